@@ -302,15 +302,14 @@ class DataCollectionApp:
         self.update_timer.start(500)    # 每500ms更新一次计数
         self.flush_timer.start(1000)    # 每1000ms保存一次数据
 
-    def handle_emg_signal(self, emg, moving):
+    def handle_emg_signal(self, block):
         """
-                处理来自Myo设备的EMG信号
+                处理来自Myo设备的EMG数据块
 
                 参数：
-                    emg: 肌电信号数据
-                    moving: 是否检测到移动
+                    block: (N, 8)的肌电信号数组
                 """
-        self.emg_handler(emg, moving)
+        self.emg_handler(block)
 
     def connect_to_myo(self):
         """连接或断开Myo设备"""
@@ -1,4 +1,5 @@
 # config.py
+import os
 
 # 文件路径配置
 GESTURE_FILE = "gesture.txt"          # 手势数据文件
@@ -7,10 +8,29 @@ SENSOR_DATA_FILE = "sensor_data.txt"  # 传感器数据文件
 # Myo设备配置
 MYO_CONNECTION_TIMEOUT = 10           # 连接超时(秒)
 MYO_SAMPLING_RATE = 50                # 采样率(Hz)
+MYO_TTY = os.environ.get("MYO_TTY")   # 蓝牙适配器串口(None为自动检测, 回放时设为pty路径)
+MYO_CAPTURE_FILE = os.environ.get("MYO_CAPTURE_FILE")  # 录制串口字节流的文件(None为不录制)
+MYO_CACHE_FILE = os.environ.get("MYO_CACHE_FILE", "myo_cache.json")  # 设备缓存(地址/固件/连接参数), 用于快速重连
+MYO_BACKPRESSURE = os.environ.get("MYO_BACKPRESSURE", "drop_oldest")  # 处理跟不上时的策略: drop_oldest/decimate/pause_imu
+MYO_CONN_PROFILE = os.environ.get("MYO_CONN_PROFILE") or None  # 连接参数配置: low_latency/balanced/low_power(None为缓存的参数)
+MYO_STATS_INTERVAL = float(os.environ.get("MYO_STATS_INTERVAL", "0")) or None  # 链路统计日志间隔(秒), 0为不打印
+MYO_SOURCE = os.environ.get("MYO_SOURCE", "myo")  # 数据源: myo(真实臂环)/replay(回放data/*.dat)/mixture(按data/*.dat拟合生成)
+MYO_SYNTHETIC_SPEED = float(os.environ.get("MYO_SYNTHETIC_SPEED", "1"))  # 合成数据源相对50Hz实时的倍数
+MYO_NATIVE_LOOP = os.environ.get("MYO_NATIVE_LOOP", "0") == "1"  # 连接后由C++线程接管串口完成解析/分类/平滑(需要新编译的libknn.so)
 
 # 分类器参数
 K = 15                             # KNN的K值
 SUBSAMPLE = 3                         # 降采样系数
+KNN_INDEX = os.environ.get("KNN_INDEX", "brute")  # 近邻搜索方式: brute(逐个比较)/kdtree(KD树, 结果相同, 样本多时更快)/pq(近似, 省内存)
+KNN_PROBES = int(os.environ.get("KNN_PROBES", "8"))  # pq每次查询扫描的倒排列表数(越大召回率越高、越慢)
+KNN_PQ_BYTES = int(os.environ.get("KNN_PQ_BYTES", "8"))  # pq每个样本的编码字节数: 8(召回率高)/4(更省内存)
+KNN_THREADS = int(os.environ.get("KNN_THREADS", "1"))  # 分类线程数: 开发板上为1, 离线评估时0为全部核心
+
+# 运动门控: 手臂快速运动时EMG主要是运动伪迹, 暂停分类并保持上一个稳定手势
+MOTION_GATE = False                   # 是否启用(需要IMU数据流, 默认只用EMG)
+GYRO_GATE_HIGH = 150.0                # 角速度超过该值(度/秒)时暂停分类
+GYRO_GATE_LOW = 60.0                  # 角速度低于该值持续GYRO_GATE_HOLD秒后恢复分类
+GYRO_GATE_HOLD = 0.2                  # 恢复前须保持静止的时间(秒)
 
 #UDP参数
 UDP_IP = "192.168.85.32"  # ROS主机IP
@@ -20,6 +40,4 @@ SEND_FREQ = 50.0  # 发送频率(Hz) - 50Hz
 #数据缓冲区
 BUFFER_SIZE = 50  # 缓冲50个数据点后再写入文件
 
-PROCESS_INTERVAL=0.02 # 处理接收间隔(50Hz)
-STORE_INTERVAL = 0.02  # 两次存储之间的最小间隔
 FLUSH_INTERVAL = 1.0  # 每1秒刷新一次缓冲区到文件
\ No newline at end of file
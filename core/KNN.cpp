@@ -11,11 +11,116 @@
 #include <ctime>
 #include <random>
 #include <cstring> // 用于memcpy
+#include <numeric>
+#include <atomic>
+#include <thread>
+#include <mutex>
+#include <condition_variable>
+#include <functional>
+#include <memory>
+#include <cerrno>
+#include <poll.h>
+#include <unistd.h>
+
+// 编译(原生循环和多线程分类需要-pthread):
+//   $CXX -fPIC -shared -O3 -std=c++17 -march=loongarch64 -pthread -o libknn.so KNN.cpp
+
+// 近邻搜索方式
+enum KNNIndex {
+    INDEX_BRUTE = 0,    // 逐个比较所有样本
+    INDEX_KDTREE = 1,   // KD树(精确, 结果与逐个比较相同)
+    INDEX_PQ = 2,       // 倒排列表+乘积量化(近似, 每个样本4或8字节, 用于数百万样本的合并数据集)
+};
+
+// 常驻线程池: run()把count个任务分给工作线程和调用线程, 全部完成后返回。
+// 工作线程在两次run之间阻塞等待, 不占用CPU
+class ThreadPool {
+public:
+    explicit ThreadPool(int workers) : job(nullptr), tasks(0), next(0), pending(0), generation(0), stopping(false) {
+        for (int i = 0; i < workers; ++i) {
+            threads.emplace_back([this] { work(); });
+        }
+    }
+    
+    ~ThreadPool() {
+        {
+            std::lock_guard<std::mutex> lock(mutex);
+            stopping = true;
+        }
+        wake.notify_all();
+        for (std::thread& t : threads) {
+            t.join();
+        }
+    }
+    
+    // 线程总数(含调用线程)
+    size_t size() const {
+        return threads.size() + 1;
+    }
+    
+    // 执行fn(0) ... fn(count - 1), 各线程动态领取任务; 多个调用者同时调用时依次执行
+    void run(size_t count, const std::function<void(size_t)>& fn) {
+        std::lock_guard<std::mutex> serial(run_mutex);
+        {
+            std::lock_guard<std::mutex> lock(mutex);
+            job = &fn;
+            tasks = count;
+            next = 0;
+            pending = threads.size();
+            generation++;
+        }
+        wake.notify_all();
+        drain();
+        // 等所有工作线程都离开本轮任务后才返回, fn和任务计数器才能安全地被下一轮替换
+        std::unique_lock<std::mutex> lock(mutex);
+        done.wait(lock, [this] { return pending == 0; });
+        job = nullptr;
+    }
+    
+private:
+    void drain() {
+        for (size_t i = next.fetch_add(1); i < tasks; i = next.fetch_add(1)) {
+            (*job)(i);
+        }
+    }
+    
+    void work() {
+        uint64_t seen = 0;
+        while (true) {
+            {
+                std::unique_lock<std::mutex> lock(mutex);
+                wake.wait(lock, [&] { return stopping || generation != seen; });
+                if (stopping) {
+                    return;
+                }
+                seen = generation;
+            }
+            drain();
+            std::lock_guard<std::mutex> lock(mutex);
+            if (--pending == 0) {
+                done.notify_one();
+            }
+        }
+    }
+    
+    std::vector<std::thread> threads;
+    std::mutex run_mutex;
+    std::mutex mutex;
+    std::condition_variable wake, done;
+    const std::function<void(size_t)>* job;
+    size_t tasks;
+    std::atomic<size_t> next;
+    size_t pending;         // 还没完成本轮的工作线程数
+    uint64_t generation;    // 每次run加1, 工作线程据此发现新任务
+    bool stopping;
+};
 
 class KNNTrainer {
 public:
-    KNNTrainer(int k = 15, int max_samples = 1500)
-        : k(k), max_samples(max_samples), trained(false) {}
+    // max_samples <= 0 时保留每个手势的全部样本
+    KNNTrainer(int k = 15, int max_samples = 1500, int index = INDEX_BRUTE)
+        : k(k), max_samples(max_samples), index(index), probes(8), trained(false), stride(0), max_value(0),
+          pq_m(8), nlist(0), ksub(0), threads(1) {}
     //若想修改K的值
     void set_k(int new_k) {
         if (new_k > 0) {
@@ -24,10 +129,80 @@ public:
             std::cerr << "警告: k值必须为正数，保持原值" << std::endl;
         }
     }
+    // PQ: 每次查询扫描的倒排列表数, 越大召回率越高、越慢
+    void set_probes(int new_probes) {
+        if (new_probes > 0) {
+            probes = new_probes;
+        } else {
+            std::cerr << "警告: 扫描列表数必须为正数，保持原值" << std::endl;
+        }
+    }
+    
+    // 分类使用的线程数(含调用线程), <=0为全部核心; 1为单线程, 不创建线程池。返回实际线程数
+    // 不要与分类同时调用
+    int set_threads(int n) {
+        if (n <= 0) {
+            n = static_cast<int>(std::max(1u, std::thread::hardware_concurrency()));
+        }
+        if (n != threads) {
+            pool.reset(n > 1 ? new ThreadPool(n - 1) : nullptr);
+            threads = n;
+        }
+        return threads;
+    }
+    
+    // PQ: 每个样本的编码字节数, 4(每个子空间2个通道, 更省内存)或8(每个通道单独量化, 召回率更高);
+    // 在加载数据前设置
+    bool set_pq_bytes(int bytes) {
+        if (bytes != 4 && bytes != 8) {
+            std::cerr << "警告: PQ编码字节数只能是4或8，保持原值" << std::endl;
+            return false;
+        }
+        if (trained && index == INDEX_PQ && bytes != pq_m) {
+            std::cerr << "错误: PQ索引不保存原始样本, 请在加载数据前设置编码字节数" << std::endl;
+            return false;
+        }
+        pq_m = bytes;
+        return true;
+    }
+    
+    // 切换近邻搜索方式, 已加载数据时按新方式重建
+    bool set_index(int new_index) {
+        if (new_index != INDEX_BRUTE && new_index != INDEX_KDTREE && new_index != INDEX_PQ) {
+            std::cerr << "警告: 未知的索引类型 " << new_index << ", 保持原值" << std::endl;
+            return false;
+        }
+        if (trained && index == INDEX_PQ) {
+            if (new_index == INDEX_PQ) {
+                return true;
+            }
+            // PQ只保存量化编码, 原始样本已释放
+            std::cerr << "错误: PQ索引不保存原始样本, 请重新加载数据后再切换" << std::endl;
+            return false;
+        }
+        index = new_index;
+        if (trained) {
+            // 按加载顺序恢复按行暂存的样本, 再重新整理
+            size_t n = labels.size();
+            rows.assign(n * 8, 0);
+            std::vector<uint8_t> loaded_labels(n);
+            for (size_t i = 0; i < n; ++i) {
+                for (int j = 0; j < 8; ++j) {
+                    rows[static_cast<size_t>(order[i]) * 8 + j] = columns[j * stride + i];
+                }
+                loaded_labels[order[i]] = labels[i];
+            }
+            labels = std::move(loaded_labels);
+            train();
+        }
+        return true;
+    }
+    
     void load_data(const std::string& base_path) {
-        samples.clear();
+        rows.clear();
         labels.clear();
-        squared_norms.clear();
+        columns.clear();
+        trained = false;
         
         for (int gesture_id = 0; gesture_id < 10; ++gesture_id) {
             std::string filename = base_path + "/vals" + std::to_string(gesture_id) + ".dat";
@@ -56,10 +231,10 @@ public:
             
             // 读取所有数据
             std::vector<uint16_t> data(8 * num_samples);
-            file.read(reinterpret_cast<char*>(data.data()), static_cast<std::streamsize>(size));
+            file.read(reinterpret_cast<char*>(data.data()), static_cast<std::streamsize>(8 * num_samples * sizeof(uint16_t)));
             
             // 限制样本数量（最大1500）
-            if (num_samples > max_samples) {
+            if (max_samples > 0 && num_samples > static_cast<size_t>(max_samples)) {
                 // 使用高质量的随机选择
                 std::vector<uint16_t> selected;
                 selected.reserve(max_samples * 8);
@@ -70,7 +245,7 @@ public:
                 std::uniform_int_distribution<size_t> dis(0, num_samples - 1);
                 
                 // 随机选择1500个样本
-                for (size_t i = 0; i < max_samples; ++i) {
+                for (size_t i = 0; i < static_cast<size_t>(max_samples); ++i) {
                     size_t idx = dis(gen);
                     for (int j = 0; j < 8; ++j) {
                         selected.push_back(data[idx * 8 + j]);
@@ -80,117 +255,986 @@ public:
                 num_samples = max_samples;
             }
             
-            // 添加样本和标签
-            for (size_t i = 0; i < num_samples; ++i) {
-                samples.push_back(std::vector<uint16_t>(data.begin() + i * 8, data.begin() + (i + 1) * 8));
-                labels.push_back(gesture_id);
-            }
+            // 添加样本和标签(暂存为按行排列, train()中转为按列存储)
+            rows.insert(rows.end(), data.begin(), data.begin() + num_samples * 8);
+            labels.insert(labels.end(), num_samples, gesture_id);
             
             std::cout << "加载手势 " << gesture_id << " 的样本: " << num_samples << " 个" << std::endl;
         }
         
-        if (!samples.empty()) {
-            train(); // 预计算范数
+        if (!labels.empty()) {
+            train(); // 转为按列存储
             trained = true;
-            std::cout << "总共加载 " << samples.size() << " 个样本用于分类" << std::endl;
+            std::cout << "总共加载 " << labels.size() << " 个样本用于分类" << std::endl;
         } else {
             std::cerr << "错误: 没有加载任何训练数据!" << std::endl;
         }
     }
     
+    // 把按行暂存的样本转为按列连续存储: 第j个通道的所有样本在columns[j * stride, j * stride + n)中,
+    // 距离计算对每个通道是一个连续的整数循环, 编译器可以自动向量化(x86-64 SSE/AVX, LoongArch LSX/LASX)
+    // 使用KD树时先建树, 样本按叶节点顺序存储, 每个叶节点是一段连续的样本, 用同一个距离循环扫描
+    // 使用PQ时只保存量化编码, 不保存按列存储的原始样本
     void train() {
-        squared_norms.resize(samples.size());
+        size_t n = labels.size();
+        order.resize(n);
+        std::iota(order.begin(), order.end(), 0);
+        nodes.clear();
+        columns.clear();
+        codes.clear();
+        stride = 0;
+        if (index == INDEX_PQ) {
+            train_pq();
+            rows.clear();
+            rows.shrink_to_fit();
+            return;
+        }
+        if (index == INDEX_KDTREE) {
+            build(0, n);
+        }
         
-        // 手动优化循环（无OpenMP）
-        for (size_t i = 0; i < samples.size(); ++i) {
-            const auto& sample = samples[i];
-            double norm_sq = 0.0;
-            
-            // 手动循环展开（优化计算）
-            for (int j = 0; j < 8; j++) {
-                uint16_t val = sample[j];
-                norm_sq += static_cast<double>(val) * val;
+        stride = (n + 15) & ~static_cast<size_t>(15);  // 每列按16个元素对齐
+        columns.assign(8 * stride, 0);
+        std::vector<uint8_t> stored_labels(n);
+        max_value = 0;
+        for (size_t i = 0; i < n; ++i) {
+            size_t src = order[i];
+            for (int j = 0; j < 8; ++j) {
+                uint16_t val = rows[src * 8 + j];
+                columns[j * stride + i] = val;
+                max_value = std::max(max_value, val);
             }
-            
-            squared_norms[i] = norm_sq;
+            stored_labels[i] = labels[src];
         }
+        labels = std::move(stored_labels);
+        rows.clear();
+        rows.shrink_to_fit();
+        if (index == INDEX_KDTREE) {
+            std::cout << "KD树: " << nodes.size() << " 个节点" << std::endl;
+        }
+    }
+    
+    // 训练数据和索引占用的内存(字节)
+    size_t memory_bytes() const {
+        return columns.size() * sizeof(uint16_t) + labels.size() * sizeof(uint8_t) + order.size() * sizeof(uint32_t) +
+               nodes.size() * sizeof(KDNode) + coarse.size() * sizeof(float) + codebooks.size() * sizeof(float) +
+               list_offsets.size() * sizeof(uint32_t) + codes.size();
     }
     
     std::pair<int, float> classify(const std::vector<uint16_t>& query) const {
-        if (!trained || samples.empty()) {
-            return {0, 0.0f};
+        return classify(query.data());
+    }
+    
+    // 对8维查询分类(直接读取调用者的数组, 不复制)
+    std::pair<int, float> classify(const uint16_t* query) const {
+        int prediction;
+        float confidence;
+        classify_batch(query, 1, &prediction, &confidence);
+        return {prediction, confidence};
+    }
+    
+    // 批量分类: queries为n行8列的uint16数组, 结果写入调用者提供的predictions/confidences
+    // (可为nullptr), neighbors不为nullptr时写入每个查询的k个近邻的加载序号(n * k, 不足k个时为-1)
+    // 每次取TILE个查询, 每个训练样本块只读一次(留在L1缓存中)就与这些查询全部比较;
+    // 近邻表和距离缓冲区使用每个线程的临时缓冲区, 分类时不分配内存。
+    // 有线程池时多组查询分给各线程; 只有一组查询时逐个比较的样本分片给各线程扫描后合并,
+    // 结果与单线程完全相同
+    void classify_batch(const uint16_t* queries, size_t n, int* predictions, float* confidences,
+                        int32_t* neighbors = nullptr) const {
+        if (!trained || labels.empty()) {
+            if (predictions != nullptr) {
+                std::fill(predictions, predictions + n, 0);
+                std::fill(confidences, confidences + n, 0.0f);
+            }
+            if (neighbors != nullptr) {
+                std::fill(neighbors, neighbors + n * k, -1);
+            }
+            return;
+        }
+        size_t tiles = (n + TILE - 1) / TILE;
+        if (pool && tiles > 1) {
+            pool->run(tiles, [&](size_t t) {
+                size_t tile = t * TILE;
+                classify_tile(queries, tile, std::min(TILE, n - tile), predictions, confidences, neighbors, false);
+            });
+            return;
         }
+        bool shard = pool && index == INDEX_BRUTE && labels.size() >= SHARD_MIN_SAMPLES * pool->size();
+        for (size_t tile = 0; tile < n; tile += TILE) {
+            classify_tile(queries, tile, std::min(TILE, n - tile), predictions, confidences, neighbors, shard);
+        }
+    }
+    
+private:
+    static constexpr size_t BLOCK = 256;   // 每块计算的样本数
+    static constexpr size_t TILE = 16;     // 批量分类时每次一起比较的查询数
+    static constexpr size_t LEAF_SIZE = 32;  // KD树叶节点的最大样本数
+    static constexpr size_t SHARD_MIN_SAMPLES = 32768;  // 单组查询分片扫描时每个线程至少分到的样本数
+    // PQ: 8个通道分为pq_m(4或8)个子空间, 每个子空间用最多PQ_KSUB个码字的码本量化为1字节
+    static constexpr size_t PQ_KSUB = 256;
+    static constexpr size_t PQ_MAX_LISTS = 1024;        // 倒排列表数上限(列表数取样本数的平方根)
+    static constexpr size_t PQ_TRAIN_SAMPLES = 65536;   // 训练聚类中心时最多使用的样本数
+    static constexpr int PQ_ITERS = 10;                 // k-means迭代次数
+    
+    // KD树节点: 内部节点按split_dim通道的split值划分, 左子树的值都<=split, 右子树的值都>=split;
+    // 每个节点覆盖按叶节点顺序存储的样本[begin, end)
+    struct KDNode {
+        int32_t split_dim;      // -1为叶节点
+        uint16_t split;
+        uint32_t left, right;
+        size_t begin, end;
+    };
+    
+    // 一个查询的前k个最近邻, 按距离升序
+    struct TopK {
+        uint64_t* dist;
+        size_t* index;
+        size_t count;
+    };
+    
+    // 每个线程的临时缓冲区, 重复使用
+    struct Scratch {
+        std::vector<uint64_t> best_dist;   // TILE * k
+        std::vector<size_t> best_index;    // TILE * k
+        int32_t dist32[BLOCK];
+        uint64_t dist64[BLOCK];
+        std::vector<float> coarse_dist;    // PQ: 查询到各倒排列表中心的距离
+        std::vector<uint32_t> probe;       // PQ: 按距离排序的倒排列表
+        float table[8 * PQ_KSUB];          // PQ: 查询残差到各子空间码本的距离表
+        std::vector<uint64_t> shard_dist;  // 分片扫描: 各分片的近邻表(分片数 * TILE * k)
+        std::vector<size_t> shard_index;
+        std::vector<size_t> shard_count;   // 分片数 * TILE
+    };
+    
+    static Scratch& scratch() {
+        static thread_local Scratch s;
+        return s;
+    }
+    
+    // 分类从第tile个开始的m个(不超过TILE)查询, shard为true时逐个比较的样本分片给线程池扫描
+    void classify_tile(const uint16_t* queries, size_t tile, size_t m, int* predictions, float* confidences,
+                       int32_t* neighbors, bool shard) const {
+        size_t kk = static_cast<size_t>(k);
+        Scratch& s = scratch();
+        if (s.best_dist.size() < TILE * kk) {
+            s.best_dist.resize(TILE * kk);
+            s.best_index.resize(TILE * kk);
+        }
+        const uint16_t* tq = queries + tile * 8;
+        
+        // 所有值都小于2^14时差值可用int16表示, 8个差的平方和小于2^31, 可以用int32累加;
+        // 否则差值用int32、平方和用uint64。两者都是精确的整数距离
+        uint16_t query_max = *std::max_element(tq, tq + m * 8);
+        bool narrow = std::max(max_value, query_max) < (1 << 14);
         
-        // 计算查询向量范数平方
-        double query_norm_sq = 0.0;
-        for (uint16_t val : query) {
-            query_norm_sq += static_cast<double>(val) * val;
+        TopK top[TILE];
+        for (size_t q = 0; q < m; ++q) {
+            top[q] = {s.best_dist.data() + q * kk, s.best_index.data() + q * kk, 0};
         }
         
-        // 使用优先队列存储前k个最近邻
-        using DistIndex = std::pair<double, size_t>;
-        auto comp = [](const DistIndex& a, const DistIndex& b) { 
-            return a.first < b.first;
-        };
-        std::priority_queue<DistIndex, std::vector<DistIndex>, decltype(comp)> pq(comp);
+        if (index == INDEX_KDTREE) {
+            // KD树: 每个查询单独搜索, 只扫描可能含有更近样本的叶节点
+            for (size_t q = 0; q < m; ++q) {
+                int64_t off[8] = {0};
+                if (narrow) {
+                    search<int16_t, int32_t>(0, tq + q * 8, 0, off, top[q], s.dist32);
+                } else {
+                    search<int32_t, uint32_t>(0, tq + q * 8, 0, off, top[q], s.dist64);
+                }
+            }
+        } else if (index == INDEX_PQ) {
+            for (size_t q = 0; q < m; ++q) {
+                search_pq(tq + q * 8, top[q], s);
+            }
+        } else if (shard) {
+            scan_shards(tq, m, narrow, top, s);
+        } else {
+            scan(tq, m, narrow, 0, labels.size(), top, s);
+        }
         
-        // 计算所有距离
-        for (size_t i = 0; i < samples.size(); ++i) {
-            const auto& sample = samples[i];
-            double dot_product = 0.0;
-            
-            // 手动循环展开（优化点积计算）
-            for (int j = 0; j < 8; j++) {
-                dot_product += static_cast<double>(sample[j]) * query[j];
+        for (size_t q = 0; q < m; ++q) {
+            finish(top[q], tile + q, predictions, confidences, neighbors);
+        }
+    }
+    
+    // 逐个比较样本[begin, end): 分块计算距离(距离缓冲区留在L1缓存中), 再从块中挑选近邻
+    void scan(const uint16_t* tq, size_t m, bool narrow, size_t begin, size_t end, TopK* top, Scratch& s) const {
+        for (size_t start = begin; start < end; start += BLOCK) {
+            size_t len = std::min(BLOCK, end - start);
+            for (size_t q = 0; q < m; ++q) {
+                if (narrow) {
+                    block_distances<int16_t, int32_t>(start, len, tq + q * 8, s.dist32);
+                    select(s.dist32, start, len, top[q]);
+                } else {
+                    block_distances<int32_t, uint32_t>(start, len, tq + q * 8, s.dist64);
+                    select(s.dist64, start, len, top[q]);
+                }
             }
-            
-            // 计算距离平方
-            double dist_sq = squared_norms[i] + query_norm_sq - 2 * dot_product;
-            
-            // 添加到优先队列
-            if (pq.size() < k) {
-                pq.push({dist_sq, i});
-            } else if (dist_sq < pq.top().first) {
-                pq.pop();
-                pq.push({dist_sq, i});
+        }
+    }
+    
+    // 样本按BLOCK对齐分成线程数个分片, 各线程扫描一个分片得到分片内的近邻表, 再合并到top
+    void scan_shards(const uint16_t* tq, size_t m, bool narrow, TopK* top, Scratch& s) const {
+        size_t kk = static_cast<size_t>(k);
+        size_t total = labels.size();
+        size_t shards = pool->size();
+        size_t per = ((total + shards - 1) / shards + BLOCK - 1) / BLOCK * BLOCK;
+        if (s.shard_dist.size() < shards * TILE * kk) {
+            s.shard_dist.resize(shards * TILE * kk);
+            s.shard_index.resize(shards * TILE * kk);
+            s.shard_count.resize(shards * TILE);
+        }
+        pool->run(shards, [&](size_t sh) {
+            TopK part[TILE];
+            for (size_t q = 0; q < m; ++q) {
+                size_t offset = (sh * TILE + q) * kk;
+                part[q] = {s.shard_dist.data() + offset, s.shard_index.data() + offset, 0};
+            }
+            size_t begin = std::min(total, sh * per);
+            scan(tq, m, narrow, begin, std::min(total, begin + per), part, scratch());
+            for (size_t q = 0; q < m; ++q) {
+                s.shard_count[sh * TILE + q] = part[q].count;
+            }
+        });
+        for (size_t q = 0; q < m; ++q) {
+            for (size_t sh = 0; sh < shards; ++sh) {
+                size_t offset = (sh * TILE + q) * kk;
+                for (size_t i = 0; i < s.shard_count[sh * TILE + q]; ++i) {
+                    uint64_t d = s.shard_dist[offset + i];
+                    size_t id = s.shard_index[offset + i];
+                    // 分片的近邻表按距离升序, 后面的不会更近
+                    if (top[q].count == kk && !closer(d, id, top[q].dist[kk - 1], top[q].index[kk - 1])) {
+                        break;
+                    }
+                    insert(top[q], d, id);
+                }
+            }
+        }
+    }
+    
+    // 计算[start, start + len)中每个样本到查询的距离平方
+    // Diff为差值类型, Prod为平方的类型, T为累加类型; 8个通道在一次循环中累加, 每个样本只写一次距离。
+    // 窄类型路径(int16差值, int32乘积)在SSE2和LSX上都是原生的16位乘法, 不需要32位min/max
+    template <typename Diff, typename Prod, typename T>
+    void block_distances(size_t start, size_t len, const uint16_t* query, T* dist) const {
+        const uint16_t* col[8];
+        Diff q[8];
+        for (int j = 0; j < 8; ++j) {
+            col[j] = columns.data() + j * stride + start;
+            q[j] = static_cast<Diff>(query[j]);
+        }
+        for (size_t i = 0; i < len; ++i) {
+            T sum = 0;
+            for (int j = 0; j < 8; ++j) {
+                Diff d = static_cast<Diff>(col[j][i] - q[j]);
+                sum += static_cast<Prod>(d) * static_cast<Prod>(d);
+            }
+            dist[i] = sum;
+        }
+    }
+    
+    // 部分选择: 把块中比当前第k近更近的样本插入有序的近邻表
+    // 距离相同时按加载顺序(order)取较早的样本, 使结果与样本的存储顺序和搜索方式无关
+    template <typename T>
+    void select(const T* dist, size_t start, size_t len, TopK& top) const {
+        size_t kk = static_cast<size_t>(k);
+        // 近邻表未满时接受任何距离, 否则只接受比第k近更近的样本
+        bool full = top.count == kk;
+        uint64_t threshold = full ? top.dist[kk - 1] : std::numeric_limits<uint64_t>::max();
+        // 整块都比第k近更远时跳过(求最小值的循环可以向量化, 大部分块在这里跳过)
+        T block_min = dist[0];
+        for (size_t i = 1; i < len; ++i) {
+            block_min = std::min(block_min, dist[i]);
+        }
+        if (full && static_cast<uint64_t>(block_min) > threshold) {
+            return;
+        }
+        for (size_t i = 0; i < len; ++i) {
+            uint64_t d = static_cast<uint64_t>(dist[i]);
+            if (full && !closer(d, start + i, threshold, top.index[kk - 1])) {
+                continue;
+            }
+            insert(top, d, start + i);
+            if (top.count == kk) {
+                full = true;
+                threshold = top.dist[kk - 1];
+            }
+        }
+    }
+    
+    // 距离为d的样本a是否排在距离为da的样本b之前(距离相同时按加载顺序)
+    bool closer(uint64_t da, size_t a, uint64_t db, size_t b) const {
+        return da < db || (da == db && order[a] < order[b]);
+    }
+    
+    // 把样本插入有序的近邻表: 插入位置之后的元素后移一位, 表满时挤出最远的一个
+    void insert(TopK& top, uint64_t d, size_t id) const {
+        size_t last = std::min(top.count, static_cast<size_t>(k) - 1);
+        size_t pos = last;
+        while (pos > 0 && closer(d, id, top.dist[pos - 1], top.index[pos - 1])) {
+            --pos;
+        }
+        std::copy_backward(top.dist + pos, top.dist + last, top.dist + last + 1);
+        std::copy_backward(top.index + pos, top.index + last, top.index + last + 1);
+        top.dist[pos] = d;
+        top.index[pos] = id;
+        top.count = last + 1;
+    }
+    
+    // 建立覆盖order[begin, end)的KD树节点, 返回节点编号
+    // 按跨度最大的通道在中位数处划分, 样本数不超过LEAF_SIZE或所有样本相同时为叶节点
+    uint32_t build(size_t begin, size_t end) {
+        uint32_t id = static_cast<uint32_t>(nodes.size());
+        nodes.push_back({-1, 0, 0, 0, begin, end});
+        if (end - begin <= LEAF_SIZE) {
+            return id;
+        }
+        uint16_t lo[8], hi[8];
+        std::fill(lo, lo + 8, std::numeric_limits<uint16_t>::max());
+        std::fill(hi, hi + 8, 0);
+        for (size_t i = begin; i < end; ++i) {
+            const uint16_t* row = rows.data() + static_cast<size_t>(order[i]) * 8;
+            for (int j = 0; j < 8; ++j) {
+                lo[j] = std::min(lo[j], row[j]);
+                hi[j] = std::max(hi[j], row[j]);
+            }
+        }
+        int dim = 0;
+        for (int j = 1; j < 8; ++j) {
+            if (hi[j] - lo[j] > hi[dim] - lo[dim]) {
+                dim = j;
+            }
+        }
+        if (hi[dim] == lo[dim]) {
+            return id;
+        }
+        size_t mid = begin + (end - begin) / 2;
+        std::nth_element(order.begin() + begin, order.begin() + mid, order.begin() + end,
+                         [&](size_t a, size_t b) { return rows[a * 8 + dim] < rows[b * 8 + dim]; });
+        uint16_t split = rows[static_cast<size_t>(order[mid]) * 8 + dim];   // 子节点建树会重排order, 先取出划分值
+        uint32_t left = build(begin, mid);
+        uint32_t right = build(mid, end);
+        KDNode& node = nodes[id];
+        node.split_dim = dim;
+        node.split = split;
+        node.left = left;
+        node.right = right;
+        return id;
+    }
+    
+    // KD树搜索: rd为查询到节点区域的距离平方下界, off[j]为查询在第j个通道上到区域边界的距离
+    // 先搜索查询所在一侧, 另一侧的下界不超过当前第k近的距离时才搜索(相等时可能因加载顺序胜出)
+    template <typename Diff, typename Prod, typename T>
+    void search(uint32_t id, const uint16_t* query, uint64_t rd, int64_t* off, TopK& top, T* dist) const {
+        const KDNode& node = nodes[id];
+        if (node.split_dim < 0) {
+            for (size_t start = node.begin; start < node.end; start += BLOCK) {
+                size_t len = std::min(BLOCK, node.end - start);
+                block_distances<Diff, Prod>(start, len, query, dist);
+                select(dist, start, len, top);
+            }
+            return;
+        }
+        int dim = node.split_dim;
+        int64_t d = static_cast<int64_t>(query[dim]) - node.split;
+        search<Diff, Prod>(d < 0 ? node.left : node.right, query, rd, off, top, dist);
+        
+        int64_t old = off[dim];
+        uint64_t far_rd = rd - static_cast<uint64_t>(old * old) + static_cast<uint64_t>(d * d);
+        size_t kk = static_cast<size_t>(k);
+        if (top.count < kk || far_rd <= top.dist[kk - 1]) {
+            off[dim] = d;
+            search<Diff, Prod>(d < 0 ? node.right : node.left, query, far_rd, off, top, dist);
+            off[dim] = old;
+        }
+    }
+    
+    // 写出一个查询的结果
+    void finish(const TopK& top, size_t q, int* predictions, float* confidences, int32_t* neighbors) const {
+        if (predictions != nullptr) {
+            vote(top, predictions + q, confidences + q);
+        }
+        if (neighbors != nullptr) {
+            size_t kk = static_cast<size_t>(k);
+            for (size_t i = 0; i < kk; ++i) {
+                neighbors[q * kk + i] = i < top.count ? static_cast<int32_t>(order[top.index[i]]) : -1;
+            }
+        }
+    }
+    
+    // 最近的聚类中心: centroids为按维转置存储的中心(dim * count, 第j维在[j * count, (j + 1) * count)),
+    // 先对所有中心向量化地累加距离到dist(count), 再按8路分别求最小值(可向量化)后找到其位置
+    static uint32_t nearest(const float* x, const float* centroids, size_t count, int dim, float* dist) {
+        std::fill(dist, dist + count, 0.0f);
+        for (int j = 0; j < dim; ++j) {
+            const float* c = centroids + j * count;
+            float xj = x[j];
+            for (size_t i = 0; i < count; ++i) {
+                float diff = xj - c[i];
+                dist[i] += diff * diff;
+            }
+        }
+        float lane[8];
+        std::fill(lane, lane + 8, dist[0]);
+        size_t i = 0;
+        for (; i + 8 <= count; i += 8) {
+            for (int l = 0; l < 8; ++l) {
+                lane[l] = dist[i + l] < lane[l] ? dist[i + l] : lane[l];
+            }
+        }
+        float best = *std::min_element(lane, lane + 8);
+        for (; i < count; ++i) {
+            best = std::min(best, dist[i]);
+        }
+        return static_cast<uint32_t>(std::find(dist, dist + count, best) - dist);
+    }
+    
+    // k-means聚类: data为n个dim维样本, 结果按维转置写入centroids(dim * count); 空簇重新取一个随机样本
+    static void kmeans(const float* data, size_t n, int dim, size_t count, int iters, std::mt19937& gen,
+                       std::vector<float>& centroids) {
+        std::vector<size_t> pick(n);
+        std::iota(pick.begin(), pick.end(), 0);
+        std::shuffle(pick.begin(), pick.end(), gen);
+        centroids.assign(dim * count, 0.0f);
+        for (size_t c = 0; c < count; ++c) {
+            for (int j = 0; j < dim; ++j) {
+                centroids[j * count + c] = data[pick[c] * dim + j];
             }
         }
+        std::uniform_int_distribution<size_t> dis(0, n - 1);
+        std::vector<double> sums(dim * count);
+        std::vector<size_t> counts(count);
+        std::vector<float> dist(count);
+        for (int it = 0; it < iters; ++it) {
+            std::fill(sums.begin(), sums.end(), 0.0);
+            std::fill(counts.begin(), counts.end(), 0);
+            for (size_t i = 0; i < n; ++i) {
+                uint32_t c = nearest(data + i * dim, centroids.data(), count, dim, dist.data());
+                counts[c]++;
+                for (int j = 0; j < dim; ++j) {
+                    sums[j * count + c] += data[i * dim + j];
+                }
+            }
+            for (size_t c = 0; c < count; ++c) {
+                size_t src = dis(gen);
+                for (int j = 0; j < dim; ++j) {
+                    centroids[j * count + c] = counts[c] > 0 ? static_cast<float>(sums[j * count + c] / counts[c])
+                                                             : data[src * dim + j];
+                }
+            }
+        }
+    }
+    
+    // 建立PQ索引: 用k-means得到倒排列表中心, 样本按最近的中心分到列表中(列表内保持加载顺序);
+    // 样本到中心的残差按子空间分别聚类得到码本, 每个子空间编码为最近码字的编号(1字节)
+    void train_pq() {
+        size_t n = labels.size();
+        int dsub = 8 / pq_m;
+        std::mt19937 gen(0);    // 固定种子, 同样的数据得到同样的索引
         
-        // 统计类别投票
-        std::vector<int> votes(10, 0);
-        size_t count = pq.size();
-        while (!pq.empty()) {
-            size_t idx = pq.top().second;
-            if (idx < labels.size()) { // 添加边界检查
-                int label = labels[idx];
-                if (label >= 0 && label < 10) { // 确保标签有效
-                    votes[label]++;
+        // 训练子集
+        size_t m = std::min(n, PQ_TRAIN_SAMPLES);
+        std::vector<size_t> pick(n);
+        std::iota(pick.begin(), pick.end(), 0);
+        for (size_t i = 0; i < m; ++i) {
+            std::swap(pick[i], pick[i + gen() % (n - i)]);
+        }
+        std::vector<float> sample(m * 8);
+        for (size_t i = 0; i < m; ++i) {
+            for (int j = 0; j < 8; ++j) {
+                sample[i * 8 + j] = rows[pick[i] * 8 + j];
+            }
+        }
+        
+        // 倒排列表中心
+        nlist = std::min(m, std::max<size_t>(1, std::min(PQ_MAX_LISTS, static_cast<size_t>(std::sqrt(n)))));
+        kmeans(sample.data(), m, 8, nlist, PQ_ITERS, gen, coarse);
+        std::vector<float> dist(std::max(nlist, PQ_KSUB));
+        
+        // 各子空间的残差码本
+        ksub = std::min(PQ_KSUB, m);
+        codebooks.assign(8 * ksub, 0.0f);
+        std::vector<uint32_t> sample_list(m);
+        for (size_t i = 0; i < m; ++i) {
+            sample_list[i] = nearest(sample.data() + i * 8, coarse.data(), nlist, 8, dist.data());
+        }
+        std::vector<float> residual(m * dsub), codebook;
+        for (int sub = 0; sub < pq_m; ++sub) {
+            for (size_t i = 0; i < m; ++i) {
+                for (int d = 0; d < dsub; ++d) {
+                    int j = sub * dsub + d;
+                    residual[i * dsub + d] = sample[i * 8 + j] - coarse[j * nlist + sample_list[i]];
                 }
             }
-            pq.pop();
+            kmeans(residual.data(), m, dsub, ksub, PQ_ITERS, gen, codebook);
+            std::copy(codebook.begin(), codebook.end(), codebooks.begin() + sub * dsub * ksub);
+        }
+        
+        // 所有样本分到倒排列表
+        std::vector<uint32_t> list(n);
+        list_offsets.assign(nlist + 1, 0);
+        for (size_t i = 0; i < n; ++i) {
+            float x[8];
+            for (int j = 0; j < 8; ++j) {
+                x[j] = rows[i * 8 + j];
+            }
+            list[i] = nearest(x, coarse.data(), nlist, 8, dist.data());
+            list_offsets[list[i] + 1]++;
+        }
+        for (size_t l = 0; l < nlist; ++l) {
+            list_offsets[l + 1] += list_offsets[l];
+        }
+        std::vector<uint32_t> fill(list_offsets.begin(), list_offsets.end() - 1);
+        for (size_t i = 0; i < n; ++i) {
+            order[fill[list[i]]++] = static_cast<uint32_t>(i);
+        }
+        
+        // 编码
+        codes.resize(n * pq_m);
+        std::vector<uint8_t> stored_labels(n);
+        for (size_t pos = 0; pos < n; ++pos) {
+            size_t i = order[pos];
+            for (int sub = 0; sub < pq_m; ++sub) {
+                float r[8];
+                for (int d = 0; d < dsub; ++d) {
+                    int j = sub * dsub + d;
+                    r[d] = rows[i * 8 + j] - coarse[j * nlist + list[i]];
+                }
+                codes[pos * pq_m + sub] = static_cast<uint8_t>(
+                    nearest(r, codebooks.data() + sub * dsub * ksub, ksub, dsub, dist.data()));
+            }
+            stored_labels[pos] = labels[i];
+        }
+        labels = std::move(stored_labels);
+        std::cout << "PQ索引: " << nlist << " 个倒排列表, 每个样本 " << pq_m << " 字节" << std::endl;
+    }
+    
+    // PQ搜索: 扫描离查询最近的probes个倒排列表, 用查询残差到各子空间码字的距离表(非对称距离)
+    // 查表累加近似距离。非负浮点数的位模式与数值顺序相同, 按int32交给select挑选近邻
+    void search_pq(const uint16_t* query, TopK& top, Scratch& s) const {
+        float q[8];
+        for (int j = 0; j < 8; ++j) {
+            q[j] = query[j];
+        }
+        s.coarse_dist.resize(nlist);
+        s.probe.resize(nlist);
+        std::fill(s.coarse_dist.begin(), s.coarse_dist.end(), 0.0f);
+        for (int j = 0; j < 8; ++j) {
+            const float* c = coarse.data() + j * nlist;
+            float* cd = s.coarse_dist.data();
+            for (size_t l = 0; l < nlist; ++l) {
+                float diff = q[j] - c[l];
+                cd[l] += diff * diff;
+            }
+        }
+        std::iota(s.probe.begin(), s.probe.end(), 0);
+        size_t count = std::min(static_cast<size_t>(probes), nlist);
+        const std::vector<float>& cd = s.coarse_dist;
+        std::partial_sort(s.probe.begin(), s.probe.begin() + count, s.probe.end(),
+                          [&](uint32_t a, uint32_t b) { return cd[a] < cd[b] || (cd[a] == cd[b] && a < b); });
+        
+        int dsub = 8 / pq_m;
+        for (size_t p = 0; p < count; ++p) {
+            uint32_t l = s.probe[p];
+            size_t begin = list_offsets[l], end = list_offsets[l + 1];
+            if (begin == end) {
+                continue;
+            }
+            // 距离表: table[sub * ksub + c]为查询残差在第sub个子空间到第c个码字的距离平方
+            std::fill(s.table, s.table + pq_m * ksub, 0.0f);
+            for (int sub = 0; sub < pq_m; ++sub) {
+                float* t = s.table + sub * ksub;
+                for (int d = 0; d < dsub; ++d) {
+                    int j = sub * dsub + d;
+                    float r = q[j] - coarse[j * nlist + l];
+                    const float* cb = codebooks.data() + (sub * dsub + d) * ksub;
+                    for (size_t c = 0; c < ksub; ++c) {
+                        float diff = r - cb[c];
+                        t[c] += diff * diff;
+                    }
+                }
+            }
+            if (pq_m == 4) {
+                scan_pq<4>(begin, end, top, s);
+            } else {
+                scan_pq<8>(begin, end, top, s);
+            }
+        }
+    }
+    
+    // 查表累加[begin, end)中每个样本的近似距离并挑选近邻
+    template <int M>
+    void scan_pq(size_t begin, size_t end, TopK& top, Scratch& s) const {
+        for (size_t start = begin; start < end; start += BLOCK) {
+            size_t len = std::min(BLOCK, end - start);
+            const uint8_t* code = codes.data() + start * M;
+            for (size_t i = 0; i < len; ++i) {
+                float d = 0.0f;
+                for (int sub = 0; sub < M; ++sub) {
+                    d += s.table[sub * ksub + code[i * M + sub]];
+                }
+                uint32_t bits;
+                std::memcpy(&bits, &d, sizeof(bits));
+                s.dist32[i] = static_cast<int32_t>(bits);
+            }
+            select(s.dist32, start, len, top);
+        }
+    }
+    
+    // 近邻投票: 票数最多的类别和其票数占比
+    void vote(const TopK& top, int* prediction, float* confidence) const {
+        int votes[10] = {0};
+        for (size_t i = 0; i < top.count; ++i) {
+            int label = labels[top.index[i]];
+            if (label >= 0 && label < 10) { // 确保标签有效
+                votes[label]++;
+            }
         }
         
         // 找到最多票数的类别
-        int prediction = 0;
+        int best = 0;
         int max_votes = 0;
         for (int i = 0; i < 10; ++i) {
             if (votes[i] > max_votes) {
                 max_votes = votes[i];
-                prediction = i;
+                best = i;
             }
         }
         
-        float confidence = (count > 0) ? static_cast<float>(max_votes) / count : 0.0f;
-        return {prediction, confidence};
+        *prediction = best;
+        *confidence = (top.count > 0) ? static_cast<float>(max_votes) / top.count : 0.0f;
     }
     
-private:
     int k;
-    int max_samples; // 每个手势最大样本数（设置为1500）
+    int max_samples; // 每个手势最大样本数（设置为1500, <= 0为不限制）
+    int index;       // 近邻搜索方式(KNNIndex)
+    int probes;      // PQ: 每次查询扫描的倒排列表数
     bool trained;
-    std::vector<std::vector<uint16_t>> samples;
-    std::vector<int> labels;
-    std::vector<double> squared_norms;
+    std::vector<uint16_t> rows;      // 加载过程中按行暂存的样本
+    std::vector<uint16_t> columns;   // 按列存储的样本(8 * stride)
+    std::vector<uint8_t> labels;
+    std::vector<uint32_t> order;     // 第i个存储位置的样本在加载时的序号
+    std::vector<KDNode> nodes;       // KD树(nodes[0]为根), 不使用时为空
+    size_t stride;                   // 每列的长度(样本数按16对齐)
+    uint16_t max_value;              // 训练样本中的最大值
+    int pq_m;                        // PQ: 每个样本的编码字节数(子空间数)
+    size_t nlist;                    // PQ: 倒排列表数
+    size_t ksub;                     // PQ: 每个子空间的码字数
+    std::vector<float> coarse;       // PQ: 倒排列表中心(按维转置, 8 * nlist)
+    std::vector<float> codebooks;    // PQ: 各子空间的码本(按维转置, 8 * ksub)
+    std::vector<uint32_t> list_offsets;  // PQ: 第l个列表的样本在[list_offsets[l], list_offsets[l + 1])
+    std::vector<uint8_t> codes;      // PQ: 按列表顺序存储的编码(n * pq_m)
+    int threads;                     // 分类使用的线程数
+    std::unique_ptr<ThreadPool> pool;    // threads > 1时的线程池
+};
+
+// ---------------------------------------------------------------------------
+// 原生采集+识别循环
+// 连接和配置仍由Python完成, 之后C++线程接管串口: 读取BLED112帧, 解码0x27预处理EMG和0x1c IMU,
+// 在C++中分类和平滑, 只把手势变化和抽样的传感器快照通过无锁环形缓冲区交回Python。
+
+// 交给Python的事件(与knn_cpp.NativeEvent的字段一致)
+struct NativeEvent {
+    int32_t type;           // 1: 手势变化, 2: 传感器快照, 3: 连接断开, 4: 读取错误
+    int32_t gesture;        // 平滑后的手势(type 1), 断开原因(type 3), errno(type 4)
+    float confidence;       // 最近一次分类的置信度
+    int32_t moving;         // 是否处于运动状态(运动门控)
+    double time;            // CLOCK_MONOTONIC时间(秒), 与Python的time.monotonic()一致
+    uint16_t emg[8];        // 最新的EMG采样
+};
+
+enum { EVENT_GESTURE = 1, EVENT_SNAPSHOT = 2, EVENT_DISCONNECTED = 3, EVENT_ERROR = 4 };
+
+// 单生产者单消费者无锁环形缓冲区: 采集线程写入, Python轮询读出
+class EventRing {
+public:
+    explicit EventRing(size_t capacity) : buf(capacity), head(0), tail(0) {}
+
+    bool push(const NativeEvent& e) {
+        size_t h = head.load(std::memory_order_relaxed);
+        if (h - tail.load(std::memory_order_acquire) >= buf.size()) {
+            return false;   // 已满, 丢弃新事件
+        }
+        buf[h % buf.size()] = e;
+        head.store(h + 1, std::memory_order_release);
+        return true;
+    }
+
+    size_t pop(NativeEvent* out, size_t max_events) {
+        size_t t = tail.load(std::memory_order_relaxed);
+        size_t n = std::min(head.load(std::memory_order_acquire) - t, max_events);
+        for (size_t i = 0; i < n; ++i) {
+            out[i] = buf[(t + i) % buf.size()];
+        }
+        tail.store(t + n, std::memory_order_release);
+        return n;
+    }
+
+private:
+    std::vector<NativeEvent> buf;
+    std::atomic<size_t> head;   // 下一个写入位置(只由生产者修改)
+    std::atomic<size_t> tail;   // 下一个读出位置(只由消费者修改)
+};
+
+// 原生循环参数
+struct LoopParams {
+    int classify_every;     // 每隔多少个EMG采样分类一次(50Hz下5为10Hz)
+    int snapshot_every;     // 每隔多少个EMG采样交回一次传感器快照(0为不交回)
+    int hist_len;           // 投票平滑的历史长度
+    int gate;               // 是否启用运动门控
+    double gate_high;       // 角速度超过该值(度/秒)时暂停分类
+    double gate_low;        // 角速度低于该值持续gate_hold秒后恢复
+    double gate_hold;
+};
+
+class NativeLoop {
+public:
+    NativeLoop(const KNNTrainer* classifier, int fd, int conn, const LoopParams& params, size_t capacity)
+        : classifier(classifier), fd(fd), conn(conn), params(params), ring(capacity),
+          history(params.hist_len, 0), history_pos(0), counts(10, 0), last_pose(-1),
+          confidence(0.0f), moving(false), still_since(-1.0), in_sync(true), running(true) {
+        std::memset(emg, 0, sizeof(emg));
+        for (auto& c : stats) {
+            c.store(0);
+        }
+        worker = std::thread(&NativeLoop::run, this);
+    }
+
+    ~NativeLoop() {
+        stop();
+    }
+
+    void stop() {
+        running = false;
+        if (worker.joinable()) {
+            worker.join();
+        }
+    }
+
+    size_t poll_events(NativeEvent* out, size_t max_events) {
+        return ring.pop(out, max_events);
+    }
+
+    // 统计: 字节, 帧, EMG采样, 分类次数, 门控跳过, 重新同步, 环形缓冲区丢弃, IMU采样
+    enum { BYTES, FRAMES, SAMPLES, CLASSIFIED, SKIPPED, RESYNCS, DROPPED, IMU, NUM_STATS };
+    std::atomic<uint64_t> stats[NUM_STATS];
+
+private:
+    static double now() {
+        timespec ts;
+        clock_gettime(CLOCK_MONOTONIC, &ts);
+        return ts.tv_sec + ts.tv_nsec * 1e-9;
+    }
+
+    void run() {
+        std::vector<uint8_t> buf;
+        uint8_t chunk[4096];
+        while (running) {
+            pollfd pfd = {fd, POLLIN, 0};
+            int r = ::poll(&pfd, 1, 100);   // 超时以便检查停止标志
+            if (r < 0) {
+                if (errno == EINTR) continue;
+                fail(errno);
+                return;
+            }
+            if (r == 0) continue;
+            ssize_t n = ::read(fd, chunk, sizeof(chunk));
+            if (n < 0) {
+                if (errno == EAGAIN || errno == EINTR) continue;
+                fail(errno);
+                return;
+            }
+            if (n == 0) continue;
+            stats[BYTES] += n;
+            buf.insert(buf.end(), chunk, chunk + n);
+            size_t used = parse(buf.data(), buf.size());
+            buf.erase(buf.begin(), buf.begin() + used);
+        }
+    }
+
+    void fail(int err) {
+        NativeEvent e = make_event(EVENT_ERROR);
+        e.gesture = err;
+        push(e);
+        running = false;
+    }
+
+    // 有效载荷长度表, 与pyomyo.BGAPI_SPECS相同: 非负为定长, 负数-k-1表示末尾数组长度在第k字节
+    static bool frame_spec(uint8_t typ, uint8_t cls, uint8_t cmd, int* spec) {
+        static const struct { uint8_t typ, cls, cmd; int8_t spec; } specs[] = {
+            {0x00, 0, 1, 0}, {0x00, 0, 6, 1}, {0x00, 3, 0, 3}, {0x00, 3, 1, 3}, {0x00, 3, 2, 3},
+            {0x00, 3, 7, 3}, {0x00, 4, 4, 3}, {0x00, 4, 5, 3}, {0x00, 4, 6, 3}, {0x00, 6, 2, 2},
+            {0x00, 6, 3, 3}, {0x00, 6, 4, 2}, {0x00, 6, 7, 2},
+            {0x80, 0, 0, 12}, {0x80, 0, 6, 2}, {0x80, 3, 0, 16}, {0x80, 3, 1, 6}, {0x80, 3, 2, -2},
+            {0x80, 3, 4, 3}, {0x80, 4, 0, 3}, {0x80, 4, 1, 5}, {0x80, 4, 2, -6}, {0x80, 4, 4, -4},
+            {0x80, 4, 5, -5}, {0x80, 6, 0, -11},
+        };
+        for (const auto& e : specs) {
+            if (e.typ == typ && e.cls == cls && e.cmd == cmd) {
+                *spec = e.spec;
+                return true;
+            }
+        }
+        return false;
+    }
+
+    // 解析缓冲区中的完整帧, 返回已消费的字节数
+    // 校验方式与pyomyo.FrameParser相同: 同步时按长度表校验通过即接受; 重新同步时候选帧之后还须紧跟帧起始;
+    // 失败时逐字节向后扫描重新同步
+    size_t parse(const uint8_t* b, size_t size) {
+        size_t pos = 0;
+        while (size - pos >= 4) {
+            uint8_t typ = b[pos];
+            bool valid = false;
+            int spec;
+            size_t len = b[pos + 1];
+            if ((typ == 0x00 || typ == 0x80) && frame_spec(typ, b[pos + 2], b[pos + 3], &spec)) {
+                if (spec >= 0) {
+                    valid = len == static_cast<size_t>(spec);
+                } else {
+                    size_t k = -spec - 1;       // 变长消息: 末尾数组长度在第k字节
+                    if (len > k) {
+                        if (size - pos < 5 + k) break;      // 长度字节未接收
+                        valid = len == k + 1 + b[pos + 4 + k];
+                    }
+                }
+                if (valid) {
+                    if (size - pos < 4 + len) break;        // 帧未接收完整
+                    if (!in_sync) {
+                        // 重新同步时其后须为帧起始, 避免同步到载荷中恰好像帧头的字节
+                        size_t next = pos + 4 + len;
+                        valid = next == size || b[next] == 0x80 || b[next] == 0x00;
+                    }
+                }
+            }
+            if (!valid) {
+                if (in_sync) {      // 连续丢弃记为一次重新同步
+                    in_sync = false;
+                    ++stats[RESYNCS];
+                }
+                ++pos;
+                continue;
+            }
+            in_sync = true;
+            handle_frame(typ, b[pos + 2], b[pos + 3], b + pos + 4, len);
+            pos += 4 + len;
+            ++stats[FRAMES];
+        }
+        return pos;
+    }
+
+    // 处理一个已校验长度的帧, 只读取载荷p[0, len)以内的字节
+    void handle_frame(uint8_t typ, uint8_t cls, uint8_t cmd, const uint8_t* p, size_t len) {
+        if (typ != 0x80) return;
+        if (cls == 4 && cmd == 5) {             // 属性值事件: 连接, 句柄, 类型, 长度, 值
+            if (len < 5 || len != 5u + p[4] || p[0] != conn) return;
+            uint16_t attr = p[1] | (p[2] << 8);
+            const uint8_t* v = p + 5;
+            if (attr == 0x27 && p[4] == 17) {
+                for (int i = 0; i < 8; ++i) {
+                    emg[i] = static_cast<uint16_t>(v[2 * i] | (v[2 * i + 1] << 8));
+                }
+                on_emg();
+            } else if (attr == 0x1c && p[4] == 20) {
+                double g[3];
+                for (int i = 0; i < 3; ++i) {
+                    g[i] = static_cast<int16_t>(v[14 + 2 * i] | (v[15 + 2 * i] << 8)) / 16.0;
+                }
+                on_gyro(std::sqrt(g[0] * g[0] + g[1] * g[1] + g[2] * g[2]));
+            }
+        } else if (cls == 3 && cmd == 4) {      // 连接断开: 连接, 原因
+            if (len >= 3 && p[0] == conn) {
+                NativeEvent e = make_event(EVENT_DISCONNECTED);
+                e.gesture = p[1] | (p[2] << 8);
+                push(e);
+                running = false;
+            }
+        }
+    }
+
+    // 运动门控(带滞回), 与Python的MotionGate相同
+    void on_gyro(double speed) {
+        ++stats[IMU];
+        if (!params.gate) return;
+        double t = now();
+        if (!moving) {
+            if (speed > params.gate_high) {
+                moving = true;
+                still_since = -1.0;
+            }
+        } else if (speed < params.gate_low) {
+            if (still_since < 0) {
+                still_since = t;
+            } else if (t - still_since >= params.gate_hold) {
+                moving = false;
+            }
+        } else {
+            still_since = -1.0;
+        }
+    }
+
+    void on_emg() {
+        uint64_t n = ++stats[SAMPLES];
+        if (params.snapshot_every > 0 && n % params.snapshot_every == 0) {
+            push(make_event(EVENT_SNAPSHOT));
+        }
+        if (n % params.classify_every != 0) return;
+        if (moving) {               // 手臂快速运动时跳过分类, 保持上一个稳定手势
+            ++stats[SKIPPED];
+            return;
+        }
+        ++stats[CLASSIFIED];
+        auto result = classifier->classify(emg);
+        int gesture = result.first;
+        confidence = result.second;
+
+        // 历史投票平滑, 与MyoClassifier.emg_handler相同
+        int oldest = history[history_pos];
+        counts[oldest] = std::max(0, counts[oldest] - 1);
+        counts[gesture]++;
+        history[history_pos] = gesture;
+        history_pos = (history_pos + 1) % history.size();
+        int current = static_cast<int>(std::max_element(counts.begin(), counts.end()) - counts.begin());
+        int count = counts[current];
+        if (last_pose < 0 || (count > counts[last_pose] + 3 && count > params.hist_len / 3)) {
+            last_pose = current;
+            push(make_event(EVENT_GESTURE));
+        }
+    }
+
+    NativeEvent make_event(int type) const {
+        NativeEvent e;
+        e.type = type;
+        e.gesture = last_pose;
+        e.confidence = confidence;
+        e.moving = moving ? 1 : 0;
+        e.time = now();
+        std::memcpy(e.emg, emg, sizeof(emg));
+        return e;
+    }
+
+    void push(const NativeEvent& e) {
+        if (!ring.push(e)) {
+            ++stats[DROPPED];
+        }
+    }
+
+    const KNNTrainer* classifier;
+    int fd;
+    int conn;
+    LoopParams params;
+    EventRing ring;
+    std::vector<int> history;
+    size_t history_pos;
+    std::vector<int> counts;
+    int last_pose;
+    float confidence;
+    bool moving;
+    double still_since;
+    bool in_sync;
+    uint16_t emg[8];
+    std::atomic<bool> running;
+    std::thread worker;
 };
 
 // Python接口函数
@@ -205,14 +1249,44 @@ extern "C" {
         classifier->load_data(base_path);
     }
     
-    // 对EMG数据进行分类
+    // 对EMG数据进行分类(query为8个uint16, 不复制)
     void knn_classify(KNNTrainer* classifier, const uint16_t* query, int* prediction, float* confidence) {
-        // 将C数组转换为vector
-        std::vector<uint16_t> q(query, query + 8);
-        auto result = classifier->classify(q);
+        auto result = classifier->classify(query);
         *prediction = result.first;
         *confidence = result.second;
     }
+    // 批量分类: queries为n行8列的uint16数组, 结果写入predictions[n]和confidences[n]
+    void knn_classify_batch(KNNTrainer* classifier, const uint16_t* queries, int n, int* predictions, float* confidences) {
+        if (n > 0) {
+            classifier->classify_batch(queries, static_cast<size_t>(n), predictions, confidences);
+        }
+    }
+    // 批量查找近邻: neighbors[n * k]写入每个查询的k个近邻在加载时的序号(不足k个时为-1)
+    void knn_neighbors_batch(KNNTrainer* classifier, const uint16_t* queries, int n, int32_t* neighbors) {
+        if (n > 0) {
+            classifier->classify_batch(queries, static_cast<size_t>(n), nullptr, nullptr, neighbors);
+        }
+    }
+    // 训练数据和索引占用的内存(字节)
+    uint64_t knn_memory_bytes(KNNTrainer* classifier) {
+        return classifier->memory_bytes();
+    }
+    // 设置分类使用的线程数(<=0为全部核心), 返回实际线程数
+    int knn_set_threads(KNNTrainer* classifier, int threads) {
+        return classifier->set_threads(threads);
+    }
+    // 设置PQ每个样本的编码字节数(4或8, 在加载数据前设置), 成功返回1
+    int knn_set_pq_bytes(KNNTrainer* classifier, int bytes) {
+        return classifier->set_pq_bytes(bytes) ? 1 : 0;
+    }
+    // 设置PQ每次查询扫描的倒排列表数
+    void knn_set_probes(KNNTrainer* classifier, int probes) {
+        classifier->set_probes(probes);
+    }
+    // 设置近邻搜索方式(0: 逐个比较, 1: KD树, 2: PQ), 成功返回1
+    int knn_set_index(KNNTrainer* classifier, int index) {
+        return classifier->set_index(index) ? 1 : 0;
+    }
     // 添加设置k值的函数
     void knn_set_k(KNNTrainer* classifier, int new_k) {
         classifier->set_k(new_k);
@@ -222,4 +1296,32 @@ extern "C" {
     void knn_destroy(KNNTrainer* classifier) {
         delete classifier;
     }
+
+    // 启动原生采集+识别循环, fd为已连接并配置好的适配器串口(调用者须先停止自己的读取)
+    NativeLoop* knn_loop_start(KNNTrainer* classifier, int fd, int conn, int classify_every, int snapshot_every,
+                               int hist_len, int gate, double gate_high, double gate_low, double gate_hold,
+                               int capacity) {
+        LoopParams params = {std::max(1, classify_every), snapshot_every, std::max(1, hist_len), gate,
+                             gate_high, gate_low, gate_hold};
+        return new NativeLoop(classifier, fd, conn, params, static_cast<size_t>(std::max(16, capacity)));
+    }
+
+    // 取出最多max_events个事件, 返回数量
+    int knn_loop_poll(NativeLoop* loop, NativeEvent* out, int max_events) {
+        return static_cast<int>(loop->poll_events(out, static_cast<size_t>(max_events)));
+    }
+
+    // 读取统计(最多n项, 顺序见NativeLoop::stats), 返回写入的项数
+    int knn_loop_stats(NativeLoop* loop, uint64_t* out, int n) {
+        int count = std::min(n, static_cast<int>(NativeLoop::NUM_STATS));
+        for (int i = 0; i < count; ++i) {
+            out[i] = loop->stats[i].load();
+        }
+        return count;
+    }
+
+    // 停止循环并释放(不关闭fd)
+    void knn_loop_stop(NativeLoop* loop) {
+        delete loop;
+    }
 }
\ No newline at end of file
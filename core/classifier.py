@@ -7,10 +7,14 @@ from collections import deque
 import numpy as np
 from PyQt5 import QtCore
 
-from core.knn_cpp import KNNClassifier
-from device.pyomyo import Myo, emg_mode
+from core.knn_cpp import KNNClassifier, NATIVE_GESTURE, NATIVE_SNAPSHOT, NATIVE_DISCONNECTED
+from device.pyomyo import IMU_SCALES, Myo, emg_mode
+from device.synthetic_myo import create_bt
 from device.UDP import GestureSender
-from config import SENSOR_DATA_FILE, GESTURE_FILE
+from config import (SENSOR_DATA_FILE, GESTURE_FILE, MYO_TTY, MYO_CAPTURE_FILE, MYO_CACHE_FILE,
+                    MYO_BACKPRESSURE, MYO_SOURCE, MYO_SYNTHETIC_SPEED, MYO_STATS_INTERVAL, MYO_CONN_PROFILE,
+                    MYO_SAMPLING_RATE, MYO_NATIVE_LOOP,
+                    MOTION_GATE, GYRO_GATE_HIGH, GYRO_GATE_LOW, GYRO_GATE_HOLD)
 
 
 class GestureRecognitionThread(QtCore.QThread):
@@ -76,7 +80,8 @@ class GestureRecognitionThread(QtCore.QThread):
             else:
                 self.status_signal.emit(f"警告: 训练数据目录 '{data_path}' 不存在")
             # 3. 创建Myo分类器实例
-            self.myo_classifier = MyoClassifier(self.classifier)
+            self.myo_classifier = MyoClassifier(self.classifier,
+                                                bt=create_bt(MYO_SOURCE, speed=MYO_SYNTHETIC_SPEED))
         except Exception as e:
             self.status_signal.emit(f"分类器初始化失败: {e}")
             self.running = False
@@ -107,6 +112,14 @@ class GestureRecognitionThread(QtCore.QThread):
                     time.sleep(0.5)
                     continue
 
+                # 设备掉线且自动重连失败, 回到连接流程(优先直接连接缓存的设备)
+                if not self.myo_classifier.connected:
+                    self.status_signal.emit("Myo设备连接已断开，正在重新连接...")
+                    self.connected = False
+                    self.sensor_active_signal.emit(False)
+                    self.stop_udp_sender()
+                    continue
+
                 time.sleep(0.1) # 主循环休眠
 
             except Exception as e:
@@ -197,24 +210,68 @@ class GestureRecognitionThread(QtCore.QThread):
         self.status_signal.emit("手势识别线程已停止")
 
 
+class MotionGate(object):
+    """基于陀螺仪角速度的运动门控(带滞回)
+
+    角速度超过high时进入运动状态; 低于low并持续hold秒后才回到静止状态,
+    避免在阈值附近来回切换。
+    """
+    def __init__(self, high=GYRO_GATE_HIGH, low=GYRO_GATE_LOW, hold=GYRO_GATE_HOLD):
+        self.high = high            # 进入运动状态的角速度(度/秒)
+        self.low = low              # 回到静止状态的角速度(度/秒)
+        self.hold = hold            # 恢复前须保持静止的时间(秒)
+        self.moving = False         # 当前是否处于运动状态
+        self.still_since = None     # 角速度低于low的起始时间
+        self.episodes = 0           # 进入运动状态的次数
+        self.skipped = 0            # 运动状态中跳过的分类次数
+
+    def update(self, gyro, t):
+        """输入一个陀螺仪采样(度/秒)和时间, 返回是否处于运动状态"""
+        speed = float(np.sqrt(gyro[0] * gyro[0] + gyro[1] * gyro[1] + gyro[2] * gyro[2]))
+        if not self.moving:
+            if speed > self.high:
+                self.moving = True
+                self.episodes += 1
+                self.still_since = None
+        elif speed < self.low:
+            if self.still_since is None:
+                self.still_since = t
+            elif t - self.still_since >= self.hold:
+                self.moving = False
+        else:
+            self.still_since = None
+        return self.moving
+
+    def stats(self):
+        """门控统计"""
+        return {'moving': self.moving, 'episodes': self.episodes, 'skipped': self.skipped}
+
+
 class MyoClassifier(Myo):
     """Myo设备分类器类，继承自Myo基类"""
-    def __init__(self, classifier, mode=emg_mode.PREPROCESSED, hist_len=25):
+    def __init__(self, classifier, mode=emg_mode.PREPROCESSED, hist_len=25, motion_gate=MOTION_GATE, bt=None,
+                 native=MYO_NATIVE_LOOP):
         """
                 初始化Myo分类器
                 参数:
                     classifier: KNN分类器实例
                     mode: EMG数据模式
                     hist_len: 历史记录长度
+                    motion_gate: 是否在手臂快速运动时暂停分类
+                    bt: 蓝牙实例(None为打开真实适配器, 合成设备见device.synthetic_myo.create_bt)
+                    native: 连接后是否由C++循环接管串口(只支持预处理EMG模式和真实适配器)
                 """
-        super().__init__(mode=mode)
+        # 合成设备不写入设备缓存, 避免之后连接真实臂环时先尝试合成设备的地址
+        super().__init__(tty=MYO_TTY, mode=mode, bt=bt, capture=MYO_CAPTURE_FILE,
+                         cache=MYO_CACHE_FILE if bt is None else None, backpressure=MYO_BACKPRESSURE,
+                         stats_interval=MYO_STATS_INTERVAL)
         self.classifier = classifier    # KNN分类器
         self.hist_len = hist_len        # 历史记录长度
         self.history = deque([0] * self.hist_len, self.hist_len) # 手势历史队列
         self.history_cnt = np.zeros(10, dtype=np.int32)   # 手势计数数组
         self.last_pose = None                   # 最后识别的手势
         self.last_confidence = 0.0              # 最后识别的置信度
-        self.add_emg_handler(self.emg_handler)  # 添加EMG数据处理器
+        self.add_emg_block_handler(self.emg_handler)  # 添加EMG数据块处理器
         self.last_print_time = time.time()      # 最后打印时间
         self.connected = False                  # 连接状态
         self.last_classify_time = 0             # 最后分类时间
@@ -226,13 +283,19 @@ class MyoClassifier(Myo):
         self.run_thread = None                  # 运行线程
         self.sensor_write_interval = 0.2        # 传感器数据写入间隔
         self.last_sensor_write_time = 0         # 最后传感器数据写入时间
-
+        self.motion_gate = None                 # 运动门控
+        if motion_gate:
+            self.motion_gate = MotionGate()
+            self.add_imu_handler(self.imu_handler)  # 开启IMU数据流
+        self.native = native and mode == emg_mode.PREPROCESSED  # 是否使用C++采集+识别循环
+        self.native_loop = None                 # 运行中的C++循环
 
     def connect(self):
         """连接Myo设备"""
         try:
-            super().connect()# 调用父类连接方法
+            super().connect(profile=MYO_CONN_PROFILE)# 调用父类连接方法
             self.connected = True
+            self.start_native()
             # 创建并启动设备运行线程
             self.run_thread = threading.Thread(target=self.run_thread_func, daemon=True)
             self.run_thread.start()
@@ -253,11 +316,73 @@ class MyoClassifier(Myo):
         except:
             pass
 
+    def start_native(self):
+        """连接和配置完成后把串口交给C++循环, 不支持时继续使用Python处理器"""
+        if not self.native or not hasattr(self.bt, 'pause_reader') or not self.classifier.has_loop:
+            return False
+        fd = self.bt.pause_reader()
+        self.native_loop = self.classifier.start_loop(
+            fd, self.conn,
+            classify_every=max(1, int(round(self.classify_interval * MYO_SAMPLING_RATE))),
+            snapshot_every=max(1, int(round(self.sensor_write_interval * MYO_SAMPLING_RATE))),
+            hist_len=self.hist_len, gate=self.motion_gate is not None)
+        print("C++采集+识别循环已启动")
+        return True
+
+    def stop_native(self):
+        """停止C++循环并恢复Python读线程"""
+        if self.native_loop is None:
+            return
+        self.native_loop.stop()
+        print(f"C++循环统计: {self.native_loop.stats()}")
+        self.native_loop = None
+        self.bt.resume_reader()
+
+    def run_native(self):
+        """处理C++循环交回的手势变化和传感器快照"""
+        events = self.native_loop.poll()
+        if not events:
+            time.sleep(0.02)
+            return
+        for e in events:
+            if e.type == NATIVE_GESTURE:
+                self.last_pose = e.gesture
+                self.last_confidence = e.confidence
+                self.update_gesture_file(e.gesture, e.confidence)
+            elif e.type == NATIVE_SNAPSHOT:
+                self.last_emg = np.array(e.emg, dtype=np.uint16)
+                try:
+                    with open(SENSOR_DATA_FILE, 'w') as f:
+                        f.write(" ".join(str(v) for v in e.emg))
+                except Exception as ex:
+                    print(f"写入传感器数据失败: {ex}")
+            else:
+                # 连接断开或串口错误: 交还串口, 按Python路径重连
+                self.stop_native()
+                if e.type == NATIVE_DISCONNECTED:
+                    print('connection lost: 0x%04x' % e.gesture)
+                    self.conn = None
+                    self.on_disconnect(e.gesture)
+                else:
+                    print(f"C++循环读取错误: errno {e.gesture}")
+                    self.conn = None
+                return
+
     def run_thread_func(self):
         """设备运行线程函数"""
         while self.connected:
             try:
-                super().run()# 调用父类运行方法
+                if self.native_loop is not None:
+                    self.run_native()
+                else:
+                    super().run()# 调用父类运行方法
+                if self.conn is None and self.connected:
+                    # 设备掉线: 直接重连上次的设备, 失败时交给识别线程重新连接
+                    print("Myo设备掉线，正在重连...")
+                    if not self.reconnect(reset=True):
+                        self.connected = False
+                    else:
+                        self.start_native()
             except Exception as e:
                 print(f"设备运行错误: {e}")
                 self.connected = False
@@ -270,21 +395,22 @@ class MyoClassifier(Myo):
                 # 等待线程结束(最多1秒)
                 if self.run_thread and self.run_thread.is_alive():
                     self.run_thread.join(timeout=1.0)
+                self.stop_native()  # 交还串口后才能发送断开命令
                 super().disconnect()# 调用父类断开方法
         except Exception as e:
             print(f"断开连接错误: {e}")
         finally:
             print("Myo设备已断开连接")
 
-    def emg_handler(self, emg, moving):
-        # EMG数据处理器
+    def imu_handler(self, quat, acc, gyro):
+        # IMU数据处理器, 用陀螺仪角速度更新运动门控
+        scale = IMU_SCALES['gyro']
+        self.motion_gate.update((gyro[0] / scale, gyro[1] / scale, gyro[2] / scale), time.monotonic())
+
+    def emg_handler(self, block, stamps):
+        # EMG数据块处理器, 只使用块内最新的采样
         current_time = time.time()
-        try:
-            # 确保emg是有效的8维数据
-            if not isinstance(emg, (list, np.ndarray)) or len(emg) != 8:
-                emg = list(emg)
-        except:
-            emg = [0] * 8
+        emg = block[-1]
 
         self.last_emg = emg # 保存最后EMG数据
         # 定期写入传感器数据到文件
@@ -298,11 +424,14 @@ class MyoClassifier(Myo):
         # 控制分类频率
         if current_time - self.last_classify_time < self.classify_interval: return
         self.last_classify_time = current_time
+        # 手臂快速运动时跳过分类, 保持上一个稳定手势
+        if self.motion_gate is not None and self.motion_gate.moving:
+            self.motion_gate.skipped += 1
+            return
 
         try:
             # 1. 使用KNN分类器进行分类
-            emg_array = np.array(emg, dtype=np.int32)
-            gesture_id, confidence = self.classifier.classify(emg_array)
+            gesture_id, confidence = self.classifier.classify(emg)
             # 2. 更新手势历史记录
             oldest = self.history[0]
             self.history_cnt[oldest] = max(0, self.history_cnt[oldest] - 1)
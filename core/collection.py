@@ -1,13 +1,15 @@
 #collection.py
 import os
-import struct
 import time
 
 import numpy as np
 from PyQt5.QtCore import pyqtSignal, QThread
 
-from config import K, SUBSAMPLE, BUFFER_SIZE,PROCESS_INTERVAL,FLUSH_INTERVAL,STORE_INTERVAL
+from config import K, SUBSAMPLE, BUFFER_SIZE,FLUSH_INTERVAL
+from config import MYO_TTY, MYO_CAPTURE_FILE, MYO_CACHE_FILE, MYO_BACKPRESSURE, MYO_SOURCE, MYO_SYNTHETIC_SPEED
+from config import MYO_STATS_INTERVAL, MYO_CONN_PROFILE
 from device.pyomyo import emg_mode, Myo
+from device.synthetic_myo import create_bt
 
 
 class DataManager(object):
@@ -35,20 +37,22 @@ class DataManager(object):
 
         self.read_data()
 
-        self.last_store_time = 0
-        self.store_interval = STORE_INTERVAL  # 两次存储之间的最小间隔
         self.last_flush_time = time.time()
         self.flush_interval = FLUSH_INTERVAL  # 每1秒刷新一次缓冲区到文件
 
-    def store_data(self, cls, vals):
-        """存储数据到缓冲区，减少文件写入频率"""
+    def store_block(self, cls, block):
+        """
+        存储EMG数据块到缓冲区
+
+        参数:
+            cls: 手势类别(0-9)
+            block: (N, 8)的EMG数据数组
+        """
         current_time = time.time()
 
-        # 添加到缓冲区
-        self.data_buffers[cls].append(vals)
-        self.counts[cls] += 1
+        self.data_buffers[cls].extend(np.asarray(block, dtype=np.uint16))
+        self.counts[cls] += len(block)
 
-        # 如果缓冲区满了，或者超过刷新间隔，则写入文件
         if (len(self.data_buffers[cls]) >= BUFFER_SIZE or
                 current_time - self.last_flush_time >= self.flush_interval):
             self.flush_buffer(cls)
@@ -62,7 +66,7 @@ class DataManager(object):
             return  # 缓冲区为空，无需处理
 
         # 将缓冲区数据转换为二进制格式
-        buffer_data = b''.join(struct.pack('8H', *vals) for vals in self.data_buffers[cls])
+        buffer_data = np.asarray(self.data_buffers[cls], dtype='<u2').tobytes()
 
         # 写入文件
         with open(f'data/vals{cls}.dat', 'ab') as f:
@@ -200,7 +204,7 @@ class DataManager(object):
 class MyoWorker(QThread):
     """Myo设备工作线程(Qt线程)"""
     # 定义信号
-    emg_signal = pyqtSignal(tuple, bool)# (emg数据, 是否移动)
+    emg_signal = pyqtSignal(object)  # (N, 8)的EMG数据块
     data_stored = pyqtSignal(int)  # 当数据存储时发出手势索引
 
     def __init__(self, parent=None):
@@ -208,36 +212,33 @@ class MyoWorker(QThread):
         self.myo = None     # Myo设备实例
         self.running = False    # 线程运行标志
         self.connected = False  # 设备连接状态
-        self.last_process_time = 0  # 最后处理时间
-        self.process_interval = PROCESS_INTERVAL # 处理间隔(50Hz
 
     def connect_myo(self):
         """连接Myo设备"""
         try:
             if not self.myo:
                 # 创建Myo实例(预处理模式)
-                self.myo = Myo(mode=emg_mode.PREPROCESSED)
-            self.myo.connect()  # 连接设备
+                bt = create_bt(MYO_SOURCE, speed=MYO_SYNTHETIC_SPEED)  # None为真实臂环
+                self.myo = Myo(tty=MYO_TTY, mode=emg_mode.PREPROCESSED, bt=bt, capture=MYO_CAPTURE_FILE,
+                               cache=MYO_CACHE_FILE if bt is None else None, backpressure=MYO_BACKPRESSURE,
+                               stats_interval=MYO_STATS_INTERVAL)
+            self.myo.connect(profile=MYO_CONN_PROFILE)  # 连接设备
             self.connected = True
-            # 添加EMG数据处理器
-            self.myo.add_emg_handler(self.handle_emg)
+            # 添加EMG数据块处理器
+            self.myo.add_emg_block_handler(self.handle_emg)
             return True, "Myo设备已连接"
         except Exception as e:
             return False, f"连接Myo失败: {str(e)}"
 
-    def handle_emg(self, emg, moving):
+    def handle_emg(self, block, stamps):
         """
-        EMG数据处理函数(频率控制)
+        EMG数据块处理函数(每块发射一次信号, 不再逐个采样发射)
 
         参数:
-            emg: EMG数据(8维)
-            moving: 是否移动标志
+            block: (N, 8)的EMG数据数组
+            stamps: 每个采样的到达时间
         """
-        current_time = time.time()
-        # 控制处理频率
-        if current_time - self.last_process_time >= self.process_interval:
-            self.emg_signal.emit(tuple(emg), moving) # 发射信号
-            self.last_process_time = current_time
+        self.emg_signal.emit(block) # 发射信号
 
     def run(self):
         """线程主函数"""
@@ -274,20 +275,21 @@ class EMGHandler(object):
                 """
         self.recording = -1 # 当前记录的手势(-1表示未记录)
         self.m = m          # 主控制器
-        self.emg = (0,) * 8 # 当前EMG数据
+        self.emg = (0,) * 8 # 最新一个EMG采样
         self.recording_enabled = True   # 是否启用记录
 
-    def __call__(self, emg, moving):
+    def __call__(self, block):
         """
-                处理EMG数据(使实例可调用)
+                处理EMG数据块(使实例可调用)
 
                 参数:
-                    emg: EMG数据
-                    moving: 是否移动标志
+                    block: (N, 8)的EMG数据数组
         """
+        if len(block) == 0:
+            return
         # 如果正在记录且启用记录
-        self.emg = emg
+        self.emg = tuple(block[-1])
         if self.recording >= 0 and self.recording_enabled:
             # 存储数据并通知计数更新
-            if self.m.data_manager.store_data(self.recording, emg):
+            if self.m.data_manager.store_block(self.recording, block):
                 self.m.update_count(self.recording)
\ No newline at end of file
@@ -4,17 +4,84 @@ import os
 import numpy as np
 import time
 
-from config import K
+from config import (K, KNN_INDEX, KNN_PROBES, KNN_PQ_BYTES, KNN_THREADS, MOTION_GATE, GYRO_GATE_HIGH, GYRO_GATE_LOW,
+                    GYRO_GATE_HOLD)
+
+# 近邻搜索方式(与KNN.cpp中的KNNIndex一致)
+KNN_INDEXES = {'brute': 0, 'kdtree': 1, 'pq': 2}
+
+# 原生循环事件类型(与KNN.cpp一致)
+NATIVE_GESTURE = 1
+NATIVE_SNAPSHOT = 2
+NATIVE_DISCONNECTED = 3
+NATIVE_ERROR = 4
+
+# knn_loop_stats的统计项顺序
+NATIVE_STATS = ('bytes', 'frames', 'samples', 'classified', 'skipped', 'resyncs', 'dropped', 'imu')
+
+
+class NativeEvent(ctypes.Structure):
+    """原生循环交回的事件(与KNN.cpp中的NativeEvent布局一致)"""
+    _fields_ = [
+        ('type', ctypes.c_int32),
+        ('gesture', ctypes.c_int32),
+        ('confidence', ctypes.c_float),
+        ('moving', ctypes.c_int32),
+        ('time', ctypes.c_double),
+        ('emg', ctypes.c_uint16 * 8),
+    ]
+
+
+class NativeLoop:
+    """C++采集+识别循环的句柄, 由KNNClassifier.start_loop创建"""
+    def __init__(self, lib, obj, batch=64):
+        self.lib = lib
+        self.obj = obj
+        self.buf = (NativeEvent * batch)()
+
+    def poll(self):
+        """取出已产生的事件, 返回NativeEvent列表(副本)"""
+        if not self.obj:
+            return []
+        n = self.lib.knn_loop_poll(self.obj, self.buf, len(self.buf))
+        return [NativeEvent.from_buffer_copy(self.buf[i]) for i in range(n)]
+
+    def stats(self):
+        """返回统计字典"""
+        out = (ctypes.c_uint64 * len(NATIVE_STATS))()
+        if self.obj:
+            self.lib.knn_loop_stats(self.obj, out, len(out))
+        return dict(zip(NATIVE_STATS, out))
+
+    def stop(self):
+        """停止C++线程(不关闭串口)"""
+        if self.obj:
+            self.lib.knn_loop_stop(self.obj)
+            self.obj = None
+
+
 class KNNClassifier:
-    def __init__(self, k=K, max_samples=1500, lib_path="core/libknn.so"):
+    def __init__(self, k=K, max_samples=1500, lib_path="core/libknn.so", verbose=True, index=KNN_INDEX,
+                 probes=KNN_PROBES, pq_bytes=KNN_PQ_BYTES, threads=KNN_THREADS):
         """
         初始化C++ KNN分类器
 
         参数:
             k: KNN算法的K值（默认15）
-            max_samples: 每个类别加载的最大样本数（默认1500）
+            max_samples: 每个类别加载的最大样本数（默认1500, 0为保留全部样本）
             lib_path: C++库的路径（默认"libknn.so"）
+            verbose: 是否打印每次分类的结果和耗时（默认True）
+            index: 近邻搜索方式, brute(逐个比较), kdtree(KD树, 结果相同, 样本多时更快)
+                   或pq(倒排列表+乘积量化, 近似结果, 每个样本只占pq_bytes字节, 用于数百万样本)
+            probes: pq每次查询扫描的倒排列表数, 越大召回率越高、越慢
+            pq_bytes: pq每个样本的编码字节数, 8(召回率高)或4(更省内存)
+            threads: 分类线程数（默认1, 0为全部核心）, 批量分类按查询分给各线程,
+                     单个查询在样本多时分片扫描, 结果与单线程相同
         """
+        if index not in KNN_INDEXES:
+            raise ValueError(f"未知的索引类型: {index}, 可选: {', '.join(KNN_INDEXES)}")
+        self.verbose = verbose
+        self.k = k
         # 获取库的绝对路径
         if not os.path.isabs(lib_path):
             lib_path = os.path.abspath(lib_path)
@@ -40,19 +107,139 @@ class KNNClassifier:
             ctypes.POINTER(ctypes.c_float)
         ]
         self.lib.knn_classify.restype = None
+        # knn_classify_batch函数原型：接收void指针、N行8列uint16数组指针、N、int输出数组和float输出数组
+        # (旧版本的库没有, classify_batch改为逐个调用knn_classify)
+        self.has_batch = hasattr(self.lib, 'knn_classify_batch')
+        if self.has_batch:
+            self.lib.knn_classify_batch.argtypes = [
+                ctypes.c_void_p,
+                ctypes.POINTER(ctypes.c_uint16),
+                ctypes.c_int,
+                ctypes.POINTER(ctypes.c_int),
+                ctypes.POINTER(ctypes.c_float)
+            ]
+            self.lib.knn_classify_batch.restype = None
         # knn_destroy函数原型：接收void指针
         self.lib.knn_destroy.argtypes = [ctypes.c_void_p]
         self.lib.knn_destroy.restype = None
+        # knn_set_index函数原型：接收void指针和索引类型, 成功返回1
+        if hasattr(self.lib, 'knn_set_index'):
+            self.lib.knn_set_index.argtypes = [ctypes.c_void_p, ctypes.c_int]
+            self.lib.knn_set_index.restype = ctypes.c_int
+        # 近似搜索相关函数(旧版本的库没有这些函数)
+        self.has_ann = hasattr(self.lib, 'knn_neighbors_batch')
+        if self.has_ann:
+            self.lib.knn_set_probes.argtypes = [ctypes.c_void_p, ctypes.c_int]
+            self.lib.knn_set_probes.restype = None
+            self.lib.knn_set_pq_bytes.argtypes = [ctypes.c_void_p, ctypes.c_int]
+            self.lib.knn_set_pq_bytes.restype = ctypes.c_int
+            self.lib.knn_neighbors_batch.argtypes = [
+                ctypes.c_void_p,
+                ctypes.POINTER(ctypes.c_uint16),
+                ctypes.c_int,
+                ctypes.POINTER(ctypes.c_int32)
+            ]
+            self.lib.knn_neighbors_batch.restype = None
+            self.lib.knn_memory_bytes.argtypes = [ctypes.c_void_p]
+            self.lib.knn_memory_bytes.restype = ctypes.c_uint64
+        # knn_set_threads函数原型：接收void指针和线程数, 返回实际线程数(旧版本的库没有)
+        if hasattr(self.lib, 'knn_set_threads'):
+            self.lib.knn_set_threads.argtypes = [ctypes.c_void_p, ctypes.c_int]
+            self.lib.knn_set_threads.restype = ctypes.c_int
+        # 原生循环函数(旧版本的库没有这些函数)
+        self.has_loop = hasattr(self.lib, 'knn_loop_start')
+        if self.has_loop:
+            self.lib.knn_loop_start.argtypes = [
+                ctypes.c_void_p, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_int,
+                ctypes.c_int, ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_int
+            ]
+            self.lib.knn_loop_start.restype = ctypes.c_void_p
+            self.lib.knn_loop_poll.argtypes = [ctypes.c_void_p, ctypes.POINTER(NativeEvent), ctypes.c_int]
+            self.lib.knn_loop_poll.restype = ctypes.c_int
+            self.lib.knn_loop_stats.argtypes = [ctypes.c_void_p, ctypes.POINTER(ctypes.c_uint64), ctypes.c_int]
+            self.lib.knn_loop_stats.restype = ctypes.c_int
+            self.lib.knn_loop_stop.argtypes = [ctypes.c_void_p]
+            self.lib.knn_loop_stop.restype = None
 
         # 创建C++对象
         print(f"创建KNN分类器 (k={k}, max_samples={max_samples})")
         self.obj = self.lib.knn_create(k, max_samples)
         if not self.obj:
             raise RuntimeError("Failed to create KNN classifier object")
+        self.index = 'brute'
+        self.set_index(index)
+        if self.has_ann:
+            self.set_probes(probes)
+            if not self.lib.knn_set_pq_bytes(self.obj, pq_bytes):
+                raise ValueError(f"pq编码字节数只能是4或8: {pq_bytes}")
+        self.threads = 1
+        if threads != 1:
+            self.set_threads(threads)
 
         load_time = (time.time() - start_time) * 1000
         print(f"KNN初始化完成, 耗时: {load_time:.2f}ms")
 
+    def set_index(self, index):
+        """切换近邻搜索方式(已加载数据时在C++中重建)"""
+        if index not in KNN_INDEXES:
+            raise ValueError(f"未知的索引类型: {index}, 可选: {', '.join(KNN_INDEXES)}")
+        if index == self.index:
+            return
+        if not hasattr(self.lib, 'knn_set_index'):
+            raise RuntimeError("KNN共享库不支持索引, 请重新编译libknn.so")
+        if not self.lib.knn_set_index(self.obj, KNN_INDEXES[index]):
+            raise RuntimeError(f"设置索引失败: {index}")
+        self.index = index
+        print(f"KNN近邻搜索方式: {index}")
+
+    def set_probes(self, probes):
+        """设置pq每次查询扫描的倒排列表数(召回率/延迟的调节参数)"""
+        if not self.has_ann:
+            raise RuntimeError("KNN共享库不支持近似搜索, 请重新编译libknn.so")
+        if probes <= 0:
+            raise ValueError("扫描列表数必须为正数")
+        self.lib.knn_set_probes(self.obj, probes)
+        self.probes = probes
+
+    def set_threads(self, threads):
+        """设置分类线程数(0为全部核心), 不要在分类时调用"""
+        if not hasattr(self.lib, 'knn_set_threads'):
+            raise RuntimeError("KNN共享库不支持多线程, 请重新编译libknn.so")
+        if threads < 0:
+            raise ValueError("线程数不能为负数")
+        self.threads = self.lib.knn_set_threads(self.obj, threads)
+        print(f"KNN分类线程数: {self.threads}")
+
+    def neighbors(self, emg_block):
+        """
+        批量查找近邻
+
+        参数:
+            emg_block: (N, 8)数组
+
+        返回:
+            (N, k) int32数组, 每个查询的k个近邻在加载时的序号(按距离升序, 不足k个时为-1)
+        """
+        if not self.has_ann:
+            raise RuntimeError("KNN共享库不支持近邻查询, 请重新编译libknn.so")
+        emg_block = np.ascontiguousarray(emg_block, dtype=np.uint16)
+        if emg_block.ndim != 2 or emg_block.shape[1] != 8:
+            raise ValueError("输入数组必须是(N, 8)")
+        out = np.empty((emg_block.shape[0], self.k), dtype=np.int32)
+        self.lib.knn_neighbors_batch(
+            self.obj,
+            emg_block.ctypes.data_as(ctypes.POINTER(ctypes.c_uint16)),
+            emg_block.shape[0],
+            out.ctypes.data_as(ctypes.POINTER(ctypes.c_int32))
+        )
+        return out
+
+    def memory_bytes(self):
+        """训练数据和索引占用的内存(字节)"""
+        if not self.has_ann:
+            raise RuntimeError("KNN共享库不支持内存统计, 请重新编译libknn.so")
+        return self.lib.knn_memory_bytes(self.obj)
+
     def load_data(self, base_path):
         """从指定目录加载训练数据"""
         if not os.path.exists(base_path):
@@ -80,10 +267,10 @@ class KNNClassifier:
         """
         # 输入数据验证和转换
         if isinstance(emg_data, np.ndarray):
-            if emg_data.dtype != np.uint16:
-                emg_data = emg_data.astype(np.uint16)   # 转换为uint16类型
             if emg_data.ndim != 1 or emg_data.size != 8:
                 raise ValueError("输入数组必须是一维且包含8个元素")
+            # 连续的uint16数组直接把指针交给C++, 不复制
+            emg_data = np.ascontiguousarray(emg_data, dtype=np.uint16)
         elif isinstance(emg_data, list):
             if len(emg_data) != 8:
                 raise ValueError("输入列表必须恰好包含8个元素")
@@ -106,10 +293,88 @@ class KNNClassifier:
         classify_time = (time.time() - start_time) * 1000
 
         # 打印性能信息
-        print(f"分类完成: 手势={prediction.value}, 置信度={confidence.value:.2f}, 耗时={classify_time:.3f}ms")
+        if self.verbose:
+            print(f"分类完成: 手势={prediction.value}, 置信度={confidence.value:.2f}, 耗时={classify_time:.3f}ms")
 
         return prediction.value, confidence.value
 
+    def classify_batch(self, emg_block, predictions=None, confidences=None):
+        """
+        批量分类(一次ctypes调用; 旧版本的库没有批量函数时逐个调用knn_classify)
+
+        参数:
+            emg_block: (N, 8)数组, EMG数据块(连续的uint16数组不复制)
+            predictions: 可选的预分配int32输出数组(长度至少N)
+            confidences: 可选的预分配float32输出数组(长度至少N)
+
+        返回:
+            (predictions, confidences): 长度为N的手势ID数组和置信度数组
+        """
+        emg_block = np.ascontiguousarray(emg_block, dtype=np.uint16)
+        if emg_block.ndim != 2 or emg_block.shape[1] != 8:
+            raise ValueError("输入数组必须是(N, 8)")
+        n = emg_block.shape[0]
+        if predictions is None:
+            predictions = np.empty(n, dtype=np.int32)
+        if confidences is None:
+            confidences = np.empty(n, dtype=np.float32)
+        for out, dtype in ((predictions, np.int32), (confidences, np.float32)):
+            if out.dtype != dtype or out.ndim != 1 or out.size < n or not out.flags['C_CONTIGUOUS']:
+                raise ValueError("输出数组必须是长度至少为N的连续%s数组" % np.dtype(dtype).name)
+
+        start_time = time.time()
+        if self.has_batch:
+            self.lib.knn_classify_batch(
+                self.obj,
+                emg_block.ctypes.data_as(ctypes.POINTER(ctypes.c_uint16)),
+                n,
+                predictions.ctypes.data_as(ctypes.POINTER(ctypes.c_int)),
+                confidences.ctypes.data_as(ctypes.POINTER(ctypes.c_float))
+            )
+        else:
+            prediction = ctypes.c_int()
+            confidence = ctypes.c_float()
+            for i in range(n):
+                self.lib.knn_classify(
+                    self.obj,
+                    emg_block[i].ctypes.data_as(ctypes.POINTER(ctypes.c_uint16)),
+                    ctypes.byref(prediction),
+                    ctypes.byref(confidence)
+                )
+                predictions[i] = prediction.value
+                confidences[i] = confidence.value
+        classify_time = (time.time() - start_time) * 1000
+
+        if self.verbose:
+            print(f"批量分类完成: {n}个样本, 耗时={classify_time:.3f}ms")
+
+        return predictions[:n], confidences[:n]
+
+    def start_loop(self, fd, conn, classify_every=5, snapshot_every=10, hist_len=25, gate=MOTION_GATE,
+                   gate_high=GYRO_GATE_HIGH, gate_low=GYRO_GATE_LOW, gate_hold=GYRO_GATE_HOLD, capacity=1024):
+        """
+        启动C++采集+识别循环
+
+        参数:
+            fd: 已连接并开启0x27预处理EMG通知的适配器串口描述符(调用者须先停止自己的读取)
+            conn: BLE连接号
+            classify_every: 每隔多少个EMG采样分类一次
+            snapshot_every: 每隔多少个EMG采样交回一次传感器快照(0为不交回)
+            hist_len: 投票平滑的历史长度
+            gate: 是否按陀螺仪角速度门控分类
+            capacity: 事件环形缓冲区容量
+
+        返回:
+            NativeLoop
+        """
+        if not self.has_loop:
+            raise RuntimeError("KNN共享库不支持原生循环, 请重新编译libknn.so")
+        obj = self.lib.knn_loop_start(self.obj, fd, conn, classify_every, snapshot_every, hist_len,
+                                      int(gate), gate_high, gate_low, gate_hold, capacity)
+        if not obj:
+            raise RuntimeError("Failed to start native loop")
+        return NativeLoop(self.lib, obj)
+
     def __del__(self):
         """销毁C++对象"""
         if hasattr(self, 'obj') and self.obj:
@@ -0,0 +1,197 @@
+#multi_myo.py
+"""
+多臂环采集
+
+多个Myo共用一个适配器(多个连接句柄)或各用一个适配器, 事件由同一个队列单线程分发,
+各臂环的EMG数据块按采样时间戳对齐后合并为(N, 8*臂环数)的帧。
+"""
+import queue
+import time
+
+import numpy as np
+
+from device.pyomyo import BT, Myo, emg_mode
+
+
+class EMGAligner(object):
+	"""按时间戳对齐多路EMG数据块
+
+	以第0路为参考时间轴, 其余各路取时间最近的采样; 只输出所有路都已到达的时间范围。
+	"""
+	def __init__(self, count, tolerance=0.01, max_buffer=400):
+		"""
+		参数:
+			count: 数据路数
+			tolerance: 最近采样与参考时间相差超过该值(秒)时计为未对齐
+			max_buffer: 每路最多缓存的采样数, 某一路停顿时丢弃其他路最旧的数据
+		"""
+		self.count = count
+		self.tolerance = tolerance
+		self.max_buffer = max_buffer
+		self.data = [None] * count		# 各路缓存的采样, 数据类型与该路第一个数据块相同(int8或uint16)
+		self.times = [np.empty(0) for _ in range(count)]
+		self.handlers = []
+		self.frames = 0			# 输出的帧数
+		self.misaligned = 0		# 最近采样超出容差的次数
+		self.overflow = 0		# 因某路停顿被丢弃的采样数
+
+	def add_handler(self, h):
+		"""添加帧处理器h(frame, stamps), frame为(N, 8*count)数组"""
+		self.handlers.append(h)
+
+	def add(self, i, block, stamps):
+		"""加入第i路的数据块"""
+		if self.data[i] is None:
+			self.data[i] = np.array(block)
+		else:
+			self.data[i] = np.concatenate([self.data[i], block])
+		self.times[i] = np.concatenate([self.times[i], stamps])
+		if len(self.times[i]) > self.max_buffer:
+			drop = len(self.times[i]) - self.max_buffer
+			self.data[i] = self.data[i][drop:]
+			self.times[i] = self.times[i][drop:]
+			self.overflow += drop
+		self.emit()
+
+	def emit(self):
+		"""输出所有路都已覆盖的参考采样"""
+		times = self.times
+		if any(len(t) == 0 for t in times):
+			return
+		horizon = min(t[-1] for t in times)
+		ref = times[0]
+		k = int(np.searchsorted(ref, horizon, side='right'))
+		if k == 0:
+			return
+		ref_t = ref[:k]
+		cols = [self.data[0][:k]]
+		for i in range(1, self.count):
+			t = times[i]
+			idx = np.clip(np.searchsorted(t, ref_t), 1, len(t) - 1) if len(t) > 1 else np.zeros(k, dtype=np.intp)
+			if len(t) > 1:
+				# 取前后两个采样中较近的一个
+				prev = idx - 1
+				idx = np.where(ref_t - t[prev] <= t[idx] - ref_t, prev, idx)
+			self.misaligned += int(np.count_nonzero(np.abs(t[idx] - ref_t) > self.tolerance))
+			cols.append(self.data[i][idx])
+			# 保留最后用到的采样, 下一批参考采样可能仍然最接近它
+			keep = int(idx[-1])
+			self.data[i] = self.data[i][keep:]
+			self.times[i] = t[keep:]
+		self.data[0] = self.data[0][k:]
+		self.times[0] = ref[k:]
+
+		frame = np.hstack(cols)
+		self.frames += k
+		for h in self.handlers:
+			h(frame, ref_t)
+
+
+class MyoGroup(object):
+	"""多个Myo臂环的组合采集
+
+	ttys为None或只有一个串口时, 所有臂环共用一个适配器和读线程;
+	给出多个串口时每个适配器一个臂环, 各读线程写入同一个事件队列。
+	"""
+	def __init__(self, count=2, ttys=None, mode=emg_mode.RAW, block_size=8, max_latency=0.04,
+				 tolerance=0.01, queue_size=1024):
+		if not ttys or len(ttys) == 1:
+			tty = ttys[0] if ttys else None
+			if tty is None:
+				tty = Myo.detect_tty()
+			if tty is None:
+				raise ValueError('Myo dongle not found!')
+			bt = BT(tty, queue_size=queue_size * count)
+			self.bts = [bt]
+			self.myos = [Myo(mode=mode, bt=bt) for _ in range(count)]
+		else:
+			events = queue.Queue(queue_size * len(ttys))
+			self.bts = [BT(tty, events=events) for tty in ttys]
+			self.myos = [Myo(mode=mode, bt=bt) for bt in self.bts]
+
+		self.aligner = EMGAligner(len(self.myos), tolerance)
+		for i, m in enumerate(self.myos):
+			m.add_emg_block_handler(self.block_handler(i), block_size, max_latency)
+		self.start_time = None
+
+	def block_handler(self, i):
+		"""第i个臂环的数据块处理器"""
+		def h(block, stamps):
+			self.aligner.add(i, block, stamps)
+		return h
+
+	def add_frame_handler(self, h):
+		"""添加对齐帧处理器h(frame, stamps), frame为(N, 8*臂环数)数组"""
+		self.aligner.add_handler(h)
+
+	def connect(self, addrs=None):
+		"""依次连接各臂环, addrs为各臂环的MAC地址(None表示扫描)"""
+		reset = set()
+		connected = []
+		for i, m in enumerate(self.myos):
+			addr = addrs[i] if addrs else None
+			# 每个适配器只在连接第一个臂环时清理旧连接
+			m.connect(addr, reset=id(m.bt) not in reset, exclude=connected)
+			reset.add(id(m.bt))
+			connected.append(m.addr)
+		self.start_time = time.monotonic()
+
+	def run(self, timeout=0.1):
+		"""分发所有适配器的事件(共用一个队列), 返回分发数量"""
+		n = self.bts[0].dispatch(timeout)
+		for m in self.myos:
+			m.flush_emg_block()
+		return n
+
+	def stats(self):
+		"""各臂环的采样率、丢包统计和对齐统计"""
+		elapsed = time.monotonic() - self.start_time if self.start_time else 0.0
+		devices = []
+		for m in self.myos:
+			s = m.emg_stats()
+			s['addr'] = m.addr
+			s['rate'] = s['samples'] / elapsed if elapsed > 0 else 0.0
+			devices.append(s)
+		return {
+			'devices': devices,
+			'frames': self.aligner.frames,
+			'misaligned': self.aligner.misaligned,
+			'overflow': self.aligner.overflow,
+			'queue_dropped': sum(bt.dropped for bt in self.bts),
+		}
+
+	def disconnect(self):
+		"""断开所有臂环"""
+		for m in self.myos:
+			m.disconnect()
+
+	def close(self):
+		"""关闭所有适配器"""
+		for bt in self.bts:
+			bt.close()
+
+
+if __name__ == '__main__':
+	import sys
+
+	g = MyoGroup(count=2, ttys=sys.argv[1:] or None)
+	g.connect()
+	frames = [0]
+
+	def on_frame(frame, stamps):
+		frames[0] += len(frame)
+
+	g.add_frame_handler(on_frame)
+	last = time.monotonic()
+	try:
+		while True:
+			g.run()
+			if time.monotonic() - last >= 1.0:
+				last = time.monotonic()
+				st = g.stats()
+				print('frames/s: %d, ' % frames[0] +
+					  ', '.join('%s: %.0f Hz lost %d' % (d['addr'], d['rate'], d['lost']) for d in st['devices']))
+				frames[0] = 0
+	except KeyboardInterrupt:
+		g.disconnect()
+		g.close()
@@ -0,0 +1,373 @@
+#myo_async.py
+"""
+asyncio版Myo客户端
+
+串口文件描述符通过loop.add_reader注册到事件循环, 数据到达时在循环内解析和分发,
+采集、分类和UDP输出可以运行在同一个事件循环中, 不再需要多个线程。
+
+用法:
+	async def main():
+		myo = AsyncMyo(mode=emg_mode.RAW)
+		await myo.connect()
+		async for block, stamps in myo.emg_stream():
+			...
+"""
+import asyncio
+import time
+from collections import deque
+
+import serial
+
+from device.pyomyo import (COMMAND_TIMEOUT, CONNECT_TIMEOUT, DIRECT_CONNECT_TIMEOUT,
+						   MYO_SERVICE, MYO_VALUE_SIZES, BTError, CommandTimeout,
+						   Dispatcher, FrameParser, Myo, Throughput, emg_mode,
+						   mac_str, multichr, pack, unpack)
+
+
+class AsyncBT(Dispatcher):
+	"""asyncio版蓝牙协议实现, 须在运行中的事件循环内创建"""
+	def __init__(self, tty):
+		"""打开串口并注册到当前事件循环"""
+		Dispatcher.__init__(self)
+		self.loop = asyncio.get_running_loop()
+		# timeout=0: 非阻塞读取, 只在可读时由事件循环回调
+		self.ser = serial.Serial(port=tty, baudrate=9600, dsrdtr=1, timeout=0)
+		self.parser = FrameParser(value_sizes=MYO_VALUE_SIZES)		# 帧解析器
+		self.throughput = Throughput()	# 吞吐量统计
+		self.responses = deque()		# 等待响应的命令(cls, cmd, Future), 按发送顺序
+		self.waiters = []				# 等待特定事件的调用者
+		self.gatt_lock = asyncio.Lock()	# 属性读写过程须逐个进行
+		self.error = None
+		self.loop.add_reader(self.ser.fileno(), self.on_readable)
+
+	def on_readable(self):
+		"""串口可读回调: 读出所有待读字节, 解析并路由"""
+		try:
+			data = self.ser.read(self.ser.in_waiting or 1)
+		except serial.SerialException as e:
+			self.fail(e)
+			return
+		if not data:
+			return
+		now = time.monotonic()
+		self.parser.feed(data)
+		packets = self.parser.parse(now)
+		self.throughput.add(len(data), len(packets))
+		for p in packets:
+			self.route_packet(p)
+
+	def route_packet(self, p):
+		"""响应包按(cls, cmd)交给最早的对应命令; 事件包先交给等待者, 否则分发给处理器"""
+		if p.typ == 0:
+			# 已超时的命令已从responses移除, 其迟到的响应找不到对应命令, 直接丢弃
+			for i, (cls, cmd, fut) in enumerate(self.responses):
+				if cls == p.cls and cmd == p.cmd:
+					break
+			else:
+				return
+			for _ in range(i):		# 之前的命令适配器未响应
+				lost = self.responses.popleft()[2]
+				if not lost.done():
+					lost.set_exception(BTError('no response to command'))
+			self.responses.popleft()
+			if not fut.done():
+				fut.set_result(p)
+			return
+
+		for w in self.waiters:
+			cls, cmd, fut, match = w
+			if p.cls == cls and p.cmd == cmd and (match is None or match(p)):
+				self.waiters.remove(w)
+				if not fut.done():
+					fut.set_result(p)
+				return
+		self.handle_event(p)
+
+	def fail(self, e):
+		"""串口出错: 停止读取并唤醒所有等待者"""
+		self.error = e
+		self.loop.remove_reader(self.ser.fileno())
+		for fut in [r[2] for r in self.responses] + [w[2] for w in self.waiters]:
+			if not fut.done():
+				fut.set_exception(e)
+		self.responses.clear()
+		self.waiters = []
+
+	def expect_event(self, cls, cmd, match=None):
+		"""登记等待特定事件, 返回Future(须在发送触发命令之前调用)"""
+		if self.error is not None:
+			raise self.error
+		fut = self.loop.create_future()
+		self.waiters.append((cls, cmd, fut, match))
+		return fut
+
+	async def wait_event(self, fut, timeout=None, what='event'):
+		"""等待expect_event返回的Future, timeout秒内未发生时注销等待者并抛出CommandTimeout"""
+		try:
+			return await asyncio.wait_for(fut, timeout)
+		except asyncio.TimeoutError:
+			raise CommandTimeout('%s: not completed within %.1fs' % (what, timeout)) from None
+		finally:
+			self.cancel_wait(fut)
+
+	def cancel_wait(self, fut):
+		"""注销expect_event登记的等待者"""
+		self.waiters = [w for w in self.waiters if w[2] is not fut]
+
+	async def send_command(self, cls, cmd, payload=b'', timeout=COMMAND_TIMEOUT):
+		"""发送蓝牙命令并等待响应, timeout秒内未响应时抛出CommandTimeout"""
+		if self.error is not None:
+			raise self.error
+		fut = self.loop.create_future()
+		entry = (cls, cmd, fut)
+		self.responses.append(entry)
+		self.ser.write(pack('4B', 0, len(payload), cls, cmd) + payload)
+		try:
+			return await asyncio.wait_for(fut, timeout)
+		except asyncio.TimeoutError:
+			raise CommandTimeout('command %d.%d: no response from dongle' % (cls, cmd)) from None
+		finally:
+			# 超时或被取消的命令不再占用responses, 之后的响应不会落到它上面
+			if fut.cancelled() and entry in self.responses:
+				self.responses.remove(entry)
+
+	# 蓝牙命令实现
+	async def connect(self, addr, interval_min=6, interval_max=6, timeout=64, latency=0):
+		"""直接连接设备(连接间隔单位1.25ms, 监督超时单位10ms)"""
+		return await self.send_command(6, 3, pack('6sBHHHH', multichr(addr), 0,
+												  interval_min, interval_max, timeout, latency))
+
+	async def discover(self):
+		"""开始扫描设备"""
+		return await self.send_command(6, 2, b'\x01')
+
+	async def end_scan(self):
+		"""停止扫描"""
+		return await self.send_command(6, 4)
+
+	async def disconnect(self, h):
+		"""断开连接"""
+		return await self.send_command(3, 0, pack('B', h))
+
+	@staticmethod
+	def check_gatt(result, what, con, how):
+		"""属性读写的响应或过程完成事件带有错误码时抛出BTError"""
+		if result:
+			raise BTError('%s on connection %d %s: 0x%04x' % (what, con, how, result))
+
+	async def read_attr(self, con, attr, timeout=COMMAND_TIMEOUT):
+		"""读取属性, 适配器拒绝或读取失败时抛出BTError"""
+		what = 'read attr 0x%02x' % attr
+		async with self.gatt_lock:
+			key = pack('BH', con, attr)
+			# 属性值: 只接受读取结果(typ != 1), 不接受同一属性的数据通知; 读取失败时以过程完成事件结束
+			value = self.expect_event(4, 5, lambda p: p.payload[:3] == key and p.payload[3] != 1)
+			done = self.expect_event(4, 1, lambda p: p.payload[0] == con and unpack('H', p.payload[3:5])[0] == attr)
+			try:
+				resp = await self.send_command(4, 4, key, timeout)
+				self.check_gatt(unpack('H', resp.payload[-2:])[0], what, con, 'rejected')
+				await asyncio.wait((value, done), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+				if value.done():
+					return value.result()
+				if done.done():
+					self.check_gatt(unpack('H', done.result().payload[1:3])[0], what, con, 'failed')
+					return await self.wait_event(value, timeout, what)
+				raise CommandTimeout('%s: not completed within %.1fs' % (what, timeout))
+			finally:
+				self.cancel_wait(value)
+				self.cancel_wait(done)
+
+	async def write_attr(self, con, attr, val, timeout=COMMAND_TIMEOUT):
+		"""写入属性, 适配器拒绝或写入失败时抛出BTError"""
+		what = 'write attr 0x%02x' % attr
+		async with self.gatt_lock:
+			done = self.expect_event(4, 1, lambda p: p.payload[0] == con)
+			try:
+				resp = await self.send_command(4, 5, pack('BHB', con, attr, len(val)) + val, timeout)
+				self.check_gatt(unpack('H', resp.payload[-2:])[0], what, con, 'rejected')
+			except BaseException:
+				self.cancel_wait(done)
+				raise
+			p = await self.wait_event(done, timeout, what)
+			self.check_gatt(unpack('H', p.payload[1:3])[0], what, con, 'failed')
+			return p
+
+	def close(self):
+		"""注销读取回调并关闭串口"""
+		if self.error is None and self.ser.is_open:
+			self.loop.remove_reader(self.ser.fileno())
+		self.ser.close()
+
+
+class AsyncMyo(Myo):
+	"""asyncio版Myo
+
+	write_attr/read_attr返回Task, 可以await等待完成, 也可以直接调用后由drain()统一等待;
+	属性读写在AsyncBT中按调用顺序逐个执行, 因此继承自Myo的
+	configure/start_raw/vibrate等方法无需修改即可使用。
+	连接过程与Myo共用参数选择、连接记录和设备缓存等步骤, 只把其中的等待改为await。
+	"""
+	def __init__(self, tty=None, mode=1, cache=None):
+		"""初始化(须在运行中的事件循环内调用), cache同Myo"""
+		if tty is None:
+			tty = Myo.detect_tty()		# 自动检测串口
+		if tty is None:
+			raise ValueError('Myo dongle not found!')
+		super().__init__(mode=mode, bt=AsyncBT(tty), cache=cache)
+		self.pending = []		# 尚未完成的属性读写
+
+	def run(self, timeout=0.1):
+		"""数据由事件循环分发, 无需调用run()"""
+		raise NotImplementedError('AsyncMyo is driven by the event loop')
+
+	def write_attr(self, attr, val):
+		"""写入属性, 返回Task"""
+		return self.schedule(self.bt.write_attr, attr, val)
+
+	def read_attr(self, attr):
+		"""读取属性, 返回Task"""
+		return self.schedule(self.bt.read_attr, attr)
+
+	def schedule(self, func, *args):
+		"""按调用顺序创建属性读写任务"""
+		if self.conn is None:
+			fut = self.bt.loop.create_future()
+			fut.set_result(None)
+			return fut
+		task = self.bt.loop.create_task(func(self.conn, *args))
+		self.pending.append(task)
+		return task
+
+	async def drain(self):
+		"""等待所有已发出的属性读写完成"""
+		pending, self.pending = self.pending, []
+		if pending:
+			await asyncio.gather(*pending)
+
+	async def connect(self, addr=None, reset=True, exclude=(), timeout=CONNECT_TIMEOUT, profile=None,
+					  scan_timeout=None):
+		"""连接Myo设备, 参数同Myo.connect; scan_timeout为扫描的期限(秒, None为一直扫描)"""
+		self.begin_connect(profile)
+		bt = self.bt
+
+		# 清理之前的现有连接
+		await bt.end_scan()
+		if reset:
+			for h in range(3):
+				await bt.disconnect(h)
+
+		# 直接连接缓存的设备
+		if addr is None and self.cache is not None:
+			addr = self.cache.recent(exclude)
+			if addr is not None:
+				try:
+					await self.connect_direct(addr, DIRECT_CONNECT_TIMEOUT)
+				except CommandTimeout:
+					print('cached device %s not found' % mac_str(addr))
+					addr = None
+
+		if self.conn is None:
+			if addr is None:
+				addr = await self.scan(exclude, scan_timeout)
+			await self.connect_direct(addr, timeout)
+
+		await self.setup()
+
+	async def scan(self, exclude=(), timeout=None):
+		"""扫描Myo设备, 返回第一个不在exclude中的地址"""
+		print('scanning...')
+		found = self.bt.expect_event(
+			6, 0, lambda p: p.payload.endswith(MYO_SERVICE) and list(p.payload[2:8]) not in exclude)
+		await self.bt.discover()
+		p = await self.bt.wait_event(found, timeout, 'scan')
+		await self.bt.end_scan()
+		return list(p.payload[2:8])
+
+	async def connect_direct(self, addr, timeout):
+		"""直接连接指定地址的设备并等待连接建立, timeout秒内未建立时取消并抛出CommandTimeout"""
+		request, source = self.conn_request(addr)
+
+		# 连接设备并等待状态事件
+		status = self.bt.expect_event(3, 0)
+		conn_pkt = await self.bt.connect(addr, request['interval_min'], request['interval_max'],
+										 request['timeout'], request['latency'])
+		result, conn = unpack('HB', conn_pkt.payload[:3])
+		if result:
+			self.bt.cancel_wait(status)
+			raise BTError('connect %s failed: 0x%04x' % (mac_str(addr), result))
+		try:
+			p = await self.bt.wait_event(status, timeout, 'connection status')
+		except CommandTimeout:
+			await self.bt.end_scan()		# 取消仍在进行的连接过程
+			raise
+		self.set_connected(addr, conn, p, request, source)
+
+	async def setup(self):
+		"""连接建立后读取固件版本(有缓存时跳过)并写入配置, 同Myo.setup"""
+		entry = self.cached_device()
+		name = None
+		if not self.use_cached_firmware(entry):
+			# 获取固件版本
+			fw = await self.read_attr(0x17)
+			self.set_firmware(fw.payload)
+			# 设备名读取与配置写入按调用顺序排队, 由drain统一等待
+			name = None if self.old else self.read_attr(0x03)
+
+		self.configure()
+		await self.drain()
+		self.finish_setup(entry, None if name is None else name.result().payload)
+
+	async def disconnect(self):
+		"""断开连接"""
+		if self.conn is not None:
+			conn, self.conn = self.conn, None	# 之后的断开事件不再当作意外断开
+			await self.bt.disconnect(conn)
+
+	async def emg_stream(self, block_size=None, max_latency=None):
+		"""异步迭代EMG数据块, 每次返回(block, stamps)"""
+		blocks = asyncio.Queue()
+
+		def h(block, stamps):
+			blocks.put_nowait((block, stamps))
+
+		self.add_emg_block_handler(h, block_size, max_latency)
+		try:
+			while True:
+				try:
+					item = await asyncio.wait_for(blocks.get(), self.emg_blocks.max_latency)
+				except asyncio.TimeoutError:
+					# 数据流停顿时按延迟上限交付未满的块
+					if self.emg_blocks.ready(time.monotonic()):
+						self.on_emg_block(*self.emg_blocks.take())
+					continue
+				yield item
+		finally:
+			self.remove_emg_block_handler(h)
+
+
+if __name__ == '__main__':
+	import sys
+
+	async def main():
+		m = AsyncMyo(sys.argv[1] if len(sys.argv) >= 2 else None, mode=emg_mode.RAW)
+		await m.connect()
+		m.vibrate(1)
+		await m.drain()
+		last = time.monotonic()
+		samples = 0
+		try:
+			async for block, stamps in m.emg_stream(block_size=16):
+				samples += len(block)
+				now = time.monotonic()
+				if now - last >= 1.0:
+					print('%.0f samples/s' % (samples / (now - last)), block[-1])
+					samples = 0
+					last = now
+		finally:
+			await m.disconnect()
+			m.close()
+
+	try:
+		asyncio.run(main())
+	except KeyboardInterrupt:
+		pass
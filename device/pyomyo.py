@@ -1,11 +1,19 @@
 #pyomyo.py
 import enum
+import json
+import math
+import os
+import queue
 import re
 import struct
 import sys
 import threading
 import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from concurrent.futures import TimeoutError as FutureTimeout
 
+import numpy as np
 import serial
 from serial.tools.list_ports import comports
 
@@ -67,7 +75,9 @@ class Pose(enum.Enum):
 
 class Packet(object):
 	"""蓝牙数据包解析类"""
-	def __init__(self, ords):
+	def __init__(self, ords, time=None):
+		self.time = time	# 接收时间(time.monotonic)
+		self.source = None	# 接收该包的蓝牙实例(多适配器共用事件队列时分发用)
 		self.typ = ords[0]	# 包类型
 		self.cls = ords[2]	# 命令类
 		self.cmd = ords[3]	# 命令码
@@ -79,60 +89,566 @@ class Packet(object):
 			 ' '.join('%02X' % b for b in multiord(self.payload)))
 
 
-class BT(object):
-	"""实现蓝牙协议的非Myo特定细节"""
-	def __init__(self, tty):
-		"""初始化蓝牙串口连接"""
-		self.ser = serial.Serial(port=tty, baudrate=9600, dsrdtr=1)
-		self.buf = []				# 接收缓冲区
-		self.lock = threading.Lock()	# 线程锁
-		self.handlers = []				# 事件处理器列表
-
-	# internal data-handling methods
-	def recv_packet(self):
-		"""接收并处理数据包"""
-		n = self.ser.inWaiting() # Windows fix	Windows修复
-
-		while True:
-			c = self.ser.read()
-			if not c:
-				return None
-
-			ret = self.proc_byte(ord(c))
-			if ret:
-				if ret.typ == 0x80:			# BLE事件包
-					self.handle_event(ret)
-					# Windows修复 - 缓冲区过大时清空
-					if n >= 5096:
-						print("Clearning",n)
-						self.ser.flushInput()
-					# End of Windows fix
-				return ret
-
-	def proc_byte(self, c):
-		"""处理单个字节，构建完整数据包"""
-		if not self.buf:
-			# 检查包起始字节
-			if c in [0x00, 0x80, 0x08, 0x88]:   # BLE/WiFi响应/事件包
-				self.buf.append(c)
-			return None
-		elif len(self.buf) == 1:
-			self.buf.append(c)
-			# 计算包长度(基础长度+可变长度)
-			self.packet_len = 4 + (self.buf[0] & 0x07) + self.buf[1]
-			return None
+class Throughput(object):
+	"""串口吞吐量计数器(字节/秒, 包/秒)"""
+	def __init__(self):
+		self.bytes = 0		# 累计读取字节数
+		self.packets = 0	# 累计解析包数
+		self.start_time = time.monotonic()
+		self.last_time = self.start_time
+		self.last_bytes = 0
+		self.last_packets = 0
+
+	def add(self, nbytes, npackets):
+		"""累加一次读取的字节数和包数"""
+		self.bytes += nbytes
+		self.packets += npackets
+
+	def rate(self):
+		"""返回自上次调用以来的(字节/秒, 包/秒)"""
+		now = time.monotonic()
+		dt = now - self.last_time
+		if dt <= 0:
+			return 0.0, 0.0
+		bps = (self.bytes - self.last_bytes) / dt
+		pps = (self.packets - self.last_packets) / dt
+		self.last_time = now
+		self.last_bytes = self.bytes
+		self.last_packets = self.packets
+		return bps, pps
+
+	def total_rate(self):
+		"""返回自创建以来的平均(字节/秒, 包/秒)"""
+		dt = time.monotonic() - self.start_time
+		if dt <= 0:
+			return 0.0, 0.0
+		return self.bytes / dt, self.packets / dt
+
+
+class Histogram(object):
+	"""对数分桶直方图
+
+	桶0为[0, 1), 桶i为[2^(i-1), 2^i), 记录前乘以scale(如秒->微秒)。
+	只由一个线程写入, 其他线程读取快照时不加锁(允许个别计数不一致)。
+	"""
+	def __init__(self, scale=1.0, buckets=32):
+		self.scale = scale
+		self.buckets = [0] * buckets
+		self.reset()
+
+	def reset(self):
+		"""清空记录"""
+		self.buckets = [0] * len(self.buckets)
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def add(self, v):
+		"""记录一个值"""
+		v *= self.scale
+		self.count += 1
+		self.total += v
+		if v > self.max:
+			self.max = v
+		i = math.frexp(v)[1] if v >= 1 else 0
+		self.buckets[min(i, len(self.buckets) - 1)] += 1
+
+	def percentile(self, q):
+		"""第q百分位数的上界(所在桶的上限, 不超过最大值)"""
+		if not self.count:
+			return 0.0
+		target = self.count * q / 100.0
+		seen = 0
+		for i, n in enumerate(self.buckets):
+			seen += n
+			if seen >= target:
+				return min(float(1 << i), self.max)
+		return self.max
+
+	def snapshot(self):
+		"""计数、均值、最大值和p50/p90/p99"""
+		return {
+			'count': self.count,
+			'mean': self.total / self.count if self.count else 0.0,
+			'max': self.max,
+			'p50': self.percentile(50),
+			'p90': self.percentile(90),
+			'p99': self.percentile(99),
+		}
+
+
+# BLED112 -> 主机消息的有效载荷长度: (类型, cls, cmd) -> 固定长度,
+# 或-(k+1)表示变长(长度 = k + 1 + payload[k], 即第k字节为末尾数组的长度)
+BGAPI_SPECS = {
+	# 响应
+	(0x00, 0, 1): 0,		# system_hello
+	(0x00, 0, 6): 1,		# system_get_connections
+	(0x00, 3, 0): 3,		# connection_disconnect
+	(0x00, 3, 1): 3,		# connection_get_rssi
+	(0x00, 3, 2): 3,		# connection_update
+	(0x00, 3, 7): 3,		# connection_get_status
+	(0x00, 4, 4): 3,		# attclient_read_by_handle
+	(0x00, 4, 5): 3,		# attclient_attribute_write
+	(0x00, 4, 6): 3,		# attclient_write_command
+	(0x00, 6, 2): 2,		# gap_discover
+	(0x00, 6, 3): 3,		# gap_connect_direct
+	(0x00, 6, 4): 2,		# gap_end_procedure
+	(0x00, 6, 7): 2,		# gap_set_scan_parameters
+	# 事件
+	(0x80, 0, 0): 12,		# system_boot
+	(0x80, 0, 6): 2,		# system_protocol_error
+	(0x80, 3, 0): 16,		# connection_status
+	(0x80, 3, 1): 6,		# connection_version_ind
+	(0x80, 3, 2): -2,		# connection_feature_ind
+	(0x80, 3, 4): 3,		# connection_disconnected
+	(0x80, 4, 0): 3,		# attclient_indicated
+	(0x80, 4, 1): 5,		# attclient_procedure_completed
+	(0x80, 4, 2): -6,		# attclient_group_found
+	(0x80, 4, 4): -4,		# attclient_find_information_found
+	(0x80, 4, 5): -5,		# attclient_attribute_value
+	(0x80, 6, 0): -11,		# gap_scan_response
+}
+
+
+class FrameParser(object):
+	"""BLED112帧解析器
+
+	整块数据写入预分配的bytearray, 通过memoryview按帧切片,
+	解析过程中不再逐字节构建列表。
+	每帧按(类型, cls, cmd)表校验有效载荷长度, 属性值事件再按value_sizes校验数据长度;
+	同步时帧头、长度表和长度都校验通过的帧即接受, 其后的字节损坏从下一帧边界开始重新同步;
+	校验失败时逐字节向后扫描重新同步, 丢弃的字节和重新同步次数计入统计。
+	不校验cls/cmd或正在重新同步时, 候选帧之后还须紧跟帧起始(或缓冲区末尾)才接受,
+	避免同步到载荷中恰好像帧头的字节。
+	"""
+	FRAME_TYPES = (0x00, 0x80)	# BLE响应/事件包(长度高3位恒为0)
+
+	def __init__(self, size=4096, specs=BGAPI_SPECS, value_sizes=None):
+		"""
+		参数:
+			specs: (类型, cls, cmd) -> 有效载荷长度表, None时不校验cls/cmd(如解析主机发出的命令)
+			value_sizes: 属性句柄 -> 通知数据长度, 长度不符的通知整帧丢弃
+		"""
+		self.buf = bytearray(size)		# 预分配接收缓冲区
+		self.view = memoryview(self.buf)
+		self.start = 0		# 未解析数据起点
+		self.end = 0		# 有效数据终点
+		self.specs = None if specs is None else {(t << 16) | (c << 8) | m: n for (t, c, m), n in specs.items()}
+		self.value_sizes = value_sizes or {}
+		self.frames = 0			# 有效帧数
+		self.discarded = 0		# 丢弃的字节数
+		self.resyncs = 0		# 重新同步次数(连续丢弃记为一次)
+		self.bad_values = 0		# 数据长度不符而丢弃的通知数
+		self.in_sync = True
+
+	def reset(self):
+		"""丢弃缓冲区中所有未解析数据"""
+		self.start = 0
+		self.end = 0
+
+	def pending(self):
+		"""缓冲区中尚未组成完整帧的字节数"""
+		return self.end - self.start
+
+	def stats(self):
+		"""解析统计"""
+		return {
+			'frames': self.frames,
+			'discarded': self.discarded,
+			'resyncs': self.resyncs,
+			'bad_values': self.bad_values,
+		}
+
+	def feed(self, data):
+		"""写入一块新数据"""
+		n = len(data)
+		if self.end + n > len(self.buf):
+			# 将未解析的尾部移到缓冲区开头
+			remain = self.end - self.start
+			self.view[:remain] = self.view[self.start:self.end]
+			self.start = 0
+			self.end = remain
+			if remain + n > len(self.buf):
+				# 缓冲区不足时按需扩容
+				self.view.release()
+				self.buf.extend(bytes(remain + n - len(self.buf)))
+				self.view = memoryview(self.buf)
+		self.view[self.end:self.end + n] = data
+		self.end += n
+
+	def parse(self, now=None):
+		"""切分出缓冲区中所有完整且有效的帧, 返回Packet列表(now为接收时间)"""
+		buf = self.buf
+		view = self.view
+		specs = self.specs
+		sizes = self.value_sizes
+		pos = self.start
+		end = self.end
+		discarded = 0
+		in_sync = self.in_sync
+		packets = []
+		while end - pos >= 4:
+			c = buf[pos]
+			valid = False
+			value_event = False
+			if c == 0x80 or c == 0x00:
+				n = buf[pos + 1]
+				flen = 4 + n
+				if specs is None:
+					valid = True
+				elif c == 0x80 and buf[pos + 2] == 4 and buf[pos + 3] == 5:
+					# 属性值事件(最常见): 长度 = 5 + 数据长度
+					if end - pos < 9:
+						break
+					valid = value_event = n == 5 + buf[pos + 8]
+				else:
+					spec = specs.get((c << 16) | (buf[pos + 2] << 8) | buf[pos + 3])
+					if spec is None:
+						pass			# 未知消息
+					elif spec >= 0:
+						valid = n == spec
+					else:
+						k = -spec - 1	# 变长消息: 末尾数组长度在第k字节
+						if n > k:
+							if end - pos < 5 + k:
+								break	# 长度字节未接收
+							valid = n == k + 1 + buf[pos + 4 + k]
+				if valid:
+					if end - pos < flen:
+						break			# 帧未接收完整
+					if specs is None or not in_sync:
+						# 校验不足以确定帧边界时, 其后须为帧起始
+						valid = end - pos == flen or buf[pos + flen] == 0x80 or buf[pos + flen] == 0x00
+			if not valid:
+				# 跳过一个字节, 向后扫描重新同步
+				discarded += 1
+				if in_sync:
+					in_sync = False
+					self.resyncs += 1
+				pos += 1
+				continue
+			in_sync = True
+			if value_event and sizes and buf[pos + 7] == 1:
+				size = sizes.get(buf[pos + 5] | (buf[pos + 6] << 8))
+				if size is not None and size != buf[pos + 8]:
+					self.bad_values += 1	# 数据长度与该属性不符, 整帧丢弃
+					pos += flen
+					continue
+			packets.append(Packet(view[pos:pos + flen], now))
+			pos += flen
+		self.in_sync = in_sync
+		self.discarded += discarded
+		self.frames += len(packets)
+		if pos >= end:
+			self.reset()	# 缓冲区已全部消费, 复位到开头
 		else:
-			self.buf.append(c)
-
-		# 检查是否收到完整包
-		if self.packet_len and len(self.buf) == self.packet_len:
-			p = Packet(self.buf)
-			self.buf = []
-			return p
-		return None
+			self.start = pos
+		return packets
+
+
+class EMGBlockBuffer(object):
+	"""EMG数据块累积器
+
+	累积原始通知载荷, 达到块大小或延迟上限时用np.frombuffer一次解码为(N, 8)数组。
+	"""
+	def __init__(self, block_size=8, max_latency=0.04):
+		self.block_size = block_size		# 每块采样数
+		self.max_latency = max_latency		# 首个采样到交付的最大延迟(秒)
+		self.dtype = None					# 当前数据类型(int8或uint16)
+		self.buf = bytearray()				# 原始载荷
+		self.stamps = []					# 每个采样的时间戳
+		self.first_time = None				# 块内首个通知的到达时间
+
+	def append(self, raw, dtype, stamps, now):
+		"""追加一次通知的载荷(raw须为8通道的整数倍, stamps为其中各采样的时间戳)"""
+		if self.dtype != dtype:
+			self.clear()
+			self.dtype = dtype
+		if self.first_time is None:
+			self.first_time = now
+		self.buf += raw
+		self.stamps.extend(stamps)
+
+	def ready(self, now):
+		"""是否达到块大小或延迟上限"""
+		if not self.stamps:
+			return False
+		return (len(self.stamps) >= self.block_size or
+				now - self.first_time >= self.max_latency)
+
+	def take(self):
+		"""取出累积数据, 返回(block, stamps)"""
+		block = np.frombuffer(bytes(self.buf), dtype=self.dtype).reshape(-1, 8)
+		stamps = np.array(self.stamps)
+		self.buf = bytearray()
+		self.stamps = []
+		self.first_time = None
+		return block, stamps
+
+	def clear(self):
+		"""丢弃累积数据"""
+		self.buf = bytearray()
+		self.stamps = []
+		self.first_time = None
+
+
+class EMGSequencer(object):
+	"""EMG通知序列重建与丢包检测
+
+	新固件的4个EMG特性按0x2b→0x2e→0x31→0x34轮流通知, 每个通知含2个采样。
+	根据特性顺序统计丢失和重复的通知, 并按采样周期为每个采样插值单调递增的时间戳。
+	"""
+	ORDER = {0x2b: 0, 0x2e: 1, 0x31: 2, 0x34: 3}
+
+	def __init__(self, rate=200, alpha=0.05, max_lag=0.1):
+		self.period = 1.0 / rate	# 采样周期(秒)
+		self.alpha = alpha			# 时间戳向到达时间修正的系数
+		self.max_lag = max_lag		# 预测时间落后到达时间超过该值时重新对齐
+		self.reset()
+
+	def reset(self):
+		"""清空序列状态和计数"""
+		self.last_index = None		# 上一个通知的特性序号
+		self.last_raw = None		# 上一个通知的载荷(用于判断重复)
+		self.last_stamp = None		# 上一个采样的时间戳
+		self.notifications = 0		# 收到的通知数
+		self.samples = 0			# 交付的采样数
+		self.gaps = 0				# 检测到的断档次数
+		self.lost = 0				# 丢失的采样数
+		self.duplicates = 0			# 重复的通知数
+		self.realigns = 0			# 时间戳重新对齐次数
+
+	def set_rate(self, rate):
+		"""修改采样率, 时间戳重新从到达时间开始"""
+		self.period = 1.0 / rate
+		self.last_index = None
+		self.last_raw = None
+		self.last_stamp = None
+
+	def stamp(self, attr, raw, t, n=2):
+		"""处理一个含n个采样的通知, 返回各采样的时间戳; 重复通知返回None"""
+		self.notifications += 1
+		missing = 0
+		index = self.ORDER.get(attr)
+		if index is not None and self.last_index is not None:
+			delta = (index - self.last_index) % 4
+			if delta == 0:
+				if raw == self.last_raw:
+					self.duplicates += 1
+					return None
+				delta = 4		# 同一特性且数据不同: 中间丢失了3个通知
+			if delta > 1:
+				self.gaps += 1
+				missing = (delta - 1) * n
+				self.lost += missing
+		if index is not None:
+			self.last_index = index
+			self.last_raw = raw
+
+		# 按采样周期预测本通知最后一个采样的时间, 再向到达时间缓慢修正
+		last = self.last_stamp
+		period = self.period
+		if last is None:
+			end = t
+		else:
+			end = last + (missing + n) * period
+			if t - end > self.max_lag:
+				self.realigns += 1
+				end = t
+			else:
+				end += self.alpha * (t - end)
+				if end > t:
+					end = t				# 采样不可能晚于到达时间
+				if end <= last:
+					end = last + 1e-6	# 到达时间抖动时也保持递增
+		first = end - (n - 1) * period
+		if last is not None and first <= last:
+			# 保证单调递增: 在上一个时间戳和end之间均匀分布
+			period = (end - last) / n
+			first = last + period
+		if n == 2:
+			stamps = [first, end]
+		else:
+			stamps = [first + i * period for i in range(n)]
+		self.last_stamp = end
+		self.samples += n
+		return stamps
+
+	def stats(self):
+		"""返回序列统计"""
+		expected = self.samples + self.lost
+		return {
+			'notifications': self.notifications,
+			'samples': self.samples,
+			'gaps': self.gaps,
+			'lost': self.lost,
+			'duplicates': self.duplicates,
+			'realigns': self.realigns,
+			'loss_rate': self.lost / expected if expected else 0.0,
+		}
+
+
+EMG_INT8 = np.dtype(np.int8)		# 新固件原始EMG(0x2b/0x2e/0x31/0x34)
+EMG_UINT16 = np.dtype('<u2')		# 预处理/旧固件EMG(0x27)
+
+# IMU通知中各量的列范围和换算系数(原始int16 / 系数 = 单位值)
+IMU_FIELDS = {'quat': slice(0, 4), 'acc': slice(4, 7), 'gyro': slice(7, 10)}
+IMU_SCALES = {'quat': 16384.0, 'acc': 2048.0, 'gyro': 16.0}	# 单位四元数, g, 度/秒
+
+
+class IMURingBuffer(object):
+	"""定长IMU环形缓冲区
+
+	保存最近size个IMU通知的原始int16值(四元数4 + 加速度3 + 陀螺仪3)和到达时间,
+	写入不分配内存, 按时间戳取值时用searchsorted一次完成。
+	"""
+	def __init__(self, size=256):
+		self.size = size
+		self.data = np.zeros((size, 10), dtype=np.int16)
+		self.times = np.zeros(size)
+		self.count = 0			# 写入总数, 写入位置为count % size
+
+	def __len__(self):
+		return min(self.count, self.size)
+
+	def append(self, vals, t):
+		"""写入一个IMU通知(10个原始值)"""
+		i = self.count % self.size
+		self.data[i] = vals
+		self.times[i] = t
+		self.count += 1
+
+	def latest(self, n=None):
+		"""按时间顺序返回最近n个(默认全部)采样, 返回(data, times)"""
+		n = len(self) if n is None else min(n, len(self))
+		idx = np.arange(self.count - n, self.count) % self.size
+		return self.data[idx], self.times[idx]
+
+	def sample(self, stamps, fields=('quat',)):
+		"""取各时间戳之前最近一个IMU采样的指定量(换算为单位值), 返回(N, 列数)的float32数组
+
+		早于缓冲区最早采样的时间戳取最早的采样; 缓冲区为空时返回全0。
+		"""
+		cols = sum(IMU_FIELDS[f].stop - IMU_FIELDS[f].start for f in fields)
+		out = np.zeros((len(stamps), cols), dtype=np.float32)
+		if not self.count:
+			return out
+		data, times = self.latest()
+		idx = np.searchsorted(times, stamps, side='right') - 1
+		np.maximum(idx, 0, out=idx)
+		rows = data[idx]
+		c = 0
+		for f in fields:
+			s = IMU_FIELDS[f]
+			w = s.stop - s.start
+			out[:, c:c + w] = rows[:, s] / IMU_SCALES[f]
+			c += w
+		return out
+
+	def clear(self):
+		"""清空缓冲区"""
+		self.count = 0
+
+
+class EMGIMUFusion(object):
+	"""EMG与IMU融合
+
+	每个EMG数据块按采样时间戳从IMU环形缓冲区取对应的IMU量,
+	拼接为(N, 8 + IMU列数)的float32帧, 前8列为EMG, 之后按fields顺序为IMU量。
+	"""
+	def __init__(self, ring, fields=('quat',)):
+		self.ring = ring
+		self.set_fields(fields)
+		self.handlers = []
+		self.frames = 0		# 输出的帧(采样)数
+		self.no_imu = 0		# 尚无IMU数据时输出的帧数(IMU列为0)
+
+	def set_fields(self, fields):
+		"""修改融合的IMU量"""
+		for f in fields:
+			if f not in IMU_FIELDS:
+				raise ValueError('unknown IMU field: %s' % f)
+		self.fields = tuple(fields)
+
+	def width(self):
+		"""融合帧的列数"""
+		return 8 + sum(IMU_FIELDS[f].stop - IMU_FIELDS[f].start for f in self.fields)
+
+	def handle_block(self, block, stamps):
+		"""EMG数据块处理器: 拼接IMU量后交给融合帧处理器"""
+		frame = np.empty((len(block), self.width()), dtype=np.float32)
+		frame[:, :8] = block
+		frame[:, 8:] = self.ring.sample(stamps, self.fields)
+		self.frames += len(block)
+		if not len(self.ring):
+			self.no_imu += len(block)
+		for h in self.handlers:
+			h(frame, stamps)
+
+
+# 扫描响应中的Myo服务UUID
+MYO_SERVICE = b'\x06\x42\x48\x12\x4A\x7F\x2C\x48\x47\xB9\xDE\x04\xA9\x01\x00\x06\xD5'
+
+# 预编译的解包器
+ATTR_HEADER = struct.Struct('<BHB')		# 属性值事件头: 连接, 属性句柄, 类型
+EMG_OLD_DATA = struct.Struct('<8HB')	# 0x27: 8个uint16 EMG + 运动标志
+EMG_DATA = struct.Struct('<16b')		# 0x2b/0x2e/0x31/0x34: 2个8通道int8采样
+IMU_DATA = struct.Struct('<10h')		# 0x1c: 四元数, 加速度, 陀螺仪
+CLASSIFIER_DATA = struct.Struct('<6B')	# 0x23: 类型, 值, 方向
+BATTERY_DATA = struct.Struct('<B')		# 0x11: 电量
+ATTR_VALUE_OFFSET = 5	# 属性值事件中数据的起始位置(事件头4字节+长度1字节)
+# 各数据流的通知配置描述符(CCCD)句柄和开启值, EMG的句柄取决于模式
+STREAM_CCCDS = {'imu': (0x1d,), 'classifier': (0x24,), 'battery': (0x12,)}
+STREAM_CCCD_ON = {'emg': b'\x01\x00', 'imu': b'\x01\x00', 'classifier': b'\x02\x00', 'battery': b'\x01\x10'}
+EMG_MODE_BYTES = {emg_mode.PREPROCESSED: 0x01, emg_mode.FILTERED: 0x02, emg_mode.RAW: 0x03}	# 设置模式命令中的EMG模式
+# 数据通知的长度, 不符的通知由FrameParser丢弃, 不会进入处理器
+MYO_VALUE_SIZES = {
+	0x27: EMG_OLD_DATA.size,
+	0x2b: EMG_DATA.size, 0x2e: EMG_DATA.size, 0x31: EMG_DATA.size, 0x34: EMG_DATA.size,
+	0x1c: IMU_DATA.size,
+	0x23: CLASSIFIER_DATA.size,
+	0x11: BATTERY_DATA.size,
+}
+
+
+class Dispatcher(object):
+	"""事件分发表
+
+	属性值事件(4, 5)按(cls, cmd, attr, conn)索引, 其余事件按(cls, cmd, None, None)索引,
+	一次字典查找即可找到订阅者; add_handler注册的通用处理器接收所有事件。
+	"""
+	def __init__(self):
+		self.subscriptions = {}		# (cls, cmd, attr, conn) -> 处理器列表
+		self.handlers = []			# 通用事件处理器列表
+		self.unmatched = 0			# 无人订阅的事件数
+
+	def subscribe(self, cls, cmd, attr, h, conn=None):
+		"""订阅事件, attr为None时订阅非属性事件, conn为属性事件所属的连接"""
+		hs = self.subscriptions.setdefault((cls, cmd, attr, conn), [])
+		if h not in hs:
+			hs.append(h)
+
+	def unsubscribe(self, cls, cmd, attr, h, conn=None):
+		"""取消订阅"""
+		key = (cls, cmd, attr, conn)
+		hs = self.subscriptions.get(key)
+		if hs and h in hs:
+			hs.remove(h)
+			if not hs:
+				del self.subscriptions[key]
 
 	def handle_event(self, p):
-		"""调用所有注册的事件处理器"""
+		"""调用订阅该事件的处理器和所有通用处理器"""
+		if p.cls == 4 and p.cmd == 5:
+			conn, attr, _ = ATTR_HEADER.unpack_from(p.payload)
+		else:
+			conn = attr = None
+		hs = self.subscriptions.get((p.cls, p.cmd, attr, conn))
+		if hs:
+			for h in hs:
+				h(p)
+		elif not self.handlers:
+			self.unmatched += 1
 		for h in self.handlers:
 			h(p)
 
@@ -147,23 +663,716 @@ class BT(object):
 		except ValueError:
 			pass
 
-	def wait_event(self, cls, cmd):
+
+CAPTURE_MAGIC = b'MYOCAP1\n'				# 录制文件头
+CAPTURE_RECORD = struct.Struct('<dI')	# 每次读取: 相对时间(秒), 字节数
+
+
+class CaptureWriter(object):
+	"""串口字节流录制: 每次读取的数据连同时间戳写入文件"""
+	def __init__(self, path):
+		self.file = open(path, 'wb')
+		self.file.write(CAPTURE_MAGIC)
+		self.start_time = None
+
+	def write(self, t, data):
+		"""记录一次读取(t为time.monotonic)"""
+		if self.start_time is None:
+			self.start_time = t
+		self.file.write(CAPTURE_RECORD.pack(t - self.start_time, len(data)))
+		self.file.write(data)
+
+	def close(self):
+		"""关闭录制文件"""
+		if not self.file.closed:
+			self.file.close()
+
+
+def read_capture(path):
+	"""读取录制文件, 逐条返回(相对时间, 数据)"""
+	with open(path, 'rb') as f:
+		if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+			raise ValueError('not a Myo capture file: %s' % path)
+		while True:
+			head = f.read(CAPTURE_RECORD.size)
+			if len(head) < CAPTURE_RECORD.size:
+				return
+			t, n = CAPTURE_RECORD.unpack(head)
+			data = f.read(n)
+			if len(data) < n:
+				return
+			yield t, data
+
+
+# 连接参数配置: 连接间隔单位1.25ms, 监督超时单位10ms, latency为从机可跳过的连接事件数
+CONN_PROFILES = {
+	'low_latency': {'interval_min': 6, 'interval_max': 6, 'timeout': 64, 'latency': 0},		# 7.5ms, 原始EMG(200Hz)所需
+	'balanced': {'interval_min': 6, 'interval_max': 12, 'timeout': 100, 'latency': 0},		# 7.5~15ms
+	'low_power': {'interval_min': 24, 'interval_max': 40, 'timeout': 400, 'latency': 2},	# 30~50ms, 只适合预处理EMG(50Hz)
+}
+DEFAULT_CONN_PROFILE = 'low_latency'
+
+COMMAND_TIMEOUT = 1.0	# 命令响应和属性读写的默认期限(秒)
+CONNECT_TIMEOUT = 5.0	# 等待连接建立的期限(秒)
+DIRECT_CONNECT_TIMEOUT = 1.5	# 直接连接缓存设备的期限(秒), 超时后改为扫描
+
+
+class BTError(Exception):
+	"""蓝牙适配器返回错误或通信失败"""
+
+
+class CommandTimeout(BTError, TimeoutError):
+	"""蓝牙命令或属性读写超过期限未完成"""
+
+
+def resolve(fut, result=None, error=None):
+	"""设置Future结果, 已完成(超时或已取消)的Future忽略"""
+	if fut.done():
+		return
+	try:
+		if error is not None:
+			fut.set_exception(error)
+		else:
+			fut.set_result(result)
+	except InvalidStateError:
+		pass		# 与超时处理同时完成
+
+
+class EventWaiters(object):
+	"""等待特定事件的调用者登记表, BT和SyntheticBT共用
+
+	调用者先expect_event登记再发送命令, 事件到达时由take_event交给第一个匹配的等待者。
+	"""
+	def __init__(self, timeout=None):
+		self.cond = threading.Condition()	# 保护等待者列表(子类可用它保护其他等待状态)
+		self.waiters = []				# 等待特定事件的调用者: (cls, cmd, fut, match)
+		self.timeout = timeout			# wait的默认期限(秒), None为不限
+		self.timeouts = 0				# 超时数
+
+	def check_active(self):
+		"""不能再登记等待者时抛出BTError, 在cond内调用"""
+
+	def expect_event(self, cls, cmd, match=None):
+		"""登记等待特定事件, 返回Future
+
+		须在发送触发该事件的命令之前调用, 避免事件先于登记到达。
+		"""
+		fut = Future()
+		with self.cond:
+			self.check_active()
+			self.waiters.append((cls, cmd, fut, match))
+		return fut
+
+	def take_event(self, p):
+		"""将事件交给所有匹配的等待者, 有等待者消费时返回True"""
+		matched = []
+		with self.cond:
+			if self.waiters:
+				remain = []
+				for w in self.waiters:
+					cls, cmd, fut, match = w
+					if p.cls == cls and p.cmd == cmd and (match is None or match(p)):
+						matched.append(fut)
+					else:
+						remain.append(w)
+				self.waiters = remain
+		for fut in matched:
+			resolve(fut, p)
+		return bool(matched)
+
+	def wait(self, fut, timeout=None, what='event'):
+		"""等待expect_event返回的Future, timeout秒(默认self.timeout)内未发生时注销并抛出CommandTimeout"""
+		if timeout is None:
+			timeout = self.timeout
+		try:
+			return fut.result(timeout)
+		except FutureTimeout:
+			if fut.done():
+				raise		# Future自身的超时错误
+		self.cancel_wait(fut)
+		self.timeouts += 1
+		raise CommandTimeout('%s: not received within %.1fs' % (what, timeout))
+
+	def cancel_wait(self, fut):
+		"""注销expect_event登记的等待者"""
+		with self.cond:
+			self.waiters = [w for w in self.waiters if w[2] is not fut]
+
+	def wait_event(self, cls, cmd, match=None, timeout=None):
 		"""等待特定事件"""
-		res = [None]
+		return self.wait(self.expect_event(cls, cmd, match), timeout, 'event %d.%d' % (cls, cmd))
+
+
+class GattRequest(object):
+	"""排队中的属性读写过程
+
+	同一连接同时只能进行一个属性读写过程, 其余在BT中排队,
+	由读线程在前一个完成时立即发出, 调用者无需等待每次往返。
+	"""
+	__slots__ = ('cmd', 'attr', 'payload', 'timeout', 'deadline', 'fut')
+
+	def __init__(self, cmd, attr, payload, timeout):
+		self.cmd = cmd			# 4: 读属性, 5: 写属性
+		self.attr = attr		# 属性句柄
+		self.payload = payload
+		self.timeout = timeout
+		self.deadline = None	# 发出后设置
+		self.fut = Future()
+
+	def describe(self):
+		"""用于错误信息的描述"""
+		return '%s attr 0x%02x' % ('read' if self.cmd == 4 else 'write', self.attr)
 
-		def h(p):
-			if p.cls == cls and p.cmd == cmd:
-				res[0] = p
-		self.add_handler(h)
-		while res[0] is None:
-			self.recv_packet()
-		self.remove_handler(h)
-		return res[0]
+
+def mac_str(addr):
+	"""MAC地址列表转为'c2:52:f5:37:29:5d'形式(高字节在前)"""
+	return ':'.join('%02x' % b for b in reversed(list(addr)))
+
+
+class DeviceCache(object):
+	"""已连接设备缓存(JSON文件)
+
+	按MAC地址记录固件版本和连接参数, 重连时直接连接缓存的设备并跳过固件读取, 无需扫描。
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.devices = {}		# MAC字符串 -> {'addr', 'firmware', 'params', 'seen'}
+		self.load()
+
+	def load(self):
+		"""读取缓存文件, 不存在或损坏时为空"""
+		try:
+			with open(self.path) as f:
+				devices = json.load(f).get('devices', {})
+		except (OSError, ValueError, AttributeError):
+			devices = {}
+		self.devices = devices if isinstance(devices, dict) else {}
+
+	def save(self):
+		"""写入临时文件后替换, 避免写到一半时断电损坏缓存"""
+		tmp = self.path + '.tmp'
+		try:
+			with open(tmp, 'w') as f:
+				json.dump({'devices': self.devices}, f, indent=1)
+			os.replace(tmp, self.path)
+		except OSError as e:
+			print('device cache not saved:', e)
+
+	def get(self, addr):
+		"""设备的缓存记录, 没有时返回None"""
+		return self.devices.get(mac_str(addr))
+
+	def recent(self, exclude=()):
+		"""最近连接过且不在exclude中的设备地址, 没有时返回None"""
+		for d in sorted(self.devices.values(), key=lambda d: d.get('seen', 0), reverse=True):
+			addr = d.get('addr')
+			if addr and addr not in exclude:
+				return addr
+		return None
+
+	def update(self, addr, **fields):
+		"""更新设备记录并保存"""
+		d = self.devices.setdefault(mac_str(addr), {})
+		d.update(fields)
+		d['addr'] = list(addr)
+		d['seen'] = time.time()
+		self.save()
+
+
+class Backpressure(object):
+	"""事件队列积压时的处理策略
+
+	dispatch()跟不上读线程时事件在队列中积压; 队列深度达到high比例时进入过载状态,
+	降到low比例以下时退出(滞回), 过载期间按strategy丢弃数据通知:
+		'drop_oldest': 不主动丢弃, 只在队列满时丢弃最旧的事件
+		'decimate': 每factor个数据通知只保留1个
+		'pause_imu': 丢弃IMU通知, 保留EMG等其他数据
+	任何策略下队列满时都丢弃最旧的事件。只丢弃整包, 非数据事件(连接状态等)不受影响。
+	"""
+	STRATEGIES = ('drop_oldest', 'decimate', 'pause_imu')
+	IMU_ATTR = 0x1c
+
+	def __init__(self, strategy='drop_oldest', high=0.5, low=0.25, factor=2):
+		if strategy not in self.STRATEGIES:
+			raise ValueError('unknown backpressure strategy: %s' % strategy)
+		self.strategy = strategy
+		self.high = high
+		self.low = low
+		self.factor = factor
+		self.high_depth = 0			# 进入过载的队列深度(bind后设置)
+		self.low_depth = 0			# 退出过载的队列深度
+		self.overloaded = False
+		self.skip = 0				# 抽取计数
+		self.counts = {'oldest': 0, 'decimated': 0, 'imu_paused': 0}	# 按原因统计的丢弃事件数
+		self.episodes = 0			# 过载次数
+		self.episode_start = 0.0
+		self.episode_drops = 0
+
+	def bind(self, maxsize):
+		"""按队列容量计算过载阈值(maxsize为0表示无界, 不会过载)"""
+		self.high_depth = int(maxsize * self.high) if maxsize > 0 else sys.maxsize
+		self.low_depth = int(maxsize * self.low)
+
+	def dropped(self):
+		"""丢弃事件总数"""
+		return sum(self.counts.values())
+
+	def admit(self, p, depth):
+		"""事件入队前调用, 返回False表示按策略丢弃"""
+		if not self.overloaded:
+			if depth < self.high_depth:
+				return True
+			self.overloaded = True
+			self.episodes += 1
+			self.episode_start = time.monotonic()
+			self.episode_drops = self.dropped()
+		elif depth <= self.low_depth:
+			self.overloaded = False
+			n = self.dropped() - self.episode_drops
+			if n:
+				print('backpressure: %d events dropped in %.2fs (%s)' %
+					  (n, time.monotonic() - self.episode_start, self.strategy))
+			return True
+
+		if p.cls != 4 or p.cmd != 5 or self.strategy == 'drop_oldest':
+			return True
+		if self.strategy == 'decimate':
+			self.skip += 1
+			if self.skip % self.factor == 0:
+				return True
+			self.counts['decimated'] += 1
+			return False
+		if ATTR_HEADER.unpack_from(p.payload)[1] == self.IMU_ATTR:
+			self.counts['imu_paused'] += 1
+			return False
+		return True
+
+
+class BT(Dispatcher, EventWaiters):
+	"""实现蓝牙协议的非Myo特定细节
+
+	后台读线程独占串口读取: 响应包按发送顺序交给等待中的命令,
+	事件包先唤醒等待该事件的调用者, 再放入有界队列由dispatch()分发给处理器。
+	每条命令和属性读写都有期限, 由读线程检查, 超时以CommandTimeout结束。
+	"""
+	def __init__(self, tty, queue_size=1024, capture=None, events=None, timeout=COMMAND_TIMEOUT,
+				 backpressure='drop_oldest', stats_interval=None):
+		"""初始化蓝牙串口连接
+
+		capture不为None时将接收的原始字节流录制到该文件;
+		events不为None时与其他适配器共用该事件队列, 由任一实例的dispatch()统一分发;
+		timeout为命令响应和属性读写的默认期限(秒);
+		backpressure为事件积压时的策略名或Backpressure实例;
+		stats_interval不为None时读线程每隔该秒数打印一行链路统计(见snapshot)。
+		"""
+		Dispatcher.__init__(self)
+		EventWaiters.__init__(self, timeout)		# cond同时保护命令响应和属性读写队列
+		# 读超时使读线程能定期检查停止标志和命令期限
+		self.ser = serial.Serial(port=tty, baudrate=9600, dsrdtr=1, timeout=0.1)
+		self.parser = FrameParser(value_sizes=MYO_VALUE_SIZES)		# 帧解析器
+		self.throughput = Throughput()	# 吞吐量统计
+		self.lock = threading.Lock()	# 串口写锁
+
+		self.events = events if events is not None else queue.Queue(queue_size)	# 待分发事件队列
+		self.max_depth = 0				# 事件队列深度峰值
+		self.dropped = 0				# 丢弃的事件总数(各原因见backpressure.counts)
+		if not isinstance(backpressure, Backpressure):
+			backpressure = Backpressure(backpressure)
+		self.backpressure = backpressure	# 积压处理策略
+		self.backpressure.bind(self.events.maxsize)
+		self.backlog = 0				# 最近一次读取时串口中待读的字节数
+		self.max_backlog = 0			# 串口积压峰值(字节)
+		self.lag = 0.0					# 最近分发的事件从到达到分发的延迟(秒)
+		self.max_lag = 0.0				# 分发延迟峰值(秒)
+		self.responses = deque()		# 等待响应的命令(cls, cmd, Future, 期限), 按发送顺序
+		self.gatt = {}					# 连接句柄 -> 排队中的属性读写(队首为正在执行的过程)
+		self.next_expire = 0.0			# 下次检查期限的时间
+		self.error = None				# 读线程异常
+		self.paused = False				# 读线程是否已暂停(串口交给原生循环)
+		self.capture = CaptureWriter(capture) if capture else None	# 原始字节流录制
+
+		# 链路统计: 定位识别延迟来自适配器、解析还是Python处理器
+		self.read_bytes = Histogram()			# 每次读取的字节数
+		self.read_wait = Histogram(1e6)			# 每次ser.read阻塞的时间(微秒)
+		self.read_wait_total = 0.0				# ser.read阻塞的总时间(秒)
+		self.parse_time = Histogram(1e6)		# 每帧解析时间(微秒, 按每次parse平均)
+		self.handler_time = Histogram(1e6)		# 每次dispatch中处理器的时间(微秒)
+		self.responses_total = 0				# 收到的响应包数(事件包数为总包数减去它)
+		self.stats_interval = stats_interval
+		self.next_stats = time.monotonic() + stats_interval if stats_interval else None
+		self.last_snapshot = None				# 上次快照的(时间, 响应数, 总包数, 阻塞时间)
+
+		self.running = True
+		self.reader = threading.Thread(target=self.reader_func, daemon=True)
+		self.reader.start()
+
+	# internal data-handling methods
+	def reader_func(self):
+		"""读线程: 一次读出串口中所有待读字节, 批量解析并路由"""
+		try:
+			while self.running:
+				n = self.ser.inWaiting()
+				# 串口积压: 读线程本身落后时增大(不丢弃, 只统计)
+				self.backlog = n
+				if n > self.max_backlog:
+					self.max_backlog = n
+				# 无数据时读取1字节(带超时), 否则一次读完
+				t0 = time.perf_counter()
+				data = self.ser.read(n if n > 0 else 1)
+				t1 = time.perf_counter()
+				self.read_wait.add(t1 - t0)
+				self.read_wait_total += t1 - t0
+				now = time.monotonic()
+				if now >= self.next_expire:
+					self.next_expire = now + 0.05
+					self.expire(now)
+					if self.next_stats is not None and now >= self.next_stats:
+						self.next_stats = now + self.stats_interval
+						print(self.format_snapshot(self.snapshot()))
+				if not data:
+					continue
+
+				self.read_bytes.add(len(data))
+				if self.capture is not None:
+					self.capture.write(now, data)
+				t2 = time.perf_counter()
+				self.parser.feed(data)
+				packets = self.parser.parse(now)
+				if packets:
+					self.parse_time.add((time.perf_counter() - t2) / len(packets))
+				self.throughput.add(len(data), len(packets))
+				for p in packets:
+					self.route_packet(p)
+		except Exception as e:
+			self.fail(e)
+
+	def fail(self, e):
+		"""读线程出错: 唤醒所有等待者"""
+		self.error = e
+		self.running = False
+		self.abort_pending(e)
+
+	def abort_pending(self, e):
+		"""以异常e结束所有等待中的命令、事件等待者和属性读写"""
+		with self.cond:
+			pending = [r[2] for r in self.responses] + [w[2] for w in self.waiters]
+			for q in self.gatt.values():
+				pending.extend(req.fut for req in q)
+			self.responses.clear()
+			self.waiters = []
+			self.gatt = {}
+		for fut in pending:
+			resolve(fut, error=e)
+
+	def expire(self, now):
+		"""结束超过期限的命令响应和属性读写"""
+		late = []
+		with self.cond:
+			for cls, cmd, fut, deadline in self.responses:
+				if deadline < now and not fut.done():
+					late.append((fut, 'command %d.%d' % (cls, cmd)))
+			reqs = [(con, q[0]) for con, q in self.gatt.items()
+					if q[0].deadline is not None and q[0].deadline < now]
+		for fut, what in late:
+			self.timeouts += 1
+			resolve(fut, error=CommandTimeout('%s: no response from dongle' % what))
+		for con, req in reqs:
+			self.timeouts += 1
+			self.finish_gatt(con, req, error=CommandTimeout(
+				'%s on connection %d: not completed within %.1fs' % (req.describe(), con, req.timeout)))
+
+	def route_packet(self, p):
+		"""将解析出的数据包交给等待者或事件队列"""
+		if p.typ == 0:	# 响应包: 按命令发送顺序对应
+			self.responses_total += 1
+			fut = None
+			lost = []
+			with self.cond:
+				while self.responses:
+					cls, cmd, f, _ = self.responses.popleft()
+					if cls == p.cls and cmd == p.cmd:
+						fut = f
+						break
+					lost.append(f)		# 适配器未响应的命令
+			for f in lost:
+				resolve(f, error=BTError('no response to command'))
+			if fut is not None:
+				resolve(fut, p)
+			return
+
+		# 属性读写过程的结果
+		if self.gatt and p.cls == 4 and (p.cmd == 5 or p.cmd == 1) and self.route_gatt(p):
+			return
+
+		# 事件包: 先满足等待该事件的调用者, 已被消费的不再分发
+		if self.waiters and self.take_event(p):
+			return
+
+		# 否则按积压策略放入有界队列, 队列满时丢弃最旧事件
+		p.source = self
+		depth = self.events.qsize()
+		if not self.backpressure.admit(p, depth):
+			self.dropped += 1
+			return
+		while True:
+			try:
+				self.events.put_nowait(p)
+				depth += 1
+				break
+			except queue.Full:
+				try:
+					self.events.get_nowait()
+					self.dropped += 1
+					self.backpressure.counts['oldest'] += 1
+				except queue.Empty:
+					pass
+		if depth > self.max_depth:
+			self.max_depth = depth
+
+	def route_gatt(self, p):
+		"""属性值(4,5)或过程完成(4,1)事件属于正在执行的读写时结束该过程, 返回是否已消费"""
+		pay = p.payload
+		con = pay[0]
+		with self.cond:
+			q = self.gatt.get(con)
+			req = q[0] if q else None
+		if req is None or req.deadline is None:
+			return False
+
+		if p.cmd == 5:		# 属性值: 只接受读取结果, 不接受同一属性的数据通知
+			_, attr, typ = ATTR_HEADER.unpack_from(pay)
+			if req.cmd != 4 or attr != req.attr or typ == 1:
+				return False
+			self.finish_gatt(con, req, p)
+			return True
+
+		result, attr = unpack('HH', pay[1:5])
+		if attr != req.attr:
+			return False
+		if result:
+			self.finish_gatt(con, req, error=BTError(
+				'%s on connection %d failed: 0x%04x' % (req.describe(), con, result)))
+		else:
+			self.finish_gatt(con, req, p)
+		return True
+
+	def submit(self, con, req):
+		"""将属性读写加入连接的队列, 队列空闲时立即发出, 返回Future"""
+		with self.cond:
+			self.check_active()
+			q = self.gatt.setdefault(con, deque())
+			q.append(req)
+			idle = len(q) == 1
+		if idle:
+			self.start_gatt(con, req)
+		return req.fut
+
+	def start_gatt(self, con, req):
+		"""发出队首的属性读写"""
+		req.deadline = time.monotonic() + req.timeout
+		try:
+			resp = self.send_command(4, req.cmd, req.payload, wait_resp=False, timeout=req.timeout)
+		except Exception as e:
+			self.finish_gatt(con, req, error=e)
+			return
+		resp.add_done_callback(lambda f: self.gatt_response(con, req, f))
+
+	def gatt_response(self, con, req, f):
+		"""属性读写命令的响应: 适配器拒绝时结束该过程"""
+		e = f.exception()
+		if e is None:
+			result = unpack('H', f.result().payload[-2:])[0]
+			if not result:
+				return
+			e = BTError('%s on connection %d rejected: 0x%04x' % (req.describe(), con, result))
+		self.finish_gatt(con, req, error=e)
+
+	def finish_gatt(self, con, req, p=None, error=None):
+		"""结束正在执行的属性读写并发出下一个"""
+		with self.cond:
+			q = self.gatt.get(con)
+			if not q or q[0] is not req:
+				return		# 已被超时或出错处理结束
+			q.popleft()
+			nxt = q[0] if q else None
+			if nxt is None:
+				del self.gatt[con]
+		if nxt is not None:
+			self.start_gatt(con, nxt)		# 先发出下一个, 再唤醒调用者
+		resolve(req.fut, p, error)
+
+	def queue_depth(self):
+		"""当前事件队列深度"""
+		return self.events.qsize()
+
+	def check_error(self):
+		"""读线程出错时在调用者线程抛出"""
+		if self.error is not None:
+			raise self.error
+
+	def check_active(self):
+		"""读线程出错或已暂停时抛出: 暂停期间没有线程接收响应, 命令和等待都不会结束"""
+		self.check_error()
+		if self.paused:
+			raise BTError('BT reader is paused (serial port handed to the native loop)')
+
+	def recv_packet(self, timeout=None):
+		"""取出一个事件包并交给处理器, 超时返回None"""
+		try:
+			p = self.events.get(timeout=timeout)
+		except queue.Empty:
+			self.check_error()
+			return None
+		self.track_lag(p)
+		p.source.handle_event(p)
+		return p
+
+	def track_lag(self, p):
+		"""记录事件从读线程接收到开始分发的延迟"""
+		if p.time is not None:
+			lag = time.monotonic() - p.time
+			self.lag = lag
+			if lag > self.max_lag:
+				self.max_lag = lag
+
+	def backpressure_stats(self):
+		"""积压统计: 串口积压(字节), 队列深度, 分发延迟(秒)和按原因统计的丢弃数"""
+		bp = self.backpressure
+		return {
+			'strategy': bp.strategy,
+			'overloaded': bp.overloaded,
+			'episodes': bp.episodes,
+			'backlog': self.backlog,
+			'max_backlog': self.max_backlog,
+			'depth': self.events.qsize(),
+			'max_depth': self.max_depth,
+			'lag': self.lag,
+			'max_lag': self.max_lag,
+			'dropped': self.dropped,
+			'dropped_by': dict(bp.counts),
+		}
+
+	def snapshot(self):
+		"""链路统计快照
+
+		reads: 每次读取的字节数; read_wait_us: 每次ser.read阻塞的时间; blocked: 自上次快照以来
+		读线程阻塞在ser.read中的时间比例; responses_per_s/events_per_s: 自上次快照以来的帧率;
+		parse_us: 每帧解析时间; handler_us: 每次dispatch中处理器的时间; 以及积压、解析和超时统计。
+		"""
+		now = time.monotonic()
+		total = self.throughput.packets
+		last = self.last_snapshot or (self.throughput.start_time, 0, 0, 0.0)
+		self.last_snapshot = (now, self.responses_total, total, self.read_wait_total)
+		dt = now - last[0]
+		responses = self.responses_total - last[1]
+		events = (total - last[2]) - responses
+		return {
+			'elapsed': dt,
+			'bytes': self.throughput.bytes,
+			'reads': self.read_bytes.snapshot(),
+			'read_wait_us': self.read_wait.snapshot(),
+			'blocked': (self.read_wait_total - last[3]) / dt if dt > 0 else 0.0,
+			'responses_per_s': responses / dt if dt > 0 else 0.0,
+			'events_per_s': events / dt if dt > 0 else 0.0,
+			'parse_us': self.parse_time.snapshot(),
+			'handler_us': self.handler_time.snapshot(),
+			'backpressure': self.backpressure_stats(),
+			'parser': self.parser.stats(),
+			'timeouts': self.timeouts,
+		}
+
+	@staticmethod
+	def format_snapshot(s):
+		"""快照格式化为一行日志"""
+		bp = s['backpressure']
+		return ('link: %.0f ev/s %.0f resp/s | read %.0fB avg, blocked %.0f%% | parse %.1fus/frame p99 %.0f | '
+				'handlers %.0fus/dispatch p99 %.0f max %.0f | backlog %dB depth %d lag %.1fms | '
+				'dropped %d resync %d timeouts %d') % (
+			s['events_per_s'], s['responses_per_s'], s['reads']['mean'], s['blocked'] * 100,
+			s['parse_us']['mean'], s['parse_us']['p99'],
+			s['handler_us']['mean'], s['handler_us']['p99'], s['handler_us']['max'],
+			bp['backlog'], bp['depth'], bp['lag'] * 1e3,
+			bp['dropped'], s['parser']['resyncs'], s['timeouts'])
+
+	def reset_stats(self):
+		"""清空直方图和峰值统计"""
+		for h in (self.read_bytes, self.read_wait, self.parse_time, self.handler_time):
+			h.reset()
+		self.max_backlog = 0
+		self.max_depth = 0
+		self.max_lag = 0.0
+
+	def dispatch(self, timeout=0.1):
+		"""分发队列中已有的事件, 队列为空时最多阻塞timeout秒, 返回分发数量
+
+		每次最多分发调用时已在队列中的事件, 处理跟不上时也能按时返回。
+		"""
+		try:
+			p = self.events.get(timeout=timeout)
+		except queue.Empty:
+			self.check_error()
+			return 0
+		self.track_lag(p)
+		t0 = time.perf_counter()
+		p.source.handle_event(p)
+		count = 1
+		limit = self.events.qsize() + 1
+		while count < limit:
+			try:
+				p = self.events.get_nowait()
+			except queue.Empty:
+				break
+			p.source.handle_event(p)
+			count += 1
+		self.handler_time.add(time.perf_counter() - t0)
+		return count
+
+	def close(self):
+		"""停止读线程并关闭串口, 未完成的命令以BTError结束"""
+		self.running = False
+		if self.reader.is_alive() and self.reader is not threading.current_thread():
+			self.reader.join(1.0)
+		self.ser.close()
+		if self.capture is not None:
+			self.capture.close()
+		if self.error is None:
+			self.fail(BTError('dongle closed'))
+
+	def pause_reader(self):
+		"""停止读线程(不关闭串口), 把串口交给原生循环, 返回串口文件描述符
+
+		暂停期间发送命令、读写属性或等待事件抛出BTError(没有线程接收响应);
+		暂停时仍在等待的命令和属性读写以BTError结束。
+		"""
+		self.running = False
+		if self.reader.is_alive() and self.reader is not threading.current_thread():
+			self.reader.join()
+		with self.cond:
+			self.paused = True
+		self.abort_pending(BTError('BT reader paused'))
+		return self.ser.fileno()
+
+	def resume_reader(self):
+		"""原生循环停止后恢复读线程, 丢弃暂停前未解析完的字节(解析统计保留)"""
+		if self.reader.is_alive():
+			return
+		self.parser.reset()
+		self.error = None
+		with self.cond:
+			self.paused = False
+		self.running = True
+		self.reader = threading.Thread(target=self.reader_func, daemon=True)
+		self.reader.start()
 
 	# 蓝牙命令实现
-	def connect(self, addr):
-		"""连接设备"""
-		return self.send_command(6, 3, pack('6sBHHHH', multichr(addr), 0, 6, 6, 64, 0))
+	def connect(self, addr, interval_min=6, interval_max=6, timeout=64, latency=0):
+		"""直接连接设备(连接间隔单位1.25ms, 监督超时单位10ms)"""
+		return self.send_command(6, 3, pack('6sBHHHH', multichr(addr), 0,
+											interval_min, interval_max, timeout, latency))
+
+	def update_connection(self, conn, interval_min, interval_max, timeout, latency):
+		"""修改已建立连接的参数, 生效后产生带参数变化标志的连接状态事件"""
+		return self.send_command(3, 2, pack('BHHHH', conn, interval_min, interval_max, latency, timeout))
 
 	def get_connections(self):
 		"""获取当前连接"""
@@ -181,51 +1390,108 @@ class BT(object):
 		"""断开连接"""
 		return self.send_command(3, 0, pack('B', h))
 
-	def read_attr(self, con, attr):
+	def disconnect_wait(self, h, timeout=None):
+		"""断开连接并等待断开事件, 避免它在之后被当作新连接的断开; 该句柄未连接时返回False"""
+		fut = self.expect_event(3, 4, lambda p: p.payload[0] == h)
+		resp = self.disconnect(h)
+		if unpack('H', resp.payload[-2:])[0]:		# 未连接
+			self.cancel_wait(fut)
+			return False
+		self.wait(fut, timeout, 'disconnect %d' % h)
+		return True
+
+	def read_attr_async(self, con, attr, timeout=None):
+		"""排队读取属性, 返回Future(结果为属性值事件)"""
+		req = GattRequest(4, attr, pack('BH', con, attr), self.timeout if timeout is None else timeout)
+		return self.submit(con, req)
+
+	def write_attr_async(self, con, attr, val, timeout=None):
+		"""排队写入属性, 返回Future(结果为过程完成事件)"""
+		req = GattRequest(5, attr, pack('BHB', con, attr, len(val)) + val,
+						  self.timeout if timeout is None else timeout)
+		return self.submit(con, req)
+
+	def read_attr(self, con, attr, timeout=None):
 		"""读取属性"""
-		self.send_command(4, 4, pack('BH', con, attr))
-		return self.wait_event(4, 5)
+		return self.read_attr_async(con, attr, timeout).result()
 
-	def write_attr(self, con, attr, val):
+	def write_attr(self, con, attr, val, timeout=None):
 		"""写入属性"""
-		self.send_command(4, 5, pack('BHB', con, attr, len(val)) + val)
-		return self.wait_event(4, 1)
+		return self.write_attr_async(con, attr, val, timeout).result()
 
-	def send_command(self, cls, cmd, payload=b'', wait_resp=True):
-		"""发送蓝牙命令"""
+	def send_command(self, cls, cmd, payload=b'', wait_resp=True, timeout=None):
+		"""发送蓝牙命令, 等待读线程转交的响应包
+
+		响应在timeout秒(默认self.timeout)内未到达时抛出CommandTimeout;
+		wait_resp为False时返回Future。
+		"""
 		s = pack('4B', 0, len(payload), cls, cmd) + payload
-		self.ser.write(s)
+		fut = Future()
+		deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+		with self.lock:
+			with self.cond:
+				self.check_active()
+				self.responses.append((cls, cmd, fut, deadline))
+			self.ser.write(s)
 
-		while True:
-			p = self.recv_packet()
-			# no timeout, so p won't be None
-			if p.typ == 0:# 响应包
-				return p
-			# not a response: must be an event非响应包作为事件处理
-			self.handle_event(p)
+		if not wait_resp:
+			return fut
+		return fut.result()	# 期限由读线程保证
 
 
 class Myo(object):
 	"""实现Myo特定的通信协议"""
 	'''Implements the Myo-specific communication protocol.'''
 
-	def __init__(self, tty=None, mode=1):
-		"""初始化Myo连接"""
-		if tty is None:
-			tty = self.detect_tty()		# 自动检测串口
-		if tty is None:
-			raise ValueError('Myo dongle not found!')
-
-		self.bt = BT(tty)		# 蓝牙实例
+	def __init__(self, tty=None, mode=1, bt=None, capture=None, cache=None, backpressure='drop_oldest',
+				 stats_interval=None):
+		"""初始化Myo连接
+
+		bt不为None时复用已有的蓝牙实例; capture不为None时录制串口原始字节流到该文件;
+		cache不为None时将设备地址、固件版本和连接参数缓存到该文件, 用于快速重连;
+		backpressure为处理跟不上数据时的策略(见Backpressure);
+		stats_interval不为None时每隔该秒数打印一行链路统计(见BT.snapshot)。
+		"""
+		if bt is None:
+			if tty is None:
+				tty = Myo.detect_tty()		# 自动检测串口
+			if tty is None:
+				raise ValueError('Myo dongle not found!')
+			bt = BT(tty, capture=capture, backpressure=backpressure, stats_interval=stats_interval)
+
+		self.bt = bt			# 蓝牙实例
 		self.conn = None		# 当前连接
+		self.addr = None		# 已连接设备的MAC地址
+		self.version = None		# 固件版本
+		self.old = None			# 是否为旧固件(连接后设置)
+		self.streams = set()	# 设备上已开启的数据流
+		self.conn_params = None	# 协商的连接参数
+		self.conn_profile = None	# 请求的连接参数配置名(None为缓存的参数或默认配置)
+		self.cache = DeviceCache(cache) if cache else None	# 设备缓存
+		self.subscribed_conn = None	# 数据事件订阅所属的连接
 		self.emg_handlers = []
 		self.imu_handlers = []
 		self.arm_handlers = []
 		self.pose_handlers = []
 		self.battery_handlers = []
+		self.disconnect_handlers = []
+		self.emg_block_handlers = []
+		self.emg_blocks = EMGBlockBuffer()	# EMG数据块累积器
+		self.emg_seq = EMGSequencer()		# EMG序列重建与丢包统计
+		self.emg_latency_sum = 0.0			# 块交付延迟累计(秒)
+		self.emg_latency_max = 0.0			# 块交付最大延迟(秒)
+		self.emg_latency_count = 0
+		self.emg_stale = 0				# 切换模式后丢弃的旧模式EMG通知数
+		self.emg_mode_handlers = []
+		self.imu_ring = IMURingBuffer()	# 最近的IMU采样
+		self.fusion = None				# EMG+IMU融合(有融合帧处理器时创建)
+		self.pending = []		# 已发出尚未确认的属性写入
 		self.mode = mode		# EMG模式
+		self.bt.subscribe(3, 4, None, self.handle_disconnected)	# 连接断开事件
+		self.bt.subscribe(3, 0, None, self.handle_status)		# 连接参数变化
 
-	def detect_tty(self):
+	@staticmethod
+	def detect_tty():
 		"""检测Myo蓝牙适配器串口"""
 		for p in comports():
 			if re.search(r'PID=2458:0*1', p[2]):		# Myo适配器的USB PID
@@ -234,44 +1500,265 @@ class Myo(object):
 
 		return None
 
-	def run(self):
-		"""主循环，处理接收到的数据包"""
-		self.bt.recv_packet()
+	def run(self, timeout=0.1):
+		"""主循环，分发读线程已接收的数据包(无数据时最多阻塞timeout秒)"""
+		n = self.bt.dispatch(timeout)
+		self.flush_emg_block()
+		return n
+
+	def flush_emg_block(self):
+		"""数据流停顿时也按延迟上限交付未满的EMG块"""
+		if self.emg_block_handlers and self.emg_blocks.ready(time.monotonic()):
+			self.on_emg_block(*self.emg_blocks.take())
 
-	def connect(self, addr=None):
+	def close(self):
+		"""关闭蓝牙串口"""
+		self.bt.close()
+
+	def connect(self, addr=None, reset=True, exclude=(), timeout=CONNECT_TIMEOUT, profile=None):
 		"""连接Myo设备
-		地址：Addr is the MAC address in format: [93, 41, 55, 245, 82, 194]"""
+		地址：Addr is the MAC address in format: [93, 41, 55, 245, 82, 194]
+		reset为False时保留适配器上的其他连接(多臂环共用适配器), exclude为扫描时跳过的地址;
+		addr为None且有设备缓存时先直接连接最近连接过的设备, 找不到再扫描;
+		profile为连接参数配置名(见CONN_PROFILES), 之后的重连沿用"""
+		self.begin_connect(profile)
 
 		# 清理之前的现有连接
 		self.bt.end_scan()
-		self.bt.disconnect(0)
-		self.bt.disconnect(1)
-		self.bt.disconnect(2)
-
-		# 扫描设备
-		if (addr is None):
-			print('scanning...')
-			self.bt.discover()
-			while True:
-				p = self.bt.recv_packet()
+		if reset:
+			for h in range(3):
+				self.bt.disconnect_wait(h)
+
+		# 直接连接缓存的设备
+		if addr is None and self.cache is not None:
+			addr = self.cache.recent(exclude)
+			if addr is not None:
+				try:
+					self.connect_direct(addr, DIRECT_CONNECT_TIMEOUT)
+				except CommandTimeout:
+					print('cached device %s not found' % mac_str(addr))
+					addr = None
+
+		if self.conn is None:
+			if addr is None:
+				addr = self.scan(exclude)
+			self.connect_direct(addr, timeout)
+
+		self.setup()
+
+	def begin_connect(self, profile):
+		"""开始连接: 检查并记录连接参数配置, 清除当前连接"""
+		if profile is not None:
+			if profile not in CONN_PROFILES:
+				raise ValueError('unknown connection profile: %s' % profile)
+			self.conn_profile = profile
+		self.conn = None
+
+	def scan(self, exclude=()):
+		"""扫描Myo设备, 返回第一个不在exclude中的地址"""
+		print('scanning...')
+		self.bt.discover()
+		while True:
+			p = self.bt.recv_packet(0.5)
+			if p is None:
+				continue
+			# 检查是否是Myo设备
+			if p.payload.endswith(MYO_SERVICE):
 				print('scan response:', p)
-				# 检查是否是Myo设备
-				if p.payload.endswith(b'\x06\x42\x48\x12\x4A\x7F\x2C\x48\x47\xB9\xDE\x04\xA9\x01\x00\x06\xD5'):
-					addr = list(multiord(p.payload[2:8]))
+				addr = list(multiord(p.payload[2:8]))
+				if addr not in exclude:
 					break
-			self.bt.end_scan()
+		self.bt.end_scan()
+		return addr
+
+	def connect_direct(self, addr, timeout):
+		"""直接连接指定地址的设备并等待连接建立, timeout秒内未建立时取消并抛出CommandTimeout"""
+		request, source = self.conn_request(addr)
+
 		# 连接设备并等待状态事件
-		conn_pkt = self.bt.connect(addr)
-		self.conn = multiord(conn_pkt.payload)[-1]
-		self.bt.wait_event(3, 0)# 等待连接完成事件
+		status = self.bt.expect_event(3, 0)
+		conn_pkt = self.bt.connect(addr, request['interval_min'], request['interval_max'],
+								   request['timeout'], request['latency'])
+		result, conn = unpack('HB', conn_pkt.payload[:3])
+		if result:
+			self.bt.cancel_wait(status)
+			raise BTError('connect %s failed: 0x%04x' % (mac_str(addr), result))
+		try:
+			p = self.bt.wait(status, timeout, 'connection status')# 等待连接完成事件
+		except CommandTimeout:
+			self.bt.end_scan()		# 取消仍在进行的连接过程
+			raise
+		self.set_connected(addr, conn, p, request, source)
+
+	def conn_request(self, addr):
+		"""连接addr时请求的连接参数, 返回(参数, 来源): 未指定配置时使用缓存中上次协商的参数"""
+		entry = self.cache.get(addr) if self.cache is not None else None
+		cached = entry.get('params') if entry else None
+		if self.conn_profile is None and cached:		# 使用上次协商的连接参数
+			request = {'interval_min': cached['interval'], 'interval_max': cached['interval'],
+					   'timeout': cached['timeout'], 'latency': cached['latency']}
+			return request, 'cached'
+		source = self.conn_profile or DEFAULT_CONN_PROFILE
+		return CONN_PROFILES[source], source
+
+	def set_connected(self, addr, conn, status, request, source):
+		"""连接建立: 记录连接句柄、地址和连接状态事件status中协商的参数"""
+		self.conn = conn
+		self.addr = list(addr)
+		self.set_conn_params(status)
+		print('connection params: %s (requested %s: interval %.2f~%.2fms)' % (
+			self.describe_conn_params(), source, request['interval_min'] * 1.25, request['interval_max'] * 1.25))
+
+	def set_conn_params(self, p):
+		"""从连接状态事件读取协商的连接参数"""
+		_, _, _, _, interval, sup_timeout, latency, _ = unpack('BB6sBHHHB', p.payload[:16])
+		self.conn_params = {'interval': interval, 'timeout': sup_timeout, 'latency': latency}
+
+	def describe_conn_params(self):
+		"""协商的连接参数(毫秒)的描述"""
+		c = self.conn_params
+		if c is None:
+			return 'not connected'
+		return 'interval %.2fms, latency %d, timeout %dms' % (c['interval'] * 1.25, c['latency'], c['timeout'] * 10)
+
+	def set_conn_profile(self, profile):
+		"""在已建立的连接上切换连接参数配置, 新参数生效后由连接状态事件更新conn_params"""
+		if profile not in CONN_PROFILES:
+			raise ValueError('unknown connection profile: %s' % profile)
+		self.conn_profile = profile
+		if self.conn is None:
+			return
+		r = CONN_PROFILES[profile]
+		resp = self.bt.update_connection(self.conn, r['interval_min'], r['interval_max'], r['timeout'], r['latency'])
+		result = unpack('H', resp.payload[-2:])[0]
+		if result:
+			raise BTError('connection update failed: 0x%04x' % result)
+
+	def handle_status(self, p):
+		"""连接状态事件(3, 0): 本连接的参数变化时更新并记录"""
+		if self.conn is None or p.payload[0] != self.conn or not p.payload[1] & 0x08:
+			return
+		self.set_conn_params(p)
+		print('connection params changed: %s' % self.describe_conn_params())
+		if self.cache is not None:
+			self.cache.update(self.addr, params=self.conn_params)
+
+	def setup(self):
+		"""连接建立后读取固件版本(有缓存时跳过)并写入配置"""
+		entry = self.cached_device()
+		name = None
+		if not self.use_cached_firmware(entry):
+			# 获取固件版本
+			fw = self.read_attr(0x17)
+			self.set_firmware(fw.payload)
+			# 设备名读取与配置写入在适配器中排队连续发出, 最后统一等待
+			name = None if self.old else self.bt.read_attr_async(self.conn, 0x03)
+
+		self.configure()
+		self.drain()
+		self.finish_setup(entry, None if name is None else name.result().payload)
+
+	def cached_device(self):
+		"""已连接设备的缓存条目(没有时为None)"""
+		return self.cache.get(self.addr) if self.cache is not None else None
+
+	def use_cached_firmware(self, entry):
+		"""缓存条目中有固件版本时直接使用(不再读取属性)并返回True"""
+		if entry and entry.get('firmware'):
+			self.set_version(entry['firmware'])
+			print('device name: %s' % entry.get('name'))
+			return True
+		return False
+
+	def finish_setup(self, entry, name_payload):
+		"""配置写入完成后: 打印设备名(name_payload为读取0x03属性的事件载荷或None), 订阅数据, 更新设备缓存"""
+		name = None
+		if name_payload is not None:
+			name = name_payload[ATTR_VALUE_OFFSET:].decode('utf-8', 'replace')
+			print('device name: %s' % name)
+
+		# 添加数据处理器
+		# add data handlers
+		self.subscribe_data()
+
+		if self.cache is not None:
+			if entry and entry.get('firmware'):
+				name = entry.get('name')
+			self.cache.update(self.addr, firmware=list(self.version), name=name, params=self.conn_params)
 
-		# 获取固件版本
-		fw = self.read_attr(0x17)
-		_, _, _, _, v0, v1, v2, v3 = unpack('BHBBHHHH', fw.payload)
+	def set_firmware(self, payload):
+		"""解析固件版本属性值(0x17)"""
+		_, _, _, _, v0, v1, v2, v3 = unpack('BHBBHHHH', payload)
+		self.set_version((v0, v1, v2, v3))
+
+	def set_version(self, version):
+		"""设置固件版本"""
+		v0, v1, v2, v3 = version
 		print('firmware version: %d.%d.%d.%d' % (v0, v1, v2, v3))
+		self.version = tuple(version)
 
 		self.old = (v0 == 0)# 标记是否为旧固件
-
+		self.apply_emg_mode()
+
+	def emg_uint16(self):
+		"""EMG数据是否来自0x27(预处理模式或旧固件, 8个uint16), 否则来自0x2b~0x34(int8)"""
+		return bool(self.old) or self.mode == emg_mode.PREPROCESSED
+
+	def emg_rate(self):
+		"""当前模式的EMG采样率(Hz): 预处理/旧固件为50Hz, 其余为200Hz"""
+		return 50 if self.emg_uint16() else 200
+
+	def apply_emg_mode(self):
+		"""按当前模式重置EMG序列统计并通知模式处理器"""
+		self.emg_seq.reset()
+		self.emg_seq.set_rate(self.emg_rate())
+		self.on_emg_mode(self.mode, self.emg_rate(), EMG_UINT16 if self.emg_uint16() else EMG_INT8)
+
+	def set_emg_mode(self, mode):
+		"""在已建立的连接上切换EMG模式, 无需重新连接
+
+		先交付旧模式已累积的EMG块, 关闭旧模式的EMG特性, 再开启新模式并重写0x19模式命令;
+		切换后仍在途的旧模式通知被丢弃(计入emg_stale)。模式处理器收到新的采样率和数据类型。
+		未连接时只修改模式, 在下次连接时生效。
+		"""
+		if mode == self.mode:
+			return
+		if self.old:
+			print('old firmware only supports the 50Hz EMG stream')
+			return
+
+		# 旧模式已累积的采样先交付, 不与新模式的数据混在一个块中
+		if self.emg_block_handlers and self.emg_blocks.stamps:
+			self.on_emg_block(*self.emg_blocks.take())
+		self.emg_blocks.clear()
+
+		if self.conn is not None and 'emg' in self.streams:
+			old_cccds = self.stream_cccds('emg')
+			self.mode = mode
+			for attr in old_cccds:
+				if attr not in self.stream_cccds('emg'):
+					self.write_attr(attr, b'\x00\x00')
+			self.streams.discard('emg')
+		else:
+			self.mode = mode
+		self.update_streams()		# 开启新模式的EMG特性并写入模式命令
+		if self.old is not None:
+			self.apply_emg_mode()
+
+	def reconnect(self, tries=5, delay=0.1, max_delay=2.0, reset=False):
+		"""连接断开后直接重连上次的设备, 失败时按指数退避重试, 成功返回True"""
+		for i in range(tries):
+			try:
+				self.connect(self.addr, reset=reset, timeout=DIRECT_CONNECT_TIMEOUT)
+				return True
+			except BTError as e:
+				print('reconnect %d/%d failed: %s' % (i + 1, tries, e))
+			time.sleep(delay)
+			delay = min(delay * 2, max_delay)
+		return False
+
+	def configure(self):
+		"""连接后按固件版本和EMG模式写入订阅和传感器参数"""
 		if self.old:
 			# 旧固件初始化
 			# don't know what these do; Myo Connect sends them, though we get data
@@ -308,112 +1795,207 @@ class Myo(object):
 			self.write_attr(0x19, pack('BBBBHBBBBB', 2, 9, 2, 1, C, emg_smooth, C // emg_hz, imu_hz, 0, 0))
 
 		else:
-			# 新固件初始化
-			name = self.read_attr(0x03)
-			print('device name: %s' % name.payload)
-
-			# 启用IMU数据
-			self.write_attr(0x1d, b'\x01\x00')
-			# 启用手臂检测通知
-			self.write_attr(0x24, b'\x02\x00')
-			# 根据模式启用EMG
-			if (self.mode == emg_mode.PREPROCESSED):
-				# Send the undocumented filtered 50Hz.
-				print("Starting filtered, 0x01")
-				self.start_filtered() # 0x01预处理50Hz模式
-			elif (self.mode == emg_mode.FILTERED):
-				print("Starting raw filtered, 0x02")
-				self.start_raw() # 0x02原始滤波200Hz模式
-			elif (self.mode == emg_mode.RAW):
-				print("Starting raw, unfiltered, 0x03")
-				self.start_raw_unfiltered() #0x03原始未滤波模式
-			else:
-				print("No EMG mode selected, not sending EMG data")
+			# 新固件初始化: 只启用已注册处理器的数据流(IMU/手臂姿势/电池按需开启)
+			self.streams = set()
+			self.update_streams()
 			# Stop the Myo Disconnecting
 			# 设置睡眠模式
 			self.sleep_mode(1)
 
-			# 启用电池通知
-			# enable battery notifications
-			self.write_attr(0x12, b'\x01\x10')
-
-		# 添加数据处理器
-		# add data handlers
-		def handle_data(p):
-			"""处理接收到的数据"""
-			if (p.cls, p.cmd) != (4, 5):
-				return
-
-			c, attr, typ = unpack('BHB', p.payload[:4])
-			pay = p.payload[5:]
-
-			# EMG数据处理
-			if attr == 0x27:	# 旧固件EMG数据
-				# Unpack a 17 byte array, first 16 are 8 unsigned shorts, last one an unsigned char
-				vals = unpack('8HB', pay)
-				# not entirely sure what the last byte is, but it's a bitmask that
-				# seems to indicate which sensors think they're being moved around or
-				# something
-				emg = vals[:8]		# 8个EMG通道数据
-				moving = vals[8]	# 运动标志
-				self.on_emg(emg, moving)
-			# 新固件EMG数据处理(4个特性)
-			# Read notification handles corresponding to the for EMG characteristics
-			elif attr == 0x2b or attr == 0x2e or attr == 0x31 or attr == 0x34:
-				'''According to http://developerblog.myo.com/myocraft-emg-in-the-bluetooth-protocol/
-				each characteristic sends two secuential readings in each update,
-				so the received payload is split in two samples. According to the
-				Myo BLE specification, the data type of the EMG samples is int8_t.
-				'''
-				# 每个特性包含2个连续采样(8个int8_t值)
-				emg1 = struct.unpack('<8b', pay[:8])
-				emg2 = struct.unpack('<8b', pay[8:])
-				self.on_emg(emg1, 0)
-				self.on_emg(emg2, 0)
-			# Read IMU characteristic handle
-			# IMU数据处理
-			elif attr == 0x1c:
-				vals = unpack('10h', pay)
-				quat = vals[:4]	# 四元数
-				acc = vals[4:7]	# 加速度
-				gyro = vals[7:10]	# 陀螺仪
-				self.on_imu(quat, acc, gyro)
-			# Read classifier characteristic handle
-			# 分类器数据处理(手臂/姿势)
-			elif attr == 0x23:
-				typ, val, xdir, _, _, _ = unpack('6B', pay)
-
-				if typ == 1:  # 戴在手臂上
-					self.on_arm(Arm(val), XDirection(xdir))
-				elif typ == 2:  #  从手臂移除
-					self.on_arm(Arm.UNKNOWN, XDirection.UNKNOWN)
-				elif typ == 3:  # 姿势
-					self.on_pose(Pose(val))
-			# 电池数据处理
-			elif attr == 0x11:
-				battery_level = ord(pay)
-				self.on_battery(battery_level)
-			else:
-				print('data with unknown attr: %02X %s' % (attr, p))
-
-		self.bt.add_handler(handle_data)
+	def wanted_streams(self):
+		"""按已注册的处理器确定需要的数据流"""
+		streams = set()
+		if (self.emg_handlers or self.emg_block_handlers) and self.mode in EMG_MODE_BYTES:
+			streams.add('emg')
+		if self.imu_handlers or self.fusion is not None:
+			streams.add('imu')
+		if self.pose_handlers or self.arm_handlers:
+			streams.add('classifier')
+		if self.battery_handlers:
+			streams.add('battery')
+		return streams
+
+	def update_streams(self):
+		"""使设备开启的数据流与已注册的处理器一致(只写入有变化的特性)
+
+		连接前或旧固件时不做任何事, 旧固件在configure中固定开启所有数据流。
+		"""
+		if self.conn is None or self.old is not False:
+			return
+		wanted = self.wanted_streams()
+		if wanted == self.streams:
+			return
+		on = wanted - self.streams
+		off = self.streams - wanted
+		for stream in on | off:
+			val = STREAM_CCCD_ON[stream] if stream in on else b'\x00\x00'
+			for attr in self.stream_cccds(stream):
+				self.write_attr(attr, val)
+		if (on | off) - {'battery'}:
+			# 设置EMG/IMU/分类器模式: [命令, 长度, EMG模式, IMU模式, 分类器模式]
+			emg = EMG_MODE_BYTES[self.mode] if 'emg' in wanted else 0
+			self.write_attr(0x19, pack('5B', 1, 3, emg, int('imu' in wanted), int('classifier' in wanted)))
+		if 'emg' in on:
+			print('Starting %s EMG, 0x%02x' % (self.mode.name.lower(), EMG_MODE_BYTES[self.mode]))
+		print('streams: %s' % (', '.join(sorted(wanted)) or 'none'))
+		self.streams = wanted
+
+	def stream_cccds(self, stream):
+		"""数据流对应的通知配置描述符句柄"""
+		if stream == 'emg':
+			return (0x28,) if self.mode == emg_mode.PREPROCESSED else (0x2c, 0x2f, 0x32, 0x35)
+		return STREAM_CCCDS[stream]
+
+	def stream_rate(self):
+		"""已开启的数据流和自上次调用以来的接收速率(包/秒, 字节/秒)"""
+		bps, pps = self.bt.throughput.rate()
+		return {'streams': sorted(self.streams), 'packets_per_s': pps, 'bytes_per_s': bps}
+
+	def subscribe_data(self):
+		"""按属性句柄订阅本连接的数据事件(重复调用不会重复订阅)"""
+		self.unsubscribe_data()
+		for attr, h in self.data_handlers().items():
+			self.bt.subscribe(4, 5, attr, h, self.conn)
+		self.subscribed_conn = self.conn
+
+	def unsubscribe_data(self):
+		"""取消上一次连接的数据事件订阅"""
+		if self.subscribed_conn is None:
+			return
+		for attr, h in self.data_handlers().items():
+			self.bt.unsubscribe(4, 5, attr, h, self.subscribed_conn)
+		self.subscribed_conn = None
+
+	def data_handlers(self):
+		"""属性句柄 -> 数据处理方法"""
+		return {
+			0x27: self.handle_emg_old,		# 旧固件/预处理EMG
+			0x2b: self.handle_emg,			# 新固件EMG(4个特性)
+			0x2e: self.handle_emg,
+			0x31: self.handle_emg,
+			0x34: self.handle_emg,
+			0x1c: self.handle_imu,			# IMU
+			0x23: self.handle_classifier,	# 手臂/姿势
+			0x11: self.handle_battery,		# 电池
+		}
+
+	# 数据事件处理
+	def handle_emg_old(self, p):
+		"""旧固件EMG数据"""
+		if not self.emg_uint16():
+			self.emg_stale += 1		# 切换模式后在途的旧模式通知
+			return
+		pay = p.payload
+		raw = pay[ATTR_VALUE_OFFSET:ATTR_VALUE_OFFSET + 16]
+		t = p.time if p.time is not None else time.monotonic()
+		stamps = self.emg_seq.stamp(0x27, raw, t, 1)
+		if self.emg_handlers:
+			# Unpack a 17 byte array, first 16 are 8 unsigned shorts, last one an unsigned char
+			vals = EMG_OLD_DATA.unpack_from(pay, ATTR_VALUE_OFFSET)
+			# not entirely sure what the last byte is, but it's a bitmask that
+			# seems to indicate which sensors think they're being moved around or
+			# something
+			emg = vals[:8]		# 8个EMG通道数据
+			moving = vals[8]	# 运动标志
+			self.on_emg(emg, moving)
+		if self.emg_block_handlers:
+			self.add_emg_block(raw, EMG_UINT16, stamps)
+
+	def handle_emg(self, p):
+		"""新固件EMG数据(0x2b/0x2e/0x31/0x34)"""
+		'''According to http://developerblog.myo.com/myocraft-emg-in-the-bluetooth-protocol/
+		each characteristic sends two secuential readings in each update,
+		so the received payload is split in two samples. According to the
+		Myo BLE specification, the data type of the EMG samples is int8_t.
+		'''
+		if self.mode == emg_mode.PREPROCESSED:
+			self.emg_stale += 1		# 切换模式后在途的旧模式通知
+			return
+		pay = p.payload
+		attr = ATTR_HEADER.unpack_from(pay)[1]
+		raw = pay[ATTR_VALUE_OFFSET:ATTR_VALUE_OFFSET + 16]
+		t = p.time if p.time is not None else time.monotonic()
+		stamps = self.emg_seq.stamp(attr, raw, t)
+		if stamps is None:
+			return		# 重复通知
+		if self.emg_handlers:
+			# 每个特性包含2个连续采样(8个int8_t值)
+			vals = EMG_DATA.unpack_from(pay, ATTR_VALUE_OFFSET)
+			self.on_emg(vals[:8], 0)
+			self.on_emg(vals[8:], 0)
+		if self.emg_block_handlers:
+			self.add_emg_block(raw, EMG_INT8, stamps)
+
+	def handle_imu(self, p):
+		"""IMU数据"""
+		vals = IMU_DATA.unpack_from(p.payload, ATTR_VALUE_OFFSET)
+		self.imu_ring.append(vals, p.time if p.time is not None else time.monotonic())
+		quat = vals[:4]		# 四元数
+		acc = vals[4:7]		# 加速度
+		gyro = vals[7:10]	# 陀螺仪
+		self.on_imu(quat, acc, gyro)
+
+	def handle_classifier(self, p):
+		"""分类器数据(手臂/姿势)"""
+		typ, val, xdir, _, _, _ = CLASSIFIER_DATA.unpack_from(p.payload, ATTR_VALUE_OFFSET)
+
+		if typ == 1:  # 戴在手臂上
+			self.on_arm(Arm(val), XDirection(xdir))
+		elif typ == 2:  #  从手臂移除
+			self.on_arm(Arm.UNKNOWN, XDirection.UNKNOWN)
+		elif typ == 3:  # 姿势
+			self.on_pose(Pose(val))
+
+	def handle_disconnected(self, p):
+		"""连接断开事件(3, 4): 本连接意外断开时通知处理器"""
+		conn, reason = unpack('BH', p.payload[:3])
+		if conn != self.conn:
+			return
+		self.conn = None
+		print('connection lost: 0x%04x' % reason)
+		self.on_disconnect(reason)
+
+	def handle_battery(self, p):
+		"""电池数据"""
+		battery_level = BATTERY_DATA.unpack_from(p.payload, ATTR_VALUE_OFFSET)[0]
+		self.on_battery(battery_level)
 
 	# 属性读写方法
 	def write_attr(self, attr, val):
-		"""写入属性"""
-		if self.conn is not None:
-			self.bt.write_attr(self.conn, attr, val)
+		"""写入属性, 返回Future
+
+		写入在适配器中按顺序排队执行, 不等待完成; 需要确认时调用drain()。
+		"""
+		if self.conn is None:
+			return None
+		fut = self.bt.write_attr_async(self.conn, attr, val)
+		pending = []
+		for f in self.pending:
+			if not f.done():
+				pending.append(f)
+			elif f.exception() is not None:
+				print('write failed:', f.exception())
+		pending.append(fut)
+		self.pending = pending
+		return fut
 
 	def read_attr(self, attr):
-		"""读取属性"""
+		"""读取属性(在已排队的写入之后执行)"""
 		if self.conn is not None:
 			return self.bt.read_attr(self.conn, attr)
 		return None
 
+	def drain(self):
+		"""等待所有已发出的属性写入完成, 任一失败或超时时抛出其异常"""
+		pending, self.pending = self.pending, []
+		for fut in pending:
+			fut.result()
+
 	def disconnect(self):
 		"""断开连接"""
 		if self.conn is not None:
-			self.bt.disconnect(self.conn)
+			conn, self.conn = self.conn, None
+			self.bt.disconnect_wait(conn)	# 消费断开事件, 不留到新连接建立之后
 
 	# 设备控制方法
 	def sleep_mode(self, mode):
@@ -571,25 +2153,119 @@ class Myo(object):
 	#     return ord(battery_level.payload[5])
 
 	# 数据处理器管理
+	# 连接后增删处理器时按需开启或关闭设备上对应的数据流
 	def add_emg_handler(self, h):
 		"""添加EMG处理器"""
 		self.emg_handlers.append(h)
+		self.update_streams()
+
+	def remove_emg_handler(self, h):
+		"""移除EMG处理器"""
+		self.remove_handler(self.emg_handlers, h)
+
+	def add_emg_block_handler(self, h, block_size=None, max_latency=None):
+		"""添加EMG数据块处理器
+
+		h(block, stamps): block为(N, 8)的np.int8(原始模式)或np.uint16(预处理模式)数组,
+		stamps为每个采样的到达时间(time.monotonic)。
+		block_size/max_latency不为None时修改块大小和延迟上限(所有块处理器共用)。
+		"""
+		if block_size is not None:
+			self.emg_blocks.block_size = block_size
+		if max_latency is not None:
+			self.emg_blocks.max_latency = max_latency
+		self.emg_block_handlers.append(h)
+		self.update_streams()
+
+	def remove_emg_block_handler(self, h):
+		"""移除EMG数据块处理器"""
+		if not self.remove_handler(self.emg_block_handlers, h):
+			return
+		if not self.emg_block_handlers:
+			self.emg_blocks.clear()
+
+	def add_emg_mode_handler(self, h):
+		"""添加EMG模式处理器h(mode, rate, dtype), 连接和切换模式时调用"""
+		self.emg_mode_handlers.append(h)
+
+	def add_fused_handler(self, h, fields=None, block_size=None, max_latency=None):
+		"""添加EMG+IMU融合帧处理器
+
+		h(frame, stamps): frame为(N, 8 + IMU列数)的float32数组, 前8列为EMG,
+		之后为fields指定的IMU量('quat', 'acc', 'gyro', 换算为单位值)在各采样时刻的最新值。
+		fields不为None时修改IMU量(所有融合帧处理器共用), 默认只取四元数。
+		block_size/max_latency含义同add_emg_block_handler。
+		"""
+		if self.fusion is None:
+			self.fusion = EMGIMUFusion(self.imu_ring, fields or ('quat',))
+			self.fusion.handlers.append(h)
+			self.add_emg_block_handler(self.fusion.handle_block, block_size, max_latency)
+			return
+		if fields is not None:
+			self.fusion.set_fields(fields)
+		if block_size is not None:
+			self.emg_blocks.block_size = block_size
+		if max_latency is not None:
+			self.emg_blocks.max_latency = max_latency
+		self.fusion.handlers.append(h)
+
+	def remove_fused_handler(self, h):
+		"""移除融合帧处理器, 没有融合帧处理器时关闭IMU融合"""
+		if self.fusion is None or h not in self.fusion.handlers:
+			return
+		self.fusion.handlers.remove(h)
+		if not self.fusion.handlers:
+			fusion, self.fusion = self.fusion, None
+			self.remove_emg_block_handler(fusion.handle_block)
 
 	def add_imu_handler(self, h):
 		"""添加IMU处理器"""
 		self.imu_handlers.append(h)
+		self.update_streams()
+
+	def remove_imu_handler(self, h):
+		"""移除IMU处理器"""
+		self.remove_handler(self.imu_handlers, h)
 
 	def add_pose_handler(self, h):
 		"""添加姿势处理器"""
 		self.pose_handlers.append(h)
+		self.update_streams()
+
+	def remove_pose_handler(self, h):
+		"""移除姿势处理器"""
+		self.remove_handler(self.pose_handlers, h)
 
 	def add_arm_handler(self, h):
 		"""添加手臂位置处理器"""
 		self.arm_handlers.append(h)
+		self.update_streams()
+
+	def remove_arm_handler(self, h):
+		"""移除手臂位置处理器"""
+		self.remove_handler(self.arm_handlers, h)
 
 	def add_battery_handler(self, h):
 		"""添加电池处理器"""
 		self.battery_handlers.append(h)
+		self.update_streams()
+
+	def remove_battery_handler(self, h):
+		"""移除电池处理器"""
+		self.remove_handler(self.battery_handlers, h)
+
+	def remove_handler(self, handlers, h):
+		"""从处理器列表中移除h并更新数据流, 返回是否移除"""
+		try:
+			handlers.remove(h)
+		except ValueError:
+			return False
+		self.update_streams()
+		return True
+
+	def add_disconnect_handler(self, h):
+		"""添加连接断开处理器h(reason)"""
+		self.disconnect_handlers.append(h)
 
 	# 数据回调方法
 	def on_emg(self, emg, moving):
@@ -597,6 +2273,38 @@ class Myo(object):
 		for h in self.emg_handlers:
 			h(emg, moving)
 
+	def add_emg_block(self, raw, dtype, stamps):
+		"""累积一次EMG通知, 达到块大小或延迟上限时交付"""
+		now = time.monotonic()
+		self.emg_blocks.append(raw, dtype, stamps, now)
+		if self.emg_blocks.ready(now):
+			self.on_emg_block(*self.emg_blocks.take())
+
+	def on_emg_block(self, block, stamps):
+		"""EMG数据块回调"""
+		# 统计块内最早采样到交付时的延迟
+		latency = time.monotonic() - stamps[0]
+		self.emg_latency_sum += latency
+		self.emg_latency_count += 1
+		if latency > self.emg_latency_max:
+			self.emg_latency_max = latency
+		for h in self.emg_block_handlers:
+			h(block, stamps)
+
+	def emg_stats(self):
+		"""返回EMG序列统计(通知数, 采样数, 断档, 丢失, 重复)和块交付延迟(秒)"""
+		stats = self.emg_seq.stats()
+		n = self.emg_latency_count
+		stats['latency_mean'] = self.emg_latency_sum / n if n else 0.0
+		stats['latency_max'] = self.emg_latency_max
+		stats['stale'] = self.emg_stale
+		return stats
+
+	def on_emg_mode(self, mode, rate, dtype):
+		"""EMG模式回调"""
+		for h in self.emg_mode_handlers:
+			h(mode, rate, dtype)
+
 	def on_imu(self, quat, acc, gyro):
 		"""IMU数据回调"""
 		for h in self.imu_handlers:
@@ -617,6 +2325,11 @@ class Myo(object):
 		for h in self.battery_handlers:
 			h(battery_level)
 
+	def on_disconnect(self, reason):
+		"""连接意外断开回调"""
+		for h in self.disconnect_handlers:
+			h(reason)
+
 if __name__ == '__main__':
 	m = Myo(sys.argv[1] if len(sys.argv) >= 2 else None, mode=emg_mode.RAW)
 
@@ -0,0 +1,342 @@
+#synthetic_myo.py
+"""
+合成Myo设备
+
+SyntheticBT代替蓝牙适配器交给Myo(bt=...)使用: 不经过串口, 把data/vals{0..9}.dat中的
+预处理EMG采样(或按其拟合的高斯混合模型生成的采样)按手势计划表作为0x27属性值事件分发,
+速率可为50Hz的任意倍数。Myo及其子类(MyoClassifier等)的add_emg_handler/run()接口不变,
+可在不佩戴臂环的情况下测量分类吞吐量并用已知标签检查准确率。
+
+用法:
+	m = Myo(bt=SyntheticBT(speed=100))
+	m.connect()
+	while True:
+		m.run()
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from device.pyomyo import MYO_SERVICE, Dispatcher, EventWaiters, Packet, Throughput, pack
+
+SYNTHETIC_ADDR = [0x53, 0x59, 0x4e, 0x4d, 0x59, 0x4f]	# 合成设备的MAC地址
+SYNTHETIC_FIRMWARE = (1, 5, 1970, 2)					# 合成设备报告的固件版本
+
+
+def load_gestures(path='data'):
+	"""读取vals{0..9}.dat, 返回{手势: (N, 8)的uint16数组}, 跳过空文件"""
+	gestures = {}
+	for i in range(10):
+		file_path = os.path.join(path, 'vals%d.dat' % i)
+		if not os.path.exists(file_path):
+			continue
+		data = np.fromfile(file_path, dtype='<u2')
+		data = data[:data.size - data.size % 8].reshape(-1, 8)
+		if len(data):
+			gestures[i] = data
+	return gestures
+
+
+class ReplaySource(object):
+	"""按顺序循环回放各手势的采样"""
+	def __init__(self, gestures):
+		self.gestures = gestures
+		self.pos = dict.fromkeys(gestures, 0)
+
+	def take(self, label, n):
+		"""取n个手势label的采样"""
+		data = self.gestures[label]
+		idx = (self.pos[label] + np.arange(n)) % len(data)
+		self.pos[label] = int(idx[-1] + 1) % len(data)
+		return data[idx]
+
+
+class MixtureSource(object):
+	"""按各手势拟合的对角高斯混合模型生成采样
+
+	每个手势用k-means划分为components个簇, 每簇用均值和各通道标准差描述,
+	按簇大小加权抽样, 生成的采样与训练数据不重复, 准确率更接近真实情况。
+	"""
+	def __init__(self, gestures, components=4, iterations=10, seed=0):
+		self.rng = np.random.default_rng(seed)
+		self.models = {}
+		for label, data in gestures.items():
+			self.models[label] = self.fit(data.astype(np.float64), components, iterations)
+
+	def fit(self, x, components, iterations):
+		"""k-means拟合, 返回(权重, 均值, 标准差)"""
+		k = min(components, len(x))
+		centers = x[self.rng.choice(len(x), k, replace=False)]
+		for _ in range(iterations):
+			assign = ((x[:, None, :] - centers[None]) ** 2).sum(2).argmin(1)
+			for j in range(k):
+				if np.any(assign == j):
+					centers[j] = x[assign == j].mean(0)
+		weights = np.bincount(assign, minlength=k) / len(x)
+		stds = np.array([x[assign == j].std(0) if np.any(assign == j) else np.zeros(8) for j in range(k)])
+		return weights, centers, stds
+
+	def take(self, label, n):
+		"""生成n个手势label的采样"""
+		weights, centers, stds = self.models[label]
+		comp = self.rng.choice(len(weights), n, p=weights)
+		x = centers[comp] + self.rng.standard_normal((n, 8)) * stds[comp]
+		return np.clip(np.rint(x), 0, 65535).astype('<u2')
+
+
+class SyntheticBT(Dispatcher, EventWaiters):
+	"""合成的蓝牙适配器
+
+	实现Myo用到的BT接口(连接、属性读写、事件等待、dispatch)。连接后只要0x28(预处理EMG)
+	已开启, dispatch()就按rate * speed的速率生成0x27属性值事件, 落后于计划时一次补发
+	(每次最多max_batch个), lag/max_lag记录落后的采样数, 用于判断处理能否跟上。
+	事件时间为采样的计划时间, 由采样时间戳可以用label_at()查到其手势标签。
+	"""
+	def __init__(self, path='data', source='replay', schedule=None, segment=2.0, rate=50, speed=1.0,
+				 max_batch=1024, seed=0):
+		"""
+		参数:
+			path: 训练数据目录
+			source: 'replay'回放原始采样, 'mixture'按高斯混合模型生成
+			schedule: [(手势, 持续时间(秒, 按50Hz实时计)), ...], 循环执行; None时依次每个手势segment秒
+			rate: 实时采样率(Hz)
+			speed: 相对实时的倍数
+			max_batch: dispatch()每次最多生成的采样数
+		"""
+		Dispatcher.__init__(self)
+		EventWaiters.__init__(self)
+		gestures = load_gestures(path)
+		if not gestures:
+			raise ValueError('no gesture data in %s' % path)
+		if source == 'replay':
+			self.source = ReplaySource(gestures)
+		elif source == 'mixture':
+			self.source = MixtureSource(gestures, seed=seed)
+		else:
+			raise ValueError('unknown synthetic source: %s' % source)
+		if schedule is None:
+			schedule = [(label, segment) for label in sorted(gestures)]
+		for label, _ in schedule:
+			if label not in gestures:
+				raise ValueError('no data for gesture %d' % label)
+		# 计划表按采样编号展开: 每段的(结束编号, 手势)
+		self.schedule = []
+		end = 0
+		for label, duration in schedule:
+			end += max(1, int(round(duration * rate)))
+			self.schedule.append((end, label))
+		self.period = end				# 计划表一轮的采样数
+		self.sample_rate = rate * speed	# 实际生成速率(采样/秒)
+		self.max_batch = max_batch
+		self.throughput = Throughput()
+		self.events = deque()			# 待分发的非数据事件(扫描响应)
+		self.conn = None				# 当前连接句柄
+		self.enabled = set()			# 已开启通知的特性(CCCD句柄)
+		self.start_time = None			# 开始生成的时间
+		self.emitted = 0				# 已生成的采样数
+		self.lag = 0					# 上次dispatch时落后于计划的采样数
+		self.max_lag = 0
+		self.running = True
+
+	def label_of(self, index):
+		"""第index个采样的手势"""
+		pos = index % self.period
+		for end, label in self.schedule:
+			if pos < end:
+				return label
+		return self.schedule[-1][1]
+
+	def label_at(self, stamp):
+		"""时间戳stamp(time.monotonic)对应采样的手势, 尚未开始生成时返回None"""
+		if self.start_time is None or stamp < self.start_time:
+			return None
+		return self.label_of(int(round((stamp - self.start_time) * self.sample_rate)))
+
+	# Myo用到的BT接口
+	def dispatch(self, timeout=None):
+		"""生成计划到期的采样并分发, 无到期采样时最多等待timeout秒"""
+		if self.events:
+			self.recv_packet(0)
+			return 1
+		if not self.streaming():
+			if timeout:
+				time.sleep(timeout)
+			return 0
+		now = time.monotonic()
+		if self.start_time is None:
+			self.start_time = now
+		due = int((now - self.start_time) * self.sample_rate) + 1 - self.emitted
+		if due <= 0:
+			wait = (self.emitted - (now - self.start_time) * self.sample_rate) / self.sample_rate
+			if timeout is not None:
+				wait = min(wait, timeout)
+			time.sleep(max(wait, 0.0))
+			return 0
+		self.lag = due
+		self.max_lag = max(self.max_lag, due)
+		return self.emit(min(due, self.max_batch))
+
+	def streaming(self):
+		"""是否正在生成EMG采样"""
+		return self.running and self.conn is not None and 0x28 in self.enabled
+
+	def emit(self, n):
+		"""生成n个采样, 按计划表分段取样后逐个作为0x27属性值事件分发(时间为计划时间)"""
+		header = pack('4BBHBB', 0x80, 22, 4, 5, self.conn, 0x27, 1, 17)
+		period = 1.0 / self.sample_rate
+		i = 0
+		while i < n:
+			index = self.emitted + i
+			pos = index % self.period
+			end = next(e for e, _ in self.schedule if pos < e)
+			count = min(n - i, end - pos)
+			rows = self.source.take(self.label_of(index), count)
+			for j, row in enumerate(rows):
+				t = self.start_time + (index + j) * period
+				self.handle_event(Packet(header + row.tobytes() + b'\x00', t))
+			i += count
+		self.emitted += n
+		self.throughput.add(n * 26, n)
+		return n
+
+	def recv_packet(self, timeout=None):
+		"""取出一个非数据事件并交给处理器, 超时返回None"""
+		if not self.events:
+			if timeout:
+				time.sleep(timeout)
+			return None
+		p = self.events.popleft()
+		self.handle_event(p)
+		return p
+
+	def post_event(self, cls, cmd, payload):
+		"""产生一个事件: 先交给等待者, 否则放入事件队列"""
+		p = Packet(pack('4B', 0x80, len(payload), cls, cmd) + payload, time.monotonic())
+		if not self.take_event(p):
+			self.events.append(p)
+
+	def response(self, cls, cmd, payload=b''):
+		"""构造响应包"""
+		return Packet(pack('4B', 0, len(payload), cls, cmd) + payload, time.monotonic())
+
+	def end_scan(self):
+		"""停止扫描"""
+		return self.response(6, 4, pack('H', 0))
+
+	def discover(self):
+		"""开始扫描: 立即产生合成设备的扫描响应"""
+		self.post_event(6, 0, pack('bB6sBB', -50, 0, bytes(SYNTHETIC_ADDR), 0, 0xff) +
+						pack('B', len(MYO_SERVICE)) + MYO_SERVICE)
+		return self.response(6, 2, pack('H', 0))
+
+	def connect(self, addr, interval_min=6, interval_max=6, timeout=64, latency=0):
+		"""连接合成设备(任意地址), 随后产生连接状态事件"""
+		self.conn = 0
+		self.enabled = set()
+		self.start_time = None
+		self.post_event(3, 0, pack('BB6sBHHHB', 0, 5, bytes(addr), 0, interval_min, timeout, latency, 0xff))
+		return self.response(6, 3, pack('HB', 0, self.conn))
+
+	def update_connection(self, conn, interval_min, interval_max, timeout, latency):
+		"""修改连接参数, 随后产生带参数变化标志的连接状态事件"""
+		if conn != self.conn:
+			return self.response(3, 2, pack('BH', conn, 0x0186))
+		self.post_event(3, 0, pack('BB6sBHHHB', conn, 0x09, bytes(SYNTHETIC_ADDR), 0, interval_max, timeout,
+								   latency, 0xff))
+		return self.response(3, 2, pack('BH', conn, 0))
+
+	def disconnect(self, h):
+		"""断开连接"""
+		if h != self.conn:
+			return self.response(3, 0, pack('BH', h, 0x0186))	# 未连接
+		self.conn = None
+		return self.response(3, 0, pack('BH', h, 0))
+
+	def disconnect_wait(self, h, timeout=None):
+		"""断开连接(不产生断开事件), 该句柄未连接时返回False"""
+		if h != self.conn:
+			return False
+		self.disconnect(h)
+		return True
+
+	def read_attr_async(self, con, attr, timeout=None):
+		"""读取属性, 返回已完成的Future"""
+		if attr == 0x17:
+			val = pack('4H', *SYNTHETIC_FIRMWARE)
+		elif attr == 0x03:
+			val = b'Synthetic Myo'
+		else:
+			val = b''
+		p = Packet(pack('4BBHBB', 0x80, 5 + len(val), 4, 5, con, attr, 0, len(val)) + val, time.monotonic())
+		fut = Future()
+		fut.set_result(p)
+		return fut
+
+	def write_attr_async(self, con, attr, val, timeout=None):
+		"""写入属性, 返回已完成的Future; 记录CCCD的开关"""
+		if attr in (0x12, 0x1d, 0x24, 0x28, 0x2c, 0x2f, 0x32, 0x35):
+			if val == b'\x00\x00':
+				self.enabled.discard(attr)
+			else:
+				self.enabled.add(attr)
+		fut = Future()
+		fut.set_result(Packet(pack('4BBHH', 0x80, 5, 4, 1, con, 0, attr), time.monotonic()))
+		return fut
+
+	def read_attr(self, con, attr, timeout=None):
+		"""读取属性"""
+		return self.read_attr_async(con, attr, timeout).result()
+
+	def write_attr(self, con, attr, val, timeout=None):
+		"""写入属性"""
+		return self.write_attr_async(con, attr, val, timeout).result()
+
+	def stats(self):
+		"""生成统计"""
+		return {'emitted': self.emitted, 'lag': self.lag, 'max_lag': self.max_lag,
+				'sample_rate': self.sample_rate}
+
+	def close(self):
+		"""停止生成"""
+		self.running = False
+		self.conn = None
+
+
+def create_bt(source=None, **kwargs):
+	"""设备工厂: 按数据源返回蓝牙实例
+
+	source为None或'myo'时返回None(由Myo打开真实适配器), 'replay'/'mixture'时返回SyntheticBT。
+	"""
+	if source in (None, '', 'myo'):
+		return None
+	return SyntheticBT(source=source, **kwargs)
+
+
+if __name__ == '__main__':
+	import sys
+
+	from device.pyomyo import Myo, emg_mode
+
+	speed = float(sys.argv[1]) if len(sys.argv) >= 2 else 1.0
+	m = Myo(bt=SyntheticBT(speed=speed), mode=emg_mode.PREPROCESSED)
+	samples = [0]
+
+	def on_block(block, stamps):
+		samples[0] += len(block)
+
+	m.add_emg_block_handler(on_block)
+	m.connect()
+	last = time.monotonic()
+	try:
+		while True:
+			m.run()
+			now = time.monotonic()
+			if now - last >= 1.0:
+				print('%.0f samples/s' % (samples[0] / (now - last)), m.bt.stats())
+				samples[0] = 0
+				last = now
+	except KeyboardInterrupt:
+		m.close()
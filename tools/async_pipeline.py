@@ -0,0 +1,74 @@
+#async_pipeline.py
+"""
+单事件循环的采集-分类-UDP输出流水线
+
+AsyncMyo的EMG数据块、KNN分类和UDP手势发送运行在同一个asyncio事件循环中,
+与GestureRecognitionThread的多线程方案对比CPU占用。KNN训练数据是预处理后的uint16特征,
+因此只使用PREPROCESSED模式(RAW模式的int8采样不能直接分类)。
+
+用法(在项目根目录下):
+    python -m tools.async_pipeline
+"""
+import argparse
+import asyncio
+import time
+from collections import deque
+
+import numpy as np
+
+from config import MYO_TTY, MYO_CACHE_FILE, MYO_CONN_PROFILE, UDP_IP, UDP_PORT, SEND_FREQ
+from core.knn_cpp import KNNClassifier
+from device.myo_async import AsyncMyo
+from device.pyomyo import emg_mode
+
+
+async def classify_loop(myo, classifier, state, interval=0.1, hist_len=25):
+    """对每个数据块的最新采样分类, 用历史投票平滑"""
+    history = deque([0] * hist_len, hist_len)
+    counts = np.zeros(10, dtype=np.int32)
+    counts[0] = hist_len
+    last = 0.0
+    async for block, stamps in myo.emg_stream():
+        now = time.monotonic()
+        if now - last < interval:
+            continue
+        last = now
+        gesture_id, confidence = classifier.classify(block[-1].astype(np.uint16))
+        counts[history[0]] -= 1
+        counts[gesture_id] += 1
+        history.append(gesture_id)
+        state['gesture'] = int(np.argmax(counts))
+
+
+async def send_loop(state):
+    """按SEND_FREQ通过UDP发送当前手势"""
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        asyncio.DatagramProtocol, remote_addr=(UDP_IP, UDP_PORT))
+    try:
+        while True:
+            transport.sendto(bytes([max(0, min(255, state['gesture']))]))
+            await asyncio.sleep(1.0 / SEND_FREQ)
+    finally:
+        transport.close()
+
+
+async def main():
+    classifier = KNNClassifier()
+    classifier.load_data("data")
+    myo = AsyncMyo(MYO_TTY, mode=emg_mode.PREPROCESSED, cache=MYO_CACHE_FILE)
+    await myo.connect(profile=MYO_CONN_PROFILE)
+    state = {'gesture': 0}
+    try:
+        await asyncio.gather(classify_loop(myo, classifier, state), send_loop(state))
+    finally:
+        await myo.disconnect()
+        myo.close()
+
+
+if __name__ == '__main__':
+    argparse.ArgumentParser(description='单事件循环的采集-分类-UDP输出流水线').parse_args()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
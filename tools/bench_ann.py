@@ -0,0 +1,100 @@
+#bench_ann.py
+"""
+近似近邻(pq)的召回率、准确率与延迟报告
+
+1. data/*.dat: 每个手势前70%的样本训练、后30%测试, 比较brute/kdtree/pq(不同编码字节数和probes)的
+   测试准确率、相对brute的近邻召回率(recall@k)、每个查询的耗时和内存占用。
+2. 合并数据集: 按bench_knn的方法把data/*.dat重采样到更大规模, 用加噪声的查询测量同样的指标。
+
+用法(在项目根目录下):
+    python -m tools.bench_ann [--sizes 150000,1500000] [--probes 1,2,4,8,16,32] [--pq-bytes 8,4] [--lib core/libknn.so]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from core.knn_cpp import KNNClassifier
+from tools.bench_knn import load_sources, make_dataset
+
+
+def split_data(path, train_ratio=0.7):
+    """把data/*.dat按时间顺序切分, 训练部分写入path, 返回(测试样本, 测试标签)"""
+    queries, labels = [], []
+    for gesture_id, src in load_sources().items():
+        cut = int(len(src) * train_ratio)
+        src[:cut].astype(np.uint16).tofile(os.path.join(path, 'vals%d.dat' % gesture_id))
+        queries.append(src[cut:].astype(np.uint16))
+        labels.append(np.full(len(src) - cut, gesture_id))
+    return np.concatenate(queries), np.concatenate(labels)
+
+
+def evaluate(classifier, queries, labels, reference):
+    """返回(准确率或None, recall@k, 每个查询的耗时us)"""
+    t0 = time.perf_counter()
+    predictions, _ = classifier.classify_batch(queries)
+    per_query = (time.perf_counter() - t0) / len(queries) * 1e6
+    found = classifier.neighbors(queries)
+    recall = np.mean([len(set(a[a >= 0]) & set(e[e >= 0])) / max(1, (e >= 0).sum())
+                      for a, e in zip(found, reference)])
+    accuracy = None if labels is None else float((predictions == labels).mean())
+    return accuracy, float(recall), per_query
+
+
+def report(title, path, queries, labels, args, max_samples=0):
+    """对path中的训练数据比较各搜索方式"""
+    print('\n== %s: %d个查询, k=%d' % (title, len(queries), args.k))
+    print('%8s %7s %10s %9s %12s %11s %9s' % ('index', 'probes', 'accuracy', 'recall', 'us/query', 'memory/KB',
+                                              'build/s'))
+    reference = None
+    configs = [('brute', 0, None), ('kdtree', 0, None)]
+    configs += [('pq%d' % int(b), int(b), int(p)) for b in args.pq_bytes.split(',') for p in args.probes.split(',')]
+    built = {}
+    for name, pq_bytes, probes in configs:
+        if name in built:
+            classifier, build = built[name], 0.0
+        else:
+            t0 = time.perf_counter()
+            classifier = KNNClassifier(k=args.k, max_samples=max_samples, lib_path=args.lib, verbose=False,
+                                       index='pq' if pq_bytes else name, pq_bytes=pq_bytes or 8)
+            classifier.load_data(path)
+            build = time.perf_counter() - t0
+            built[name] = classifier
+        if probes is not None:
+            classifier.set_probes(probes)
+        if reference is None:
+            reference = classifier.neighbors(queries)
+        accuracy, recall, per_query = evaluate(classifier, queries, labels, reference)
+        print('%8s %7s %10s %9.3f %12.1f %11.0f %9s' % (
+            name, '-' if probes is None else probes, '-' if accuracy is None else '%.1f%%' % (accuracy * 100),
+            recall, per_query, classifier.memory_bytes() / 1024, '-' if not build else '%.2f' % build))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='近似近邻的召回率、准确率与延迟报告')
+    parser.add_argument('--sizes', default='150000,1500000', help='合并数据集的样本总数, 逗号分隔(空为不测)')
+    parser.add_argument('--probes', default='1,2,4,8,16,32', help='pq扫描的倒排列表数, 逗号分隔')
+    parser.add_argument('--pq-bytes', default='8,4', help='pq每个样本的编码字节数(4或8), 逗号分隔')
+    parser.add_argument('--lib', default='core/libknn.so', help='KNN共享库路径')
+    parser.add_argument('--k', type=int, default=5, help='KNN的K值')
+    parser.add_argument('--noise', type=int, default=20, help='合并数据集查询的噪声幅度')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        queries, labels = split_data(path)
+        report('data/ 70%训练/30%测试', path, queries, labels, args)
+
+    rng = np.random.default_rng(1)
+    for total in (int(s) for s in args.sizes.split(',') if s):
+        with tempfile.TemporaryDirectory() as path:
+            per_class, queries = make_dataset(path, total)
+            noisy = queries.astype(np.int32) + rng.integers(-args.noise, args.noise + 1, queries.shape)
+            queries = np.clip(noisy, 0, 65535).astype(np.uint16)
+            labels = np.repeat(sorted(load_sources()), len(queries) // len(load_sources()))
+            report('合并数据集 %d个样本' % total, path, queries, labels, args, per_class)
+
+
+if __name__ == '__main__':
+    main()
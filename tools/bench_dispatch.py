@@ -0,0 +1,125 @@
+#bench_dispatch.py
+"""
+事件分发微基准
+
+将一段数据包流分别送入旧的if/elif分发(每包重新解析格式字符串)和
+按(cls, cmd, attr)索引的分发表, 比较每包耗时。
+
+用法(在项目根目录下):
+    python -m tools.bench_dispatch [--packets N] [--repeat R]
+"""
+import argparse
+import random
+import struct
+import time
+
+from device.pyomyo import (Arm, Dispatcher, Myo, Packet, Pose, XDirection,
+                           emg_mode, pack, unpack)
+
+
+def make_stream(n):
+    """生成RAW模式+IMU的数据包流(4个EMG特性轮流, IMU占1/5, 偶尔电池)"""
+    rng = random.Random(0)
+    frames = []
+    emg_attrs = (0x2b, 0x2e, 0x31, 0x34)
+    for i in range(n):
+        if i % 5 == 4:
+            attr, data = 0x1c, pack('10h', *(rng.randrange(-2000, 2000) for _ in range(10)))
+        elif i % 1000 == 999:
+            attr, data = 0x11, pack('B', 90)
+        else:
+            attr, data = emg_attrs[i % 4], bytes(rng.randrange(256) for _ in range(16))
+        payload = pack('BHBB', 0, attr, 1, len(data)) + data
+        frames.append(Packet(pack('4B', 0x80, len(payload), 4, 5) + payload, i * 0.002))
+    return frames
+
+
+def old_handler(m):
+    """基线版本的handle_data(if/elif链, 每包解析格式字符串)"""
+    def handle_data(p):
+        if (p.cls, p.cmd) != (4, 5):
+            return
+
+        c, attr, typ = unpack('BHB', p.payload[:4])
+        pay = p.payload[5:]
+
+        if attr == 0x27:
+            vals = unpack('8HB', pay)
+            m.on_emg(vals[:8], vals[8])
+        elif attr == 0x2b or attr == 0x2e or attr == 0x31 or attr == 0x34:
+            # 与新路径做相同的时间戳和丢包统计, 差异只来自分发和解包
+            if m.emg_seq.stamp(attr, pay[:16], p.time) is None:
+                return
+            emg1 = struct.unpack('<8b', pay[:8])
+            emg2 = struct.unpack('<8b', pay[8:])
+            m.on_emg(emg1, 0)
+            m.on_emg(emg2, 0)
+        elif attr == 0x1c:
+            vals = unpack('10h', pay)
+            m.on_imu(vals[:4], vals[4:7], vals[7:10])
+        elif attr == 0x23:
+            typ, val, xdir, _, _, _ = unpack('6B', pay)
+            if typ == 1:
+                m.on_arm(Arm(val), XDirection(xdir))
+            elif typ == 2:
+                m.on_arm(Arm.UNKNOWN, XDirection.UNKNOWN)
+            elif typ == 3:
+                m.on_pose(Pose(val))
+        elif attr == 0x11:
+            m.on_battery(ord(pay))
+        else:
+            print('data with unknown attr: %02X %s' % (attr, p))
+    return handle_data
+
+
+def run(dispatcher, m, stream, repeat):
+    """返回最快一轮的每包耗时(微秒)"""
+    best = float('inf')
+    for _ in range(repeat):
+        m.emg_seq.reset()
+        start = time.perf_counter()
+        for p in stream:
+            dispatcher.handle_event(p)
+        best = min(best, time.perf_counter() - start)
+    return best / len(stream) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='事件分发微基准')
+    parser.add_argument('--packets', type=int, default=20000, help='数据包数量')
+    parser.add_argument('--repeat', type=int, default=5, help='重复轮数')
+    args = parser.parse_args()
+
+    stream = make_stream(args.packets)
+    counts = {'emg': 0, 'imu': 0}
+
+    def on_emg(emg, moving):
+        counts['emg'] += 1
+
+    def on_imu(quat, acc, gyro):
+        counts['imu'] += 1
+
+    # 旧分发: BT.handlers列表 + if/elif链
+    old = Dispatcher()
+    m_old = Myo(mode=emg_mode.RAW, bt=old)
+    m_old.add_emg_handler(on_emg)
+    m_old.add_imu_handler(on_imu)
+    old.add_handler(old_handler(m_old))
+
+    # 新分发: (cls, cmd, attr)索引 + 预编译解包器
+    new = Dispatcher()
+    m_new = Myo(mode=emg_mode.RAW, bt=new)
+    m_new.add_emg_handler(on_emg)
+    m_new.add_imu_handler(on_imu)
+    m_new.conn = 0
+    m_new.subscribe_data()
+
+    t_old = run(old, m_old, stream, args.repeat)
+    t_new = run(new, m_new, stream, args.repeat)
+    print(f'数据包: {len(stream)}, 重复: {args.repeat}')
+    print(f'旧分发: {t_old:.3f} us/包')
+    print(f'新分发: {t_new:.3f} us/包 (加速 {t_old / t_new:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
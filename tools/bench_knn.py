@@ -0,0 +1,107 @@
+#bench_knn.py
+"""
+KNN分类延迟测试
+
+按data/*.dat的样本重采样(加少量噪声)生成不同规模的训练集, 分别加载到KNNClassifier,
+测量单次classify的延迟(含ctypes调用开销), 以及classify_batch一次分类全部查询时平均每个查询的耗时。
+用--lib指定不同版本的libknn.so即可对比(旧版本的库没有批量接口时跳过批量测试),
+用--index比较逐个比较(brute)和KD树(kdtree), 用--threads比较不同的分类线程数。
+
+用法(在项目根目录下):
+    python -m tools.bench_knn [--sizes 15000,150000,1500000] [--lib core/libknn.so] [--index brute,kdtree] [--threads 1,4]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from core.knn_cpp import KNNClassifier
+
+
+def load_sources():
+    """读取data/*.dat中有样本的手势, 返回{手势ID: (N, 8) int32数组}"""
+    sources = {}
+    for gesture_id in range(10):
+        path = 'data/vals%d.dat' % gesture_id
+        if not os.path.exists(path):
+            continue
+        src = np.fromfile(path, dtype=np.uint16)
+        if src.size >= 8:
+            sources[gesture_id] = src[:src.size // 8 * 8].reshape(-1, 8).astype(np.int32)
+    return sources
+
+
+def make_dataset(path, total, seed=0):
+    """在path下生成共约total个样本的vals*.dat(各手势样本数相同), 返回(每个手势的样本数, 查询样本)"""
+    rng = np.random.default_rng(seed)
+    sources = load_sources()
+    per_class = total // len(sources)
+    queries = []
+    for gesture_id, src in sources.items():
+        rows = src[rng.integers(0, len(src), per_class)] + rng.integers(-3, 4, (per_class, 8))
+        np.clip(rows, 0, 65535).astype(np.uint16).tofile(os.path.join(path, 'vals%d.dat' % gesture_id))
+        queries.append(src[rng.integers(0, len(src), 20)].astype(np.uint16))
+    return per_class, np.concatenate(queries)
+
+
+def bench(lib, total, k, repeat, index='brute', threads=1):
+    """返回(中位延迟us, 最小延迟us, 批量分类每个查询的耗时us或None, 预测结果)"""
+    with tempfile.TemporaryDirectory() as path:
+        per_class, queries = make_dataset(path, total)
+        classifier = KNNClassifier(k=k, max_samples=per_class, lib_path=lib, verbose=False, index=index,
+                                   threads=threads)
+        classifier.load_data(path)
+    times = []
+    predictions = []
+    for _ in range(repeat):
+        for q in queries:
+            t0 = time.perf_counter()
+            gesture_id, _ = classifier.classify(q)
+            times.append(time.perf_counter() - t0)
+            predictions.append(gesture_id)
+    times = np.array(times) * 1e6
+
+    batch = None
+    if classifier.has_batch:
+        batch_queries = np.tile(queries, (repeat, 1))
+        out = (np.empty(len(batch_queries), dtype=np.int32), np.empty(len(batch_queries), dtype=np.float32))
+        t0 = time.perf_counter()
+        batch_predictions, _ = classifier.classify_batch(batch_queries, *out)
+        batch = (time.perf_counter() - t0) / len(batch_queries) * 1e6
+        if list(batch_predictions) != predictions:
+            print('警告: 批量分类结果与逐个分类不一致')
+    return float(np.median(times)), float(times.min()), batch, predictions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KNN分类延迟测试')
+    parser.add_argument('--sizes', default='15000,150000,1500000', help='训练样本总数, 逗号分隔')
+    parser.add_argument('--lib', default='core/libknn.so', help='KNN共享库路径')
+    parser.add_argument('--k', type=int, default=5, help='KNN的K值')
+    parser.add_argument('--repeat', type=int, default=3, help='每个查询重复次数')
+    parser.add_argument('--index', default='brute', help='近邻搜索方式(brute/kdtree), 逗号分隔')
+    parser.add_argument('--threads', default='1', help='分类线程数(0为全部核心), 逗号分隔')
+    args = parser.parse_args()
+
+    results = []
+    for total in (int(s) for s in args.sizes.split(',')):
+        reference = None
+        for index in args.index.split(','):
+            for threads in (int(t) for t in args.threads.split(',')):
+                median, best, batch, predictions = bench(args.lib, total, args.k, args.repeat, index, threads)
+                if reference is None:
+                    reference = predictions
+                elif predictions != reference:
+                    print('警告: %s(%d线程)的分类结果与第一组不一致' % (index, threads))
+                results.append((total, index, threads, median, best, batch))
+    print('%10s %8s %8s %12s %12s %14s %14s' % ('samples', 'index', 'threads', 'median/us', 'min/us', 'samples/us',
+                                                'batch us/query'))
+    for total, index, threads, median, best, batch in results:
+        print('%10d %8s %8d %12.1f %12.1f %14.1f %14s' % (total, index, threads, median, best, total / median,
+                                                          '-' if batch is None else '%.1f' % batch))
+
+
+if __name__ == '__main__':
+    main()
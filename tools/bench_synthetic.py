@@ -0,0 +1,84 @@
+#bench_synthetic.py
+"""
+合成设备上的分类吞吐量与准确率测试
+
+Myo连接SyntheticBT, 按data/*.dat的手势计划表以不同倍速生成采样, 每个采样都交给
+KNNClassifier.classify_batch分类。生成落后于计划的采样数(lag)在测试期间保持有界即认为该速率可持续,
+准确率按生成时的已知标签统计。
+
+用法(在项目根目录下):
+    python -m tools.bench_synthetic [--source replay|mixture] [--speeds 1,10,50,100] [--seconds 5]
+"""
+import argparse
+import time
+
+from core.knn_cpp import KNNClassifier
+from device.pyomyo import Myo, emg_mode
+from device.synthetic_myo import SyntheticBT
+
+
+def run(classifier, source, speed, seconds, max_lag):
+    """以speed倍速运行seconds秒, 返回统计"""
+    bt = SyntheticBT(source=source, speed=speed, segment=1.0)
+    m = Myo(bt=bt, mode=emg_mode.PREPROCESSED)
+    stats = {'samples': 0, 'correct': 0, 'labeled': 0, 'busy': 0.0}
+
+    def on_block(block, stamps):
+        t0 = time.perf_counter()
+        predictions, _ = classifier.classify_batch(block)
+        for gesture_id, stamp in zip(predictions, stamps):
+            label = bt.label_at(stamp)
+            if label is not None:
+                stats['labeled'] += 1
+                stats['correct'] += int(gesture_id == label)
+        stats['samples'] += len(block)
+        stats['busy'] += time.perf_counter() - t0
+
+    m.add_emg_block_handler(on_block, block_size=max(8, int(speed)))
+    m.connect()
+    start = time.monotonic()
+    warmup = start + min(1.0, seconds / 4)
+    while time.monotonic() - start < seconds:
+        m.run()
+        if time.monotonic() < warmup:
+            bt.max_lag = 0		# 不计启动阶段
+    elapsed = time.monotonic() - start
+    m.close()
+    return {
+        'speed': speed,
+        'target': bt.sample_rate,
+        'rate': stats['samples'] / elapsed,
+        'max_lag': bt.max_lag,
+        'sustained': bt.max_lag <= max_lag,
+        'accuracy': stats['correct'] / stats['labeled'] if stats['labeled'] else 0.0,
+        'per_sample_us': stats['busy'] / stats['samples'] * 1e6 if stats['samples'] else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='合成设备上的分类吞吐量与准确率测试')
+    parser.add_argument('--source', choices=['replay', 'mixture'], default='mixture', help='合成数据源')
+    parser.add_argument('--speeds', default='1,10,50,100,200', help='相对50Hz实时的倍速, 逗号分隔')
+    parser.add_argument('--seconds', type=float, default=5.0, help='每个倍速的运行时间(秒)')
+    parser.add_argument('--max-lag', type=int, default=1000, help='允许落后于计划的最大采样数')
+    parser.add_argument('--lib', default='core/libknn.so', help='KNN共享库路径')
+    parser.add_argument('--k', type=int, default=5, help='KNN的K值')
+    args = parser.parse_args()
+
+    classifier = KNNClassifier(k=args.k, lib_path=args.lib, verbose=False)
+    classifier.load_data('data')
+    print('%8s %10s %10s %8s %10s %9s %10s' % ('speed', 'target/s', 'rate/s', 'max_lag', 'sustained',
+                                               'accuracy', 'us/sample'))
+    best = 0.0
+    for speed in (float(s) for s in args.speeds.split(',')):
+        r = run(classifier, args.source, speed, args.seconds, args.max_lag)
+        if r['sustained']:
+            best = max(best, r['rate'])
+        print('%8g %10.0f %10.0f %8d %10s %8.1f%% %10.1f' % (
+            r['speed'], r['target'], r['rate'], r['max_lag'], r['sustained'],
+            r['accuracy'] * 100, r['per_sample_us']))
+    print('max sustained classification rate: %.0f samples/s (%.1fx real time)' % (best, best / 50.0))
+
+
+if __name__ == '__main__':
+    main()
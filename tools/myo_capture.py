@@ -0,0 +1,292 @@
+#myo_capture.py
+"""
+Myo串口字节流录制与回放
+
+record: 连接真实的Myo, 将BLED112串口接收的原始字节流连同时间戳录制到文件
+replay: 在Linux pty上模拟BLED112适配器, 应答connect()发送的GATT命令,
+        并按录制时的节奏(或N倍速)回放数据通知, 无需硬件即可端到端测试
+
+用法(在项目根目录下):
+    python -m tools.myo_capture record session.cap --seconds 30 --mode raw
+    python -m tools.myo_capture replay session.cap --speed 1 --loop
+    MYO_TTY=<回放打印的pty路径> python3 main.py
+"""
+import argparse
+import os
+import queue
+import select
+import struct
+import threading
+import time
+import tty
+
+from device.pyomyo import (ATTR_HEADER, MYO_SERVICE, FrameParser, Myo,
+                           emg_mode, pack, read_capture)
+
+DATA_ATTRS = (0x27, 0x2b, 0x2e, 0x31, 0x34, 0x1c, 0x23, 0x11)  # 回放的数据特性
+DEFAULT_FIRMWARE = (1, 5, 1970, 2)      # 录制中没有固件版本时使用的新固件版本
+DEFAULT_ADDR = bytes([93, 41, 55, 245, 82, 194])
+
+MODES = {
+    'preprocessed': emg_mode.PREPROCESSED,
+    'filtered': emg_mode.FILTERED,
+    'raw': emg_mode.RAW,
+}
+
+
+def frame(typ, cls, cmd, payload=b''):
+    """构造BLED112帧"""
+    return pack('4B', typ, len(payload), cls, cmd) + payload
+
+
+def load_capture(path):
+    """
+    解析录制文件
+
+    返回:
+        (data, attrs): data为[(相对时间, 数据通知帧)], attrs为录制中读取到的属性值{句柄: 值}
+    """
+    parser = FrameParser()
+    data = []
+    attrs = {}
+    for t, chunk in read_capture(path):
+        parser.feed(chunk)
+        for p in parser.parse(t):
+            if p.typ != 0x80 or (p.cls, p.cmd) != (4, 5):
+                continue
+            _, attr, typ = ATTR_HEADER.unpack_from(p.payload)
+            if attr in DATA_ATTRS:
+                data.append((t, frame(p.typ, p.cls, p.cmd, p.payload)))
+            else:
+                attrs[attr] = p.payload[5:]
+    return data, attrs
+
+
+class VirtualDongle(object):
+    """pty上的虚拟BLED112适配器"""
+
+    def __init__(self, data, attrs, speed=1.0, loop=False, addr=DEFAULT_ADDR, latency=0.0):
+        """
+        参数:
+            data: [(相对时间, 数据通知帧)]
+            attrs: 可读属性值{句柄: 值}
+            speed: 回放倍速
+            loop: 数据回放完后是否从头循环
+            addr: 扫描时报告的Myo MAC地址
+            latency: 每个属性读写过程在空中的耗时(秒), 模拟连接间隔, 0为立即完成
+        """
+        self.data = data
+        self.attrs = dict(attrs)
+        self.attrs.setdefault(0x17, pack('4H', *DEFAULT_FIRMWARE))
+        self.attrs.setdefault(0x03, b'Myo')
+        self.speed = speed
+        self.loop = loop
+        self.addr = addr
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self.lock = threading.Lock()    # 主线程应答与回放线程共用写锁
+        self.conn = None                # 当前连接句柄
+        self.addr_connected = addr      # 当前连接的地址
+        self.enabled = set()            # 已开启通知的数据特性
+        self.running = True
+        self.sent = 0                   # 已回放的数据通知数
+        self.player = None
+        self.latency = latency
+        self.air = queue.Queue()        # 延迟发送的过程结果(到期时间, 帧)
+        self.air_free = 0.0             # 空中链路空闲的时间
+        if latency > 0:
+            threading.Thread(target=self.air_func, daemon=True).start()
+
+    def send(self, data):
+        """向客户端写入"""
+        with self.lock:
+            os.write(self.master, data)
+
+    def complete(self, data):
+        """发送属性读写过程的结果, 有latency时按空中链路逐个延迟"""
+        if self.latency <= 0:
+            self.send(data)
+            return
+        self.air_free = max(time.monotonic(), self.air_free) + self.latency
+        self.air.put((self.air_free, data))
+
+    def air_func(self):
+        """延迟发送线程"""
+        while self.running:
+            due, data = self.air.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if self.running:
+                self.send(data)
+
+    def serve(self):
+        """处理客户端命令, 直到stop()"""
+        parser = FrameParser(specs=None)   # 主机发出的是命令, 不按响应/事件表校验
+        while self.running:
+            r, _, _ = select.select([self.master], [], [], 0.1)
+            if not r:
+                continue
+            try:
+                chunk = os.read(self.master, 4096)
+            except OSError:
+                continue
+            parser.feed(chunk)
+            for p in parser.parse():
+                self.handle_command(p.cls, p.cmd, p.payload)
+
+    def handle_command(self, cls, cmd, payload):
+        """应答一条命令"""
+        ok = b'\x00\x00'
+        if (cls, cmd) == (6, 2):        # 开始扫描
+            self.send(frame(0, cls, cmd, ok))
+            adv = b'\x02\x01\x06\x11' + MYO_SERVICE
+            self.send(frame(0x80, 6, 0, pack('bB6sBBB', -60, 0, self.addr, 0, 0xff, len(adv)) + adv))
+        elif (cls, cmd) == (6, 3):      # 直接连接
+            self.conn = 0
+            self.enabled.clear()
+            self.send(frame(0, cls, cmd, ok + pack('B', self.conn)))
+            addr = payload[:6]
+            _, interval_min, interval_max, timeout, latency = struct.unpack_from('<BHHHH', payload, 6)
+            self.addr_connected = addr
+            self.send(frame(0x80, 3, 0, pack('BB6sBHHHB', self.conn, 0x05, addr, 0,
+                                             interval_max, timeout, latency, 0xff)))
+            self.start_player()
+        elif (cls, cmd) == (3, 2):      # 修改连接参数
+            con, interval_min, interval_max, latency, timeout = struct.unpack_from('<BHHHH', payload)
+            if con != self.conn:
+                self.send(frame(0, cls, cmd, pack('BH', con, 0x0186)))  # 未连接
+                return
+            self.send(frame(0, cls, cmd, pack('B', con) + ok))
+            # 参数在之后的连接事件生效, 状态事件带参数变化标志(0x08)
+            self.complete(frame(0x80, 3, 0, pack('BB6sBHHHB', con, 0x09, self.addr_connected, 0,
+                                                 interval_max, timeout, latency, 0xff)))
+        elif (cls, cmd) == (3, 0):      # 断开连接
+            con = payload[0]
+            if con == self.conn:
+                self.send(frame(0, cls, cmd, pack('B', con) + ok))
+                self.conn = None
+                self.send(frame(0x80, 3, 4, pack('BH', con, 0x0216)))
+            else:
+                self.send(frame(0, cls, cmd, pack('BH', con, 0x0186)))  # 未连接
+        elif (cls, cmd) == (4, 4):      # 读属性
+            con, attr = struct.unpack_from('<BH', payload)
+            self.send(frame(0, cls, cmd, pack('B', con) + ok))
+            val = self.attrs.get(attr, b'')
+            self.complete(frame(0x80, 4, 5, pack('BHBB', con, attr, 0, len(val)) + val))
+        elif (cls, cmd) == (4, 5):      # 写属性
+            con, attr, n = struct.unpack_from('<BHB', payload)
+            val = payload[4:4 + n]
+            self.send(frame(0, cls, cmd, pack('B', con) + ok))
+            if attr - 1 in DATA_ATTRS:  # 写CCCD开启或关闭对应特性的通知
+                if any(val):
+                    self.enabled.add(attr - 1)
+                else:
+                    self.enabled.discard(attr - 1)
+            self.complete(frame(0x80, 4, 1, pack('BHH', con, 0, attr)))
+        elif (cls, cmd) == (0, 6):      # 获取连接数
+            self.send(frame(0, cls, cmd, pack('B', 3)))
+        else:
+            self.send(frame(0, cls, cmd, ok))
+
+    def start_player(self):
+        """连接建立后启动数据回放线程"""
+        if self.player is None or not self.player.is_alive():
+            self.player = threading.Thread(target=self.play, daemon=True)
+            self.player.start()
+
+    def play(self):
+        """按录制时间间隔(除以倍速)回放已开启通知的数据"""
+        if not self.data:
+            return
+        while self.running and self.conn is not None:
+            t0 = self.data[0][0]
+            start = time.monotonic()
+            for t, f in self.data:
+                conn = self.conn
+                if not self.running or conn is None:
+                    return
+                delay = start + (t - t0) / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if ATTR_HEADER.unpack_from(f, 4)[1] not in self.enabled:
+                    continue
+                self.send(f[:4] + pack('B', conn) + f[5:])
+                self.sent += 1
+            if not self.loop:
+                return
+
+    def drop(self, reason=0x0208):
+        """模拟连接意外断开(默认原因为监督超时)"""
+        con, self.conn = self.conn, None
+        if con is not None:
+            self.send(frame(0x80, 3, 4, pack('BH', con, reason)))
+
+    def stop(self):
+        """停止服务"""
+        self.running = False
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def record(args):
+    """连接真实Myo并录制串口字节流"""
+    m = Myo(args.tty, mode=MODES[args.mode], capture=args.file)
+    m.connect()
+    print(f'录制到 {args.file}, 持续 {args.seconds} 秒...')
+    end = time.monotonic() + args.seconds
+    try:
+        while time.monotonic() < end:
+            m.run()
+    except KeyboardInterrupt:
+        pass
+    bps, pps = m.bt.throughput.total_rate()
+    print(f'录制完成: {m.bt.throughput.bytes} 字节, {bps:.0f} B/s, {pps:.0f} 包/s')
+    m.disconnect()
+    m.close()
+
+
+def replay(args):
+    """在pty上回放录制文件"""
+    data, attrs = load_capture(args.file)
+    if not data:
+        print(f'警告: {args.file} 中没有数据通知')
+    dongle = VirtualDongle(data, attrs, speed=args.speed, loop=args.loop, latency=args.latency)
+    print(f'虚拟适配器: {dongle.path} ({len(data)} 个数据通知, {args.speed}x)')
+    print(f'例如: MYO_TTY={dongle.path} python3 main.py')
+    try:
+        dongle.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f'已回放 {dongle.sent} 个数据通知')
+        dongle.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Myo串口字节流录制与回放')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('record', help='录制真实Myo的串口字节流')
+    p.add_argument('file', help='录制文件')
+    p.add_argument('--tty', default=None, help='适配器串口(默认自动检测)')
+    p.add_argument('--mode', choices=sorted(MODES), default='raw', help='EMG模式')
+    p.add_argument('--seconds', type=float, default=30.0, help='录制时长(秒)')
+    p.set_defaults(func=record)
+
+    p = sub.add_parser('replay', help='在pty上回放录制文件')
+    p.add_argument('file', help='录制文件')
+    p.add_argument('--speed', type=float, default=1.0, help='回放倍速')
+    p.add_argument('--loop', action='store_true', help='循环回放')
+    p.add_argument('--latency', type=float, default=0.0,
+                   help='每个属性读写过程的模拟耗时(秒), 如0.0075模拟7.5ms连接间隔')
+    p.set_defaults(func=replay)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()